@@ -0,0 +1,112 @@
+"""Per-record cost of encoding and decoding brrr's wire records.
+
+Compares brrr.wire to plain bencodepy, which it replaced:
+
+    python bench/bench_wire.py
+
+"""
+
+import dataclasses
+import timeit
+from collections.abc import Callable
+from typing import Any
+
+import bencodepy
+from brrr import wire
+from brrr.store import PendingReturns
+from brrr.tagged_tuple import PendingReturn, ScheduleMessage, TaggedTuple
+
+_bc = bencodepy.Bencode(encoding="utf-8")
+
+msg = ScheduleMessage(root_id="Zq3v9xYp1J2mRk8sT0aWbA", call_hash="a" * 64)
+prs = PendingReturns(
+    1700000000,
+    {
+        PendingReturn("Zq3v9xYp1J2mRk8sT0aWbA", f"{i:064}", "brrr-topic")
+        for i in range(3)
+    },
+)
+task_name, payload = "my_task", b"\x80\x05" + b"x" * 200
+
+
+# The way these were encoded before brrr.wire
+
+
+def astuple(x: TaggedTuple) -> tuple[Any, ...]:
+    return (x.tag,) + dataclasses.astuple(x)
+
+
+def prs_bencodepy() -> bytes:
+    x: bytes = _bc.encode(
+        {
+            "returns": sorted(map(astuple, prs.returns)),
+            "scheduled_at": prs.scheduled_at,
+        }
+    )
+    return x
+
+
+msg_enc = msg.encode()
+prs_enc = prs.encode()
+call_enc = wire.encode_call(task_name, payload)
+
+
+def prs_bencodepy_decode() -> PendingReturns:
+    decoded = _bc.decode(prs_enc)
+    return PendingReturns(
+        decoded.get("scheduled_at"),
+        set(map(PendingReturn.fromtuple, decoded["returns"])),
+    )
+
+
+def call_bencodepy_decode() -> tuple[str, bytes]:
+    decoded = bencodepy.decode(call_enc)
+    return decoded[b"task_name"].decode("utf-8"), decoded[b"payload"]
+
+
+CASES: list[tuple[str, Callable[[], object], Callable[[], object]]] = [
+    (
+        "ScheduleMessage encode",
+        lambda: _bc.encode(astuple(msg)),
+        msg.encode,
+    ),
+    (
+        "ScheduleMessage decode",
+        lambda: ScheduleMessage.fromtuple(_bc.decode(msg_enc)),
+        lambda: ScheduleMessage.decode(msg_enc),
+    ),
+    ("PendingReturns encode", prs_bencodepy, prs.encode),
+    (
+        "PendingReturns decode",
+        prs_bencodepy_decode,
+        lambda: PendingReturns.decode(prs_enc),
+    ),
+    (
+        "Call encode",
+        lambda: bencodepy.encode(
+            {b"task_name": task_name.encode(), b"payload": payload}
+        ),
+        lambda: wire.encode_call(task_name, payload),
+    ),
+    (
+        "Call decode",
+        call_bencodepy_decode,
+        lambda: wire.decode_call(call_enc),
+    ),
+]
+
+
+def per_record_us(f: Callable[[], object]) -> float:
+    n, _ = timeit.Timer(f).autorange()
+    return min(timeit.repeat(f, number=n, repeat=5)) / n * 1e6
+
+
+def main() -> None:
+    print(f"{'record':<24} {'bencodepy':>10} {'wire':>10} {'speedup':>8}")
+    for name, old, new in CASES:
+        a, b = per_record_us(old), per_record_us(new)
+        print(f"{name:<24} {a:>8.2f}µs {b:>8.2f}µs {a / b:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,12 @@ from .app import (
 from .app import (
     handler_no_arg as handler_no_arg,
 )
+from .app import (
+    handler_sync as handler_sync,
+)
+from .cas import CasRetryPolicy as CasRetryPolicy
+from .cas import ExponentialBackoff as ExponentialBackoff
+from .cas import ImmediateRetry as ImmediateRetry
 from .connection import (
     Connection as Connection,
 )
@@ -22,6 +28,9 @@ from .connection import (
 from .connection import (
     DeferredCall as DeferredCall,
 )
+from .connection import (
+    DrainReport as DrainReport,
+)
 from .connection import (
     Request as Request,
 )
@@ -49,4 +58,8 @@ from .only import (
 from .only import (
     only as only,
 )
+from .pool import (
+    serve_pool as serve_pool,
+)
+from .store import MemoryOptions as MemoryOptions
 from .store import NotFoundError as NotFoundError
@@ -1,18 +1,24 @@
 from __future__ import annotations
 
+import asyncio
+import contextvars
 import functools
+import weakref
 from abc import abstractmethod
 from collections import UserDict
 from collections.abc import (
     Awaitable,
     Callable,
+    Coroutine,
     Mapping,
     Sequence,
 )
-from typing import Any, Concatenate, Protocol, overload
+from concurrent.futures import Executor
+from typing import Any, Concatenate, Protocol, cast, overload
 
 from brrr.store import NotFoundError
 
+from .call import Call
 from .codec import Codec
 from .connection import Connection, Defer, DeferredCall, Request, Response
 from .only import allow_only
@@ -81,6 +87,40 @@ def handler_no_arg[**P, R](
     return f  # type: ignore[return-value]
 
 
+@overload
+def handler_sync[**P, R](f: Callable[P, R]) -> WrappedTaskT[P, P, R]: ...
+@overload
+def handler_sync[**P, R](
+    *, executor: Executor | None = None
+) -> Callable[[Callable[P, R]], WrappedTaskT[P, P, R]]: ...
+def handler_sync[**P, R](
+    f: Callable[P, R] | None = None, *, executor: Executor | None = None
+) -> WrappedTaskT[P, P, R] | Callable[[Callable[P, R]], WrappedTaskT[P, P, R]]:
+    """A brrr handler for a plain, blocking function.
+
+    The function is run in the given executor, or asyncio's default thread
+    pool, so the worker's event loop keeps serving other messages in the
+    meantime.  Pass executor=... to size the pool for your workload:
+
+    >>> @brrr.handler_sync(executor=ThreadPoolExecutor(max_workers=8))
+    ... def crunch(x: int) -> int: ...
+
+    The context variables of the caller are visible to the function.
+
+    """
+
+    def decorator(f: Callable[P, R]) -> WrappedTaskT[P, P, R]:
+        @functools.wraps(f)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            ctx = contextvars.copy_context()
+            call = functools.partial(ctx.run, f, *args, **kwargs)
+            return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+        return handler_no_arg(wrapper)
+
+    return decorator if f is None else decorator(f)
+
+
 def handler[**P, R](
     f: Callable[Concatenate[ActiveWorker, P], Awaitable[R]],
 ) -> WrappedTaskT[Concatenate[ActiveWorker, P], P, R]:
@@ -191,15 +231,50 @@ class AppWorker(AppConsumer):
             return Response(payload=resp)
 
 
+class _ChildCall:
+    """What ActiveWorker.call(...)(...) is about.
+
+    That returns a plain coroutine, which looks up the value or defers.
+    ActiveWorker.gather looks up the values of all of these at once instead.
+
+    """
+
+    def __init__(
+        self, worker: ActiveWorker, task_name: str, topic: str | None, call: Call
+    ):
+        self.worker = worker
+        self.task_name = task_name
+        self.topic = topic
+        self.call = call
+
+    async def get(self) -> Any:
+        try:
+            payload = await self.worker._connection._memory.get_value(
+                self.call.call_hash
+            )
+        except NotFoundError:
+            raise self.defer()
+        return self.decode(payload)
+
+    def decode(self, payload: bytes) -> Any:
+        return self.worker._codec.decode_return(self.task_name, payload)
+
+    def defer(self) -> Defer:
+        return Defer([DeferredCall(self.topic, self.call)])
+
+
 class ActiveWorker:
     _connection: Connection
     _codec: Codec
     _handlers: TaskCollection
+    # The coroutines returned by call, for gather to recognize
+    _child_calls: weakref.WeakKeyDictionary[Awaitable[Any], _ChildCall]
 
     def __init__(self, conn: Connection, codec: Codec, tasks: TaskCollection):
         self._connection = conn
         self._codec = codec
         self._handlers = tasks
+        self._child_calls = weakref.WeakKeyDictionary()
 
     @overload
     def call[**P, R](
@@ -229,14 +304,13 @@ class ActiveWorker:
         """
         task_name = self._handlers.spec2name(task_spec)
 
-        async def f(*args: Any, **kwargs: Any) -> Any:
+        def f(*args: Any, **kwargs: Any) -> Awaitable[Any]:
             call = self._codec.encode_call(task_name, args, kwargs)
-            try:
-                payload = await self._connection._memory.get_value(call.call_hash)
-            except NotFoundError:
-                raise Defer([DeferredCall(topic, call)])
-            else:
-                return self._codec.decode_return(task_name, payload)
+            child = _ChildCall(self, task_name, topic, call)
+            # A real coroutine, so create_task and the like work on it
+            coro = child.get()
+            self._child_calls[coro] = child
+            return coro
 
         return f
 
@@ -290,17 +364,61 @@ class ActiveWorker:
         Takes a number of task lambdas and calls each of them.
         If they've all been computed, return their values,
         Otherwise raise jobs for those that haven't been computed
+
+        The values of all direct brrr calls are looked up in a single
+        Memory.get_values call.  Any other awaitables are run concurrently
+        with that.  Errors other than Defer are raised as is, the first one
+        in argument order if there are multiple.
         """
+        children = [self._child_call(aw) for aw in task_awaitables]
+        calls = [child for child in children if child is not None]
+        others = [aw for aw, child in zip(task_awaitables, children) if child is None]
+        # Looked up below instead of running them
+        for aw, child in zip(task_awaitables, children):
+            if child is not None:
+                cast(Coroutine[Any, Any, Any], aw).close()
+
+        other_results: Sequence[Any] = []
+        # Don't spin up any tasks unless necessary
+        running = asyncio.gather(*others, return_exceptions=True) if others else None
+        try:
+            found = await self._connection._memory.get_values(
+                call.call.call_hash for call in calls
+            )
+            if running is not None:
+                other_results = await running
+        except BaseException:
+            if running is not None:
+                running.cancel()
+            raise
+
         defers: list[DeferredCall] = []
         values = []
-
-        for task_awaitable in task_awaitables:
-            try:
-                values.append(await task_awaitable)
-            except Defer as d:
-                defers.extend(d.calls)
+        other_results_it = iter(other_results)
+        for child in children:
+            if child is not None:
+                payload = found.get(child.call.call_hash)
+                if payload is None:
+                    defers.extend(child.defer().calls)
+                else:
+                    values.append(child.decode(payload))
+                continue
+            result = next(other_results_it)
+            if isinstance(result, Defer):
+                defers.extend(result.calls)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                values.append(result)
 
         if defers:
             raise Defer(defers)
 
         return values
+
+    def _child_call(self, aw: Awaitable[Any]) -> _ChildCall | None:
+        try:
+            return self._child_calls.get(aw)
+        except TypeError:
+            # Can't be weakly referenced, so it's not one of ours
+            return None
@@ -4,12 +4,17 @@ import asyncio
 import functools
 import logging
 import typing
+from collections.abc import Iterable, Iterator, Sequence
 from typing import Any, Callable, Coroutine
 
 from ..store import CompareMismatch, MemKey, NotFoundError, Store
 
 if typing.TYPE_CHECKING:
     from types_aiobotocore_dynamodb import DynamoDBClient
+    from types_aiobotocore_dynamodb.type_defs import (
+        TransactWriteItemTypeDef,
+        WriteRequestTypeDef,
+    )
 
 
 logger = logging.getLogger(__name__)
@@ -75,10 +80,28 @@ def async_retry_on_exception[**P, T](
     return decorator
 
 
+# Hard limits on the number of items per BatchGetItem / BatchWriteItem request
+_BATCH_GET_MAX = 100
+_BATCH_WRITE_MAX = 25
+
+
+def _chunks[T](items: Sequence[T], n: int) -> Iterator[Sequence[T]]:
+    for i in range(0, len(items), n):
+        yield items[i : i + n]
+
+
+# Reasons for cancelling a transaction which mean it lost a race
+_CAS_CANCELLATIONS = {"ConditionalCheckFailed", "TransactionConflict"}
+
+
 class DynamoDbMemStore(Store):
     client: DynamoDBClient
     table_name: str
 
+    supports_set_and_compare_and_set = True
+    supports_items = True
+    supports_sets = True
+
     def key(self, mem_key: MemKey) -> dict[str, dict[str, str]]:
         return {"pk": {"S": mem_key.call_hash}, "sk": {"S": mem_key.type}}
 
@@ -125,6 +148,86 @@ class DynamoDbMemStore(Store):
         """
         return await self.get(key)
 
+    async def _with_unprocessed_retry[T](
+        self, request: T, send: Callable[[T], Coroutine[Any, Any, T | None]]
+    ) -> None:
+        """Send a batch request until Dynamo processed all of it.
+
+        Dynamo can process only part of a batch, e.g. when throttled, and
+        returns whatever is left to be retried.  Backs off like
+        get_with_retry.
+
+        """
+        retries = 0
+        while True:
+            unprocessed = await send(request)
+            if not unprocessed:
+                return
+            retries += 1
+            if retries > 8:
+                raise RuntimeError(
+                    f"Dynamo left part of a batch unprocessed {retries} times in a row"
+                )
+            logger.warning(f"Retrying unprocessed batch items, attempt {retries}")
+            await asyncio.sleep(min(25 * (2**retries), 300) / 1000)
+            request = unprocessed
+
+    async def get_many(self, keys: Sequence[MemKey]) -> list[bytes | None]:
+        found: dict[tuple[str, str], bytes] = {}
+        # Duplicate keys in a single request are an error
+        unique = list({(k.call_hash, k.type): k for k in keys}.values())
+
+        async def send(request: list[dict[str, Any]]) -> list[dict[str, Any]] | None:
+            response = await self.client.batch_get_item(
+                RequestItems={self.table_name: {"Keys": request}}
+            )
+            for item in response["Responses"].get(self.table_name, []):
+                found[(item["pk"]["S"], item["sk"]["S"])] = item["value"]["B"]
+            unprocessed = response.get("UnprocessedKeys", {})
+            if self.table_name not in unprocessed:
+                return None
+            return list(unprocessed[self.table_name]["Keys"])
+
+        await asyncio.gather(
+            *(
+                self._with_unprocessed_retry([self.key(k) for k in chunk], send)
+                for chunk in _chunks(unique, _BATCH_GET_MAX)
+            )
+        )
+        return [found.get((k.call_hash, k.type)) for k in keys]
+
+    async def _batch_write(self, requests: Sequence[WriteRequestTypeDef]) -> None:
+        async def send(
+            request: Sequence[WriteRequestTypeDef],
+        ) -> Sequence[WriteRequestTypeDef] | None:
+            response = await self.client.batch_write_item(
+                RequestItems={self.table_name: request}
+            )
+            unprocessed = response.get("UnprocessedItems", {})
+            if self.table_name not in unprocessed:
+                return None
+            # The output and input shapes are the same
+            return typing.cast(
+                Sequence["WriteRequestTypeDef"], unprocessed[self.table_name]
+            )
+
+        await asyncio.gather(
+            *(
+                self._with_unprocessed_retry(chunk, send)
+                for chunk in _chunks(requests, _BATCH_WRITE_MAX)
+            )
+        )
+
+    async def set_many(self, items: Sequence[tuple[MemKey, bytes]]) -> None:
+        # Duplicate keys in a single request are an error: last one wins
+        last = list({(k.call_hash, k.type): (k, v) for k, v in items}.values())
+        await self._batch_write(
+            [
+                {"PutRequest": {"Item": {**self.key(k), "value": {"B": v}}}}
+                for k, v in last
+            ]
+        )
+
     async def set(self, key: MemKey, value: bytes) -> None:
         await self.client.put_item(
             TableName=self.table_name, Item={**self.key(key), "value": {"B": value}}
@@ -183,6 +286,247 @@ class DynamoDbMemStore(Store):
         except self.client.exceptions.ConditionalCheckFailedException as e:
             raise CompareMismatch() from e
 
+    async def set_and_compare_and_set(
+        self,
+        items: Sequence[tuple[MemKey, bytes]],
+        key: MemKey,
+        value: bytes,
+        expected: bytes | None,
+    ) -> None:
+        # A transaction costs twice the capacity of a plain write
+        if not items:
+            if expected is None:
+                return await self.set_new_value(key, value)
+            return await self.compare_and_set(key, value, expected)
+        if expected is None:
+            condition = "attribute_not_exists(#value)"
+            values: dict[str, Any] = {":value": {"B": value}}
+        else:
+            condition = "#value = :expected"
+            values = {":value": {"B": value}, ":expected": {"B": expected}}
+        transaction: list[TransactWriteItemTypeDef] = [
+            {
+                "Put": {
+                    "TableName": self.table_name,
+                    "Item": {**self.key(k), "value": {"B": v}},
+                }
+            }
+            for k, v in items
+        ]
+        transaction.append(
+            {
+                "Update": {
+                    "TableName": self.table_name,
+                    "Key": self.key(key),
+                    "UpdateExpression": "SET #value = :value",
+                    "ExpressionAttributeNames": {"#value": "value"},
+                    "ExpressionAttributeValues": values,
+                    "ConditionExpression": condition,
+                }
+            }
+        )
+        try:
+            await self.client.transact_write_items(TransactItems=transaction)
+        except self.client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get("CancellationReasons", [])
+            if any(r.get("Code") in _CAS_CANCELLATIONS for r in reasons):
+                raise CompareMismatch() from e
+            raise
+
+    # Item sets are stored as one item per element, next to the item for the
+    # key itself, which holds the version.  Elements are in the sort key,
+    # after the type, decoded as latin-1 to keep their prefixes intact.
+
+    def _item_sk(self, key: MemKey, item: bytes) -> str:
+        return f"{key.type}/{item.decode('latin-1')}"
+
+    async def add_item(self, key: MemKey, item: bytes) -> int:
+        await self.client.put_item(
+            TableName=self.table_name,
+            Item={"pk": {"S": key.call_hash}, "sk": {"S": self._item_sk(key, item)}},
+        )
+        response = await self.client.update_item(
+            TableName=self.table_name,
+            Key=self.key(key),
+            UpdateExpression="ADD #version :one",
+            ExpressionAttributeNames={"#version": "version"},
+            ExpressionAttributeValues={":one": {"N": "1"}},
+            ReturnValues="UPDATED_NEW",
+        )
+        return int(response["Attributes"]["version"]["N"])
+
+    async def get_item_version(self, key: MemKey) -> int:
+        response = await self.client.get_item(
+            TableName=self.table_name,
+            Key=self.key(key),
+            ConsistentRead=True,
+        )
+        if "Item" not in response:
+            return 0
+        return int(response["Item"]["version"]["N"])
+
+    async def get_items(self, key: MemKey, prefix: bytes = b"") -> list[bytes]:
+        skip = len(self._item_sk(key, b""))
+        items: list[bytes] = []
+        start: dict[str, Any] = {}
+        while True:
+            response = await self.client.query(
+                TableName=self.table_name,
+                KeyConditionExpression="pk = :pk AND begins_with(sk, :prefix)",
+                ExpressionAttributeValues={
+                    ":pk": {"S": key.call_hash},
+                    ":prefix": {"S": self._item_sk(key, prefix)},
+                },
+                ConsistentRead=True,
+                **start,
+            )
+            items += (i["sk"]["S"][skip:].encode("latin-1") for i in response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return items
+            start = {"ExclusiveStartKey": response["LastEvaluatedKey"]}
+
+    async def delete_items(
+        self, key: MemKey, items: Sequence[bytes], version: int
+    ) -> None:
+        requests: list[WriteRequestTypeDef] = [
+            {
+                "DeleteRequest": {
+                    "Key": {
+                        "pk": {"S": key.call_hash},
+                        "sk": {"S": self._item_sk(key, item)},
+                    }
+                }
+            }
+            for item in dict.fromkeys(items)
+        ]
+        await self._batch_write(requests)
+        try:
+            if version:
+                await self.client.delete_item(
+                    TableName=self.table_name,
+                    Key=self.key(key),
+                    ConditionExpression="#version = :version",
+                    ExpressionAttributeNames={"#version": "version"},
+                    ExpressionAttributeValues={":version": {"N": str(version)}},
+                )
+            else:
+                await self.client.delete_item(
+                    TableName=self.table_name,
+                    Key=self.key(key),
+                    ConditionExpression="attribute_not_exists(#version)",
+                    ExpressionAttributeNames={"#version": "version"},
+                )
+        except self.client.exceptions.ConditionalCheckFailedException as e:
+            raise CompareMismatch() from e
+
+    # Sets are a binary set attribute on the key itself, which DynamoDB adds
+    # to and removes from atomically, next to another one of their members'
+    # groups.  The members attribute disappears once empty, the item itself,
+    # groups and all, is deleted separately.
+
+    # Ways of adding a member, with the condition under which each applies,
+    # and what that tells: whether it created the set, and whether it's new to
+    # a group which has other members.  Tried in the order of how common that
+    # is, so usually the first write goes through: every parent of a call adds
+    # a member to its existing set, but only the first one creates it.
+    # Nothing is read back.
+    _ADD_TO_SET = (
+        (
+            (False, False),
+            "ADD #members :new_members, #groups :new_groups",
+            (
+                "attribute_exists(#members)"
+                " AND (NOT contains(#groups, :group) OR contains(#members, :member))"
+            ),
+        ),
+        (
+            (True, False),
+            # A new set starts without any groups left behind
+            "ADD #members :new_members SET #groups = :new_groups",
+            "attribute_not_exists(#members)",
+        ),
+        (
+            (False, True),
+            "ADD #members :new_members, #groups :new_groups",
+            (
+                "attribute_exists(#members)"
+                " AND contains(#groups, :group) AND NOT contains(#members, :member)"
+            ),
+        ),
+    )
+
+    async def add_to_set(
+        self, key: MemKey, member: bytes, group: bytes
+    ) -> tuple[bool, bool]:
+        values: dict[str, Any] = {
+            ":new_members": {"BS": [member]},
+            ":new_groups": {"BS": [group]},
+            ":member": {"B": member},
+            ":group": {"B": group},
+        }
+        # Between them the conditions cover every case, but the set can
+        # change between attempts: go round until one sticks.
+        while True:
+            for result, update, condition in self._ADD_TO_SET:
+                try:
+                    await self.client.update_item(
+                        TableName=self.table_name,
+                        Key=self.key(key),
+                        UpdateExpression=update,
+                        ConditionExpression=condition,
+                        ExpressionAttributeNames={
+                            "#members": "members",
+                            "#groups": "groups",
+                        },
+                        # DynamoDB rejects any which aren't used
+                        ExpressionAttributeValues={
+                            k: v for k, v in values.items() if k in update + condition
+                        },
+                    )
+                except self.client.exceptions.ConditionalCheckFailedException:
+                    continue
+                return result
+
+    async def get_set(self, key: MemKey) -> frozenset[bytes]:
+        response = await self.client.get_item(
+            TableName=self.table_name,
+            Key=self.key(key),
+            ConsistentRead=True,
+            ProjectionExpression="#members",
+            ExpressionAttributeNames={"#members": "members"},
+        )
+        return frozenset(response.get("Item", {}).get("members", {}).get("BS", []))
+
+    async def remove_from_set(
+        self, key: MemKey, members: Iterable[bytes]
+    ) -> frozenset[bytes]:
+        members = list(members)
+        if not members:
+            return await self.get_set(key)
+        response = await self.client.update_item(
+            TableName=self.table_name,
+            Key=self.key(key),
+            UpdateExpression="DELETE #members :members",
+            ExpressionAttributeNames={"#members": "members"},
+            ExpressionAttributeValues={":members": {"BS": members}},
+            ReturnValues="UPDATED_NEW",
+        )
+        attributes = response.get("Attributes", {})
+        remaining = frozenset(attributes.get("members", {}).get("BS", []))
+        if remaining:
+            return remaining
+        try:
+            await self.client.delete_item(
+                TableName=self.table_name,
+                Key=self.key(key),
+                ConditionExpression="attribute_not_exists(#members)",
+                ExpressionAttributeNames={"#members": "members"},
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            # Somebody added a member in the meantime
+            return await self.get_set(key)
+        return frozenset()
+
     async def create_table(self) -> None:
         try:
             await self.client.create_table(
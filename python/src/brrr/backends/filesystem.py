@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+from typing import override
+
+from ..offload import BlobStore
+
+
+class FileBlobStore(BlobStore):
+    """Blobs as files in a local directory, for development and testing.
+
+    A shared filesystem works too: blobs are written to a temporary file first
+    and atomically moved into place, so readers never see a partial blob.
+
+    """
+
+    def __init__(self, root: str | os.PathLike[str]):
+        self.root = Path(root)
+
+    def _path(self, address: str) -> Path:
+        # Don't put everything in one huge directory
+        return self.root / address[:2] / address
+
+    def _put(self, address: str, data: bytes) -> None:
+        path = self._path(address)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @override
+    async def put(self, address: str, data: bytes) -> None:
+        await asyncio.to_thread(self._put, address, data)
+
+    @override
+    async def get(self, address: str) -> bytes:
+        return await asyncio.to_thread(self._path(address).read_bytes)
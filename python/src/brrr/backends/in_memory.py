@@ -2,19 +2,24 @@ from __future__ import annotations
 
 import asyncio
 import typing
-from collections.abc import Mapping, Sequence
+from collections.abc import Iterable, Mapping, Sequence
 from typing import override
 
 from brrr.store import CompareMismatch, NotFoundError
 
+from ..offload import BlobStore
 from ..queue import Message, Queue, QueueInfo, QueueIsClosed, QueueIsEmpty
 from ..store import Cache, MemKey, Store
 
 
 class InMemoryQueue(Queue):
-    """In-memory, inherently ephemeral message queue for testing."""
+    """In-memory, inherently ephemeral message queue for testing.
 
-    _queues: Mapping[str, asyncio.Queue[str]]
+    Messages come back out exactly as they were put in, str or bytes.
+
+    """
+
+    _queues: Mapping[str, asyncio.Queue[str | bytes]]
 
     def __init__(self, topics: Sequence[str]):
         self._closing = False
@@ -22,6 +27,8 @@ class InMemoryQueue(Queue):
         # Could be updated to allow dynamically creating topics on-demand but
         # this is probably a bit nicer for now.
         self._queues = {k: asyncio.Queue() for k in topics}
+        # Set on every put and close, to wake up multi-topic listeners.
+        self._activity = asyncio.Event()
 
     async def close(self) -> None:
         """Only works in Python ≥3.13"""
@@ -30,6 +37,7 @@ class InMemoryQueue(Queue):
         self._closing = True
         for q in self._queues.values():
             q.shutdown()
+        self._activity.set()
 
     async def join(self) -> None:
         """Wait for all queues to be fully closed"""
@@ -62,11 +70,89 @@ class InMemoryQueue(Queue):
         q.task_done()
         return Message(body=payload)
 
+    @typing.override
+    async def get_messages(self, topic: str, max_n: int) -> Sequence[Message]:
+        messages = [await self.get_message(topic)]
+        q = self._queues[topic]
+        while len(messages) < max_n:
+            try:
+                payload = q.get_nowait()
+            except (asyncio.QueueEmpty, asyncio.QueueShutDown):
+                break
+            q.task_done()
+            messages.append(Message(body=payload))
+        return messages
+
+    @typing.override
+    async def get_messages_any(
+        self, topics: Sequence[str], max_n: int
+    ) -> tuple[str, Sequence[Message]]:
+        if any(topic not in self._queues for topic in topics):
+            raise ValueError("invalid topic name")
+
+        try:
+            async with asyncio.timeout(self.recv_block_secs):
+                while True:
+                    # Clear before checking so nothing put in the meantime is
+                    # missed.
+                    self._activity.clear()
+                    closed = 0
+                    for topic in topics:
+                        q = self._queues[topic]
+                        try:
+                            payload = q.get_nowait()
+                        except asyncio.QueueEmpty:
+                            continue
+                        except asyncio.QueueShutDown:
+                            closed += 1
+                            continue
+                        q.task_done()
+                        messages = [Message(body=payload)]
+                        while len(messages) < max_n:
+                            try:
+                                payload = q.get_nowait()
+                            except (asyncio.QueueEmpty, asyncio.QueueShutDown):
+                                break
+                            q.task_done()
+                            messages.append(Message(body=payload))
+                        return topic, messages
+
+                    if closed == len(topics):
+                        raise QueueIsClosed()
+                    if self._flushing:
+                        for topic in topics:
+                            self._queues[topic].shutdown()
+                        raise QueueIsClosed()
+                    await self._activity.wait()
+        except TimeoutError:
+            raise QueueIsEmpty()
+
     @typing.override
     async def put_message(self, topic: str, body: str) -> None:
         if topic not in self._queues:
             raise ValueError(f"Unknown topic {topic}")
         await self._queues[topic].put(body)
+        self._activity.set()
+
+    @typing.override
+    async def put_messages(self, topic: str, bodies: Sequence[str]) -> None:
+        await self._put(topic, bodies)
+
+    @typing.override
+    async def put_message_bytes(self, topic: str, body: bytes) -> None:
+        await self._put(topic, [body])
+
+    @typing.override
+    async def put_messages_bytes(self, topic: str, bodies: Sequence[bytes]) -> None:
+        await self._put(topic, bodies)
+
+    async def _put(self, topic: str, bodies: Sequence[str | bytes]) -> None:
+        if topic not in self._queues:
+            raise ValueError(f"Unknown topic {topic}")
+        q = self._queues[topic]
+        for body in bodies:
+            await q.put(body)
+        self._activity.set()
 
     async def get_info(self, topic: str) -> QueueInfo:
         return QueueInfo(num_messages=self._queues[topic].qsize())
@@ -85,6 +171,7 @@ class InMemoryQueue(Queue):
 
         """
         self._flushing = True
+        self._activity.set()
 
 
 def _key2str(key: MemKey) -> str:
@@ -99,10 +186,24 @@ class InMemoryByteStore(Store, Cache):
 
     inner: dict[str, bytes]
     cache: dict[str, int]
+    # Item sets and their versions
+    items: dict[str, set[bytes]]
+    versions: dict[str, int]
+    sets: dict[str, set[bytes]]
+    # The groups of the members of every set, forgotten along with the set
+    set_groups: dict[str, set[bytes]]
+
+    supports_set_and_compare_and_set = True
+    supports_items = True
+    supports_sets = True
 
     def __init__(self) -> None:
         self.inner = {}
         self.cache = {}
+        self.items = {}
+        self.versions = {}
+        self.sets = {}
+        self.set_groups = {}
 
     @override
     async def has(self, key: MemKey) -> bool:
@@ -115,6 +216,15 @@ class InMemoryByteStore(Store, Cache):
             raise NotFoundError(key)
         return self.inner[full_hash]
 
+    @override
+    async def get_many(self, keys: Sequence[MemKey]) -> list[bytes | None]:
+        return [self.inner.get(_key2str(key)) for key in keys]
+
+    @override
+    async def set_many(self, items: Sequence[tuple[MemKey, bytes]]) -> None:
+        for key, value in items:
+            self.inner[_key2str(key)] = value
+
     @override
     async def get_with_retry(self, key: MemKey) -> bytes:
         return await self.get(key=key)
@@ -151,8 +261,106 @@ class InMemoryByteStore(Store, Cache):
             raise CompareMismatch()
         del self.inner[k]
 
+    @override
+    async def set_and_compare_and_set(
+        self,
+        items: Sequence[tuple[MemKey, bytes]],
+        key: MemKey,
+        value: bytes,
+        expected: bytes | None,
+    ) -> None:
+        k = _key2str(key)
+        if self.inner.get(k) != expected:
+            raise CompareMismatch()
+        for item_key, item_value in items:
+            self.inner[_key2str(item_key)] = item_value
+        self.inner[k] = value
+
+    @override
+    async def add_item(self, key: MemKey, item: bytes) -> int:
+        k = _key2str(key)
+        self.items.setdefault(k, set()).add(item)
+        version = self.versions.get(k, 0) + 1
+        self.versions[k] = version
+        return version
+
+    @override
+    async def get_item_version(self, key: MemKey) -> int:
+        return self.versions.get(_key2str(key), 0)
+
+    @override
+    async def get_items(self, key: MemKey, prefix: bytes = b"") -> list[bytes]:
+        items = self.items.get(_key2str(key), set())
+        return [item for item in items if item.startswith(prefix)]
+
+    @override
+    async def delete_items(
+        self, key: MemKey, items: Sequence[bytes], version: int
+    ) -> None:
+        k = _key2str(key)
+        remaining = self.items.get(k, set())
+        remaining.difference_update(items)
+        if self.versions.get(k, 0) != version:
+            raise CompareMismatch()
+        self.versions.pop(k, None)
+        if not remaining:
+            self.items.pop(k, None)
+
+    @override
+    async def add_to_set(
+        self, key: MemKey, member: bytes, group: bytes
+    ) -> tuple[bool, bool]:
+        k = _key2str(key)
+        created = k not in self.sets
+        if created:
+            self.sets[k] = set()
+            self.set_groups[k] = set()
+        if member in self.sets[k]:
+            return created, False
+        self.sets[k].add(member)
+        regrouped = group in self.set_groups[k]
+        self.set_groups[k].add(group)
+        return created, regrouped
+
+    @override
+    async def get_set(self, key: MemKey) -> frozenset[bytes]:
+        return frozenset(self.sets.get(_key2str(key), ()))
+
+    @override
+    async def remove_from_set(
+        self, key: MemKey, members: Iterable[bytes]
+    ) -> frozenset[bytes]:
+        k = _key2str(key)
+        remaining = self.sets.get(k, set())
+        remaining.difference_update(members)
+        if not remaining:
+            self.sets.pop(k, None)
+            self.set_groups.pop(k, None)
+        return frozenset(remaining)
+
     @override
     async def incr(self, key: str) -> int:
-        n: int = self.cache.get(key, 0) + 1
-        self.cache[key] = n
-        return n
+        return await self.incr_by(key, 1)
+
+    @override
+    async def incr_by(self, key: str, n: int) -> int:
+        value: int = self.cache.get(key, 0) + n
+        self.cache[key] = value
+        return value
+
+
+class InMemoryBlobStore(BlobStore):
+    """Blob store in a dict, for testing."""
+
+    blobs: dict[str, bytes]
+
+    def __init__(self) -> None:
+        self.blobs = {}
+
+    @override
+    async def put(self, address: str, data: bytes) -> None:
+        self.blobs[address] = data
+
+    @override
+    async def get(self, address: str) -> bytes:
+        return self.blobs[address]
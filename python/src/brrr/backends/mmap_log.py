@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import zlib
+from collections.abc import Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import override
+
+from ..store import CompareMismatch, MemKey, NotFoundError, Store
+
+logger = logging.getLogger(__name__)
+
+
+# Every record is a header followed by the key and the value.  The header has a
+# checksum of everything after it, so a record torn by a crash is detected and
+# the log ends just before it.  Unused space at the end of a segment is zeroes,
+# which reads as a header with an empty key: no valid record has one.
+_HEADER = struct.Struct("<IBII")  # crc32, kind, key length, value length
+_PUT = 1
+_DELETE = 2
+
+# Compact at most this many records before yielding to the event loop
+_COMPACT_BATCH = 1000
+
+
+def _key2bytes(key: MemKey) -> bytes:
+    return f"{key.type}/{key.call_hash}".encode()
+
+
+@dataclass(eq=False)
+class _Segment:
+    id: int
+    path: Path
+    file: int
+    map: mmap.mmap
+    # Where the next record goes, i.e. the end of the log in this segment
+    end: int
+    # Bytes of records which are still in the index
+    live: int = 0
+
+    def close(self) -> bool:
+        """Unmap and close, unless a view of it is still in use."""
+        try:
+            self.map.close()
+        except BufferError:
+            return False
+        os.close(self.file)
+        return True
+
+
+class MmapLogStore(Store):
+    """A store in append-only log files, memory mapped, for a single process.
+
+    Every write appends a record to the current segment file, and an
+    in-memory index points at the latest record for every key.  The index is
+    rebuilt from the log at startup.  Segments are memory mapped, so reading
+    never copies more than once, and get_view doesn't copy at all.
+
+    Once full, a segment is sealed and a new one started.  When too much of
+    the sealed segments is overwritten or deleted, whatever is still live is
+    copied to the current segment in the background, and the sealed segments
+    are removed.
+
+    Writes are only as durable as the operating system's page cache, unless
+    sync is set.  Only one process can use a directory at a time: there's no
+    shared index, so this takes an exclusive lock on the directory.
+
+    """
+
+    supports_set_and_compare_and_set = True
+
+    def __init__(
+        self,
+        directory: str | os.PathLike[str],
+        *,
+        segment_size: int = 64 * 1024 * 1024,
+        compact_ratio: float = 0.5,
+        sync: bool = False,
+    ):
+        self.directory = Path(directory)
+        self.segment_size = segment_size
+        self.compact_ratio = compact_ratio
+        self.sync = sync
+        self._index: dict[bytes, tuple[_Segment, int, int]] = {}
+        self._segments: dict[int, _Segment] = {}
+        # Removed segments with views still in use, closed when possible
+        self._retired: list[_Segment] = []
+        self._compacting: asyncio.Task[None] | None = None
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = os.open(self.directory / "LOCK", os.O_RDWR | os.O_CREAT)
+        try:
+            import fcntl
+        except ImportError:
+            pass
+        else:
+            try:
+                fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(self._lock)
+                raise RuntimeError(f"{self.directory} is in use by another process")
+
+        for path in sorted(self.directory.glob("*.log")):
+            # An empty file is a segment which was only just created
+            size = path.stat().st_size or self.segment_size
+            self._replay(self._open(int(path.stem), size))
+        if not self._segments:
+            self._active = self._open(0, self.segment_size)
+        else:
+            self._active = self._segments[max(self._segments)]
+
+    def _path(self, segment_id: int) -> Path:
+        return self.directory / f"{segment_id:010d}.log"
+
+    def _open(self, segment_id: int, size: int) -> _Segment:
+        path = self._path(segment_id)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        segment = _Segment(segment_id, path, fd, mmap.mmap(fd, size), 0)
+        self._segments[segment_id] = segment
+        return segment
+
+    def _replay(self, segment: _Segment) -> None:
+        m = segment.map
+        pos = 0
+        while pos + _HEADER.size <= len(m):
+            crc, kind, key_len, value_len = _HEADER.unpack_from(m, pos)
+            start = pos + _HEADER.size
+            end = start + key_len + value_len
+            if key_len == 0 or end > len(m):
+                break
+            if zlib.crc32(m[pos + 4 : end]) != crc:
+                logger.warning(f"Torn record in {segment.path} at {pos}, ignoring")
+                break
+            key = bytes(m[start : start + key_len])
+            self._unindex(key)
+            if kind == _PUT:
+                self._index[key] = (segment, start + key_len, value_len)
+                segment.live += end - pos
+            pos = end
+        segment.end = pos
+
+    def _unindex(self, key: bytes) -> None:
+        old = self._index.pop(key, None)
+        if old is not None:
+            segment, _, length = old
+            segment.live -= _HEADER.size + len(key) + length
+
+    def _append(self, kind: int, key: bytes, value: bytes = b"") -> None:
+        size = _HEADER.size + len(key) + len(value)
+        if self._active.end + size > len(self._active.map):
+            self._seal()
+            self._active = self._open(
+                max(self._segments) + 1, max(self.segment_size, size)
+            )
+        segment = self._active
+        pos = segment.end
+        body = _HEADER.pack(0, kind, len(key), len(value))[4:] + key + value
+        segment.map[pos + 4 : pos + size] = body
+        # The checksum last, so a torn record never looks valid
+        struct.pack_into("<I", segment.map, pos, zlib.crc32(body))
+        if self.sync:
+            segment.map.flush()
+        segment.end = pos + size
+        self._unindex(key)
+        if kind == _PUT:
+            self._index[key] = (segment, pos + _HEADER.size + len(key), len(value))
+            segment.live += size
+
+    def _seal(self) -> None:
+        self._active.map.flush()
+        sealed = [s for s in self._segments.values() if s is not self._active]
+        sealed.append(self._active)
+        total = sum(s.end for s in sealed)
+        dead = total - sum(s.live for s in sealed)
+        if total and dead / total >= self.compact_ratio:
+            self._start_compaction()
+
+    def _start_compaction(self) -> None:
+        if self._compacting is not None and not self._compacting.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+            self._compacting = loop.create_task(self._compact())
+        except RuntimeError:
+            # Not on an event loop, e.g. while closing: next time
+            pass
+
+    async def compact(self) -> None:
+        """Copy the live records of all sealed segments, then remove those."""
+        if self._compacting is not None and not self._compacting.done():
+            await self._compacting
+        await self._compact()
+
+    async def _compact(self) -> None:
+        sealed = [s for s in self._segments.values() if s is not self._active]
+        sealed_ids = {s.id for s in sealed}
+        live = [(k, loc) for k, loc in self._index.items() if loc[0].id in sealed_ids]
+        for i, (key, (segment, offset, length)) in enumerate(live, 1):
+            # Anything written meanwhile is indexed elsewhere already
+            if self._index.get(key) != (segment, offset, length):
+                continue
+            self._append(_PUT, key, segment.map[offset : offset + length])
+            if i % _COMPACT_BATCH == 0:
+                await asyncio.sleep(0)
+        for segment in sealed:
+            # Only once everything was copied: a crash halfway loses nothing
+            del self._segments[segment.id]
+            os.unlink(segment.path)
+            if not segment.close():
+                self._retired.append(segment)
+        self._retired = [s for s in self._retired if not s.close()]
+
+    def close(self) -> None:
+        if self._compacting is not None:
+            self._compacting.cancel()
+        for segment in [*self._segments.values(), *self._retired]:
+            segment.map.flush()
+            segment.close()
+        self._segments.clear()
+        self._index.clear()
+        os.close(self._lock)
+
+    def get_view(self, key: MemKey) -> memoryview:
+        """The value at this key, without copying it.
+
+        The view is only valid until the value is overwritten or deleted and
+        compacted away.  Release it when done, so the segment can be unmapped.
+
+        """
+        try:
+            segment, offset, length = self._index[_key2bytes(key)]
+        except KeyError:
+            raise NotFoundError(key)
+        return memoryview(segment.map)[offset : offset + length]
+
+    @override
+    async def has(self, key: MemKey) -> bool:
+        return _key2bytes(key) in self._index
+
+    @override
+    async def get(self, key: MemKey) -> bytes:
+        with self.get_view(key) as view:
+            return bytes(view)
+
+    @override
+    async def get_with_retry(self, key: MemKey) -> bytes:
+        return await self.get(key)
+
+    @override
+    async def get_many(self, keys: Sequence[MemKey]) -> list[bytes | None]:
+        values: list[bytes | None] = []
+        for key in keys:
+            try:
+                values.append(await self.get(key))
+            except NotFoundError:
+                values.append(None)
+        return values
+
+    @override
+    async def set(self, key: MemKey, value: bytes) -> None:
+        self._append(_PUT, _key2bytes(key), value)
+
+    @override
+    async def set_many(self, items: Sequence[tuple[MemKey, bytes]]) -> None:
+        for key, value in items:
+            self._append(_PUT, _key2bytes(key), value)
+
+    @override
+    async def delete(self, key: MemKey) -> None:
+        if await self.has(key):
+            self._append(_DELETE, _key2bytes(key))
+
+    # Everything below runs without awaiting anything in between, so nothing
+    # else on the event loop can get in between the comparison and the write.
+
+    def _matches(self, key: MemKey, expected: bytes | None) -> bool:
+        try:
+            view = self.get_view(key)
+        except NotFoundError:
+            return expected is None
+        with view:
+            return expected is not None and view == expected
+
+    @override
+    async def set_new_value(self, key: MemKey, value: bytes) -> None:
+        if not self._matches(key, None):
+            raise CompareMismatch()
+        self._append(_PUT, _key2bytes(key), value)
+
+    @override
+    async def compare_and_set(self, key: MemKey, value: bytes, expected: bytes) -> None:
+        if not self._matches(key, expected):
+            raise CompareMismatch()
+        self._append(_PUT, _key2bytes(key), value)
+
+    @override
+    async def compare_and_delete(self, key: MemKey, expected: bytes) -> None:
+        if not self._matches(key, expected):
+            raise CompareMismatch()
+        self._append(_DELETE, _key2bytes(key))
+
+    @override
+    async def set_and_compare_and_set(
+        self,
+        items: Sequence[tuple[MemKey, bytes]],
+        key: MemKey,
+        value: bytes,
+        expected: bytes | None,
+    ) -> None:
+        if not self._matches(key, expected):
+            raise CompareMismatch()
+        for item_key, item_value in items:
+            self._append(_PUT, _key2bytes(item_key), item_value)
+        self._append(_PUT, _key2bytes(key), value)
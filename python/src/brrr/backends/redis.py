@@ -1,10 +1,16 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import os
+import socket
+import time
 import typing
+import uuid
+from collections.abc import Iterable, Sequence
 
 from ..queue import Message, Queue, QueueInfo, QueueIsEmpty
-from ..store import Cache
+from ..store import Cache, CompareMismatch, MemKey, NotFoundError, Store, prefix_end
 
 if typing.TYPE_CHECKING:
     from redis.asyncio import Redis
@@ -14,10 +20,24 @@ logger = logging.getLogger(__name__)
 
 
 class RedisQueue(Queue, Cache):
+    """A queue on Redis lists, one per topic.
+
+    Receiving one message at a time works on any Redis version.  Receiving
+    several at once, and receiving from several topics, requires Redis ≥ 7.0.
+
+    """
+
     client: Redis[typing.Any]
 
-    def __init__(self, client: Redis[typing.Any]) -> None:
+    def __init__(self, client: Redis[typing.Any], *, bytes_bodies: bool = False):
+        """With bytes_bodies, received messages are left as bytes.
+
+        Brrr itself takes either.  Skipping the decoding is cheaper, but
+        anything else reading messages from this queue has to expect bytes.
+
+        """
         self.client = client
+        self.bytes_bodies = bytes_bodies
 
     async def setup(self) -> None:
         pass
@@ -26,11 +46,58 @@ class RedisQueue(Queue, Cache):
         logger.debug(f"Putting new message on {topic}")
         await self.client.rpush(topic, body.encode("utf-8"))
 
+    async def put_messages(self, topic: str, bodies: Sequence[str]) -> None:
+        if not bodies:
+            return
+        logger.debug(f"Putting {len(bodies)} new messages on {topic}")
+        await self.client.rpush(topic, *(body.encode("utf-8") for body in bodies))
+
+    async def put_message_bytes(self, topic: str, body: bytes) -> None:
+        logger.debug(f"Putting new message on {topic}")
+        await self.client.rpush(topic, body)
+
+    async def put_messages_bytes(self, topic: str, bodies: Sequence[bytes]) -> None:
+        if not bodies:
+            return
+        logger.debug(f"Putting {len(bodies)} new messages on {topic}")
+        await self.client.rpush(topic, *bodies)
+
+    def _message(self, body: bytes) -> Message:
+        return Message(body if self.bytes_bodies else body.decode("utf-8"))
+
     async def get_message(self, topic: str) -> Message:
         response = await self.client.blpop(topic, self.recv_block_secs)
         if not response:
             raise QueueIsEmpty()
-        return Message(response[1].decode("utf-8"))
+        return self._message(response[1])
+
+    async def get_messages(self, topic: str, max_n: int) -> Sequence[Message]:
+        if max_n == 1:
+            # What a loop asks for by default: keep that working on Redis 6
+            return [await self.get_message(topic)]
+        # BLMPOP requires Redis ≥ 7.0.  The type stubs don't know it yet.
+        response = await self.client.blmpop(  # type: ignore[attr-defined]
+            self.recv_block_secs, 1, topic, direction="LEFT", count=max_n
+        )
+        if not response:
+            raise QueueIsEmpty()
+        return [self._message(body) for body in response[1]]
+
+    async def get_messages_any(
+        self, topics: Sequence[str], max_n: int
+    ) -> tuple[str, Sequence[Message]]:
+        # BLMPOP pops from the first non-empty list in the order given.
+        response = await self.client.blmpop(  # type: ignore[attr-defined]
+            self.recv_block_secs,
+            len(topics),
+            *topics,
+            direction="LEFT",
+            count=max_n,
+        )
+        if not response:
+            raise QueueIsEmpty()
+        topic, bodies = response
+        return topic.decode("utf-8"), [self._message(b) for b in bodies]
 
     async def get_info(self, topic: str) -> QueueInfo:
         total = await self.client.llen(topic)
@@ -38,3 +105,517 @@ class RedisQueue(Queue, Cache):
 
     async def incr(self, key: str) -> int:
         return await self.client.incr(key)
+
+    async def incr_by(self, key: str, n: int) -> int:
+        return await self.client.incrby(key, n)
+
+
+# Millisecond timestamps from the server's clock, so workers needn't agree
+_NOW_MS = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+"""
+
+# Requeue everything in a dead worker's processing list, unless its lease was
+# renewed in the meantime.  KEYS: the lease, the processing list, the topic, the
+# set of workers, the delivery counts, the dead letters.  ARGV: the worker, the
+# maximum number of deliveries.  The most recently received message goes back
+# on the front of the topic last, so they keep their order.  Returns how many
+# messages were requeued and how many were dead lettered.
+_REAP = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return {-1, 0} end
+local n, dead = 0, 0
+while true do
+  local m = redis.call('RPOP', KEYS[2])
+  if not m then break end
+  if redis.call('HINCRBY', KEYS[5], m, 1) >= tonumber(ARGV[2]) then
+    redis.call('HDEL', KEYS[5], m)
+    redis.call('RPUSH', KEYS[6], m)
+    dead = dead + 1
+  else
+    redis.call('LPUSH', KEYS[3], m)
+    n = n + 1
+  end
+end
+redis.call('SREM', KEYS[4], ARGV[1])
+return {n, dead}
+"""
+
+# Put a message which failed aside until it's time to retry it, unless it was
+# reaped in the meantime, or on the dead letters once it's been delivered too
+# often.  KEYS: the processing list, the delayed messages, the delivery counts,
+# the dead letters.  ARGV: the message, the maximum number of deliveries, the
+# delay in ms.  Identical messages share their count, and their place in line.
+_NACK = (
+    _NOW_MS
+    + """
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) == 0 then return 0 end
+if redis.call('HINCRBY', KEYS[3], ARGV[1], 1) >= tonumber(ARGV[2]) then
+  redis.call('HDEL', KEYS[3], ARGV[1])
+  redis.call('RPUSH', KEYS[4], ARGV[1])
+  return 2
+end
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[3]), ARGV[1])
+return 1
+"""
+)
+
+# Put delayed messages whose time has come back on the end of the topic.
+# KEYS: the delayed messages, the topic.
+_PROMOTE = (
+    _NOW_MS
+    + """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, 1000)
+if #due == 0 then return 0 end
+redis.call('ZREM', KEYS[1], unpack(due))
+redis.call('RPUSH', KEYS[2], unpack(due))
+return #due
+"""
+)
+
+
+class ReliableRedisQueue(RedisQueue):
+    """A Redis queue which doesn't lose messages when their worker dies.
+
+    Received messages are atomically moved to a processing list of this
+    worker's own, with BLMOVE, and only removed from there once brrr
+    acknowledges them.  The worker holds a lease, which it renews in the
+    background for as long as it's alive.  Once the lease of a worker has
+    expired, any worker receiving from the same topic puts its unacknowledged
+    messages back on the front of the topic, at most every lease_secs.
+
+    A message whose handler raised is put back on the end of the topic after
+    at least retry_delay_secs.  Every time a message is given up on or reaped
+    counts as a delivery: after max_deliveries of those, it goes on the
+    topic's dead letters instead, for a human to look at.  Brrr never gives up
+    on a message which hit the spawn limit: it's acknowledged and gone.
+
+    Messages can be handled more than once, e.g. when a worker is only slow
+    rather than dead.  Brrr handles that fine, it just means more work.
+
+    The processing lists, leases, set of workers, delivery counts, delayed
+    messages and dead letters live next to the topic, in keys which start with
+    the topic and a colon.  The dead letters are the list {topic}:dead.
+    Requires Redis ≥ 6.2.
+
+    """
+
+    def __init__(
+        self,
+        client: Redis[typing.Any],
+        *,
+        bytes_bodies: bool = False,
+        worker_id: str | None = None,
+        lease_secs: float = 60,
+        max_deliveries: int = 5,
+        retry_delay_secs: float = 5,
+    ):
+        super().__init__(client, bytes_bodies=bytes_bodies)
+        self.worker_id = worker_id or (
+            f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        )
+        self.lease_secs = lease_secs
+        self.max_deliveries = max_deliveries
+        self.retry_delay_secs = retry_delay_secs
+        self._reap = client.register_script(_REAP)
+        self._nack = client.register_script(_NACK)
+        self._promote = client.register_script(_PROMOTE)
+        # Topics this worker has received from, and when they were last reaped
+        self._topics: dict[str, float] = {}
+        # ... and when their delayed messages were last checked
+        self._promoted: dict[str, float] = {}
+        self._heartbeat: asyncio.Task[None] | None = None
+
+    def _processing_key(self, topic: str, worker_id: str) -> str:
+        return f"{topic}:processing:{worker_id}"
+
+    def _lease_key(self, topic: str, worker_id: str) -> str:
+        return f"{topic}:lease:{worker_id}"
+
+    def _workers_key(self, topic: str) -> str:
+        return f"{topic}:workers"
+
+    def _deliveries_key(self, topic: str) -> str:
+        return f"{topic}:deliveries"
+
+    def _delayed_key(self, topic: str) -> str:
+        return f"{topic}:delayed"
+
+    def _dead_key(self, topic: str) -> str:
+        return f"{topic}:dead"
+
+    async def _renew(self, topics: Iterable[str]) -> None:
+        lease_ms = int(self.lease_secs * 1000)
+        async with self.client.pipeline(transaction=False) as pipe:
+            for topic in topics:
+                pipe.set(self._lease_key(topic, self.worker_id), b"", px=lease_ms)
+                pipe.sadd(self._workers_key(topic), self.worker_id)
+            await pipe.execute()
+
+    async def _beat(self) -> None:
+        from redis.exceptions import RedisError
+
+        while True:
+            await asyncio.sleep(self.lease_secs / 3)
+            try:
+                await self._renew(self._topics)
+            except (RedisError, OSError) as e:
+                # Try again next time: the lease lasts a few beats
+                logger.warning(f"Failed to renew lease of {self.worker_id}: {e!r}")
+
+    async def _join(self, topic: str) -> None:
+        """Take a lease on this topic, and reap it if it's been a while.
+
+        Also requeues its delayed messages which are due, if it's been a bit.
+
+        """
+        if topic not in self._topics:
+            await self._renew([topic])
+            self._topics[topic] = 0
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._beat())
+        if time.monotonic() - self._topics[topic] >= self.lease_secs:
+            self._topics[topic] = time.monotonic()
+            await self.reap(topic)
+        if time.monotonic() - self._promoted.get(topic, 0) >= self.retry_delay_secs:
+            self._promoted[topic] = time.monotonic()
+            await self.promote(topic)
+
+    async def reap(self, topic: str) -> int:
+        """Requeue the messages of every worker on this topic which is gone.
+
+        Returns how many messages were requeued.
+
+        """
+        requeued = 0
+        for worker in await self.client.smembers(self._workers_key(topic)):
+            worker_id = worker.decode("utf-8")
+            n, dead = await self._reap(
+                keys=[
+                    self._lease_key(topic, worker_id),
+                    self._processing_key(topic, worker_id),
+                    topic,
+                    self._workers_key(topic),
+                    self._deliveries_key(topic),
+                    self._dead_key(topic),
+                ],
+                args=[worker_id, self.max_deliveries],
+            )
+            if n > 0:
+                logger.warning(f"Requeued {n} messages of {worker_id} on {topic}")
+                requeued += n
+            if dead > 0:
+                logger.error(f"Dead lettered {dead} messages of {worker_id} on {topic}")
+        return requeued
+
+    async def promote(self, topic: str) -> int:
+        """Requeue the delayed messages on this topic whose time has come.
+
+        Returns how many messages were requeued.
+
+        """
+        n: int = await self._promote(keys=[self._delayed_key(topic), topic])
+        return n
+
+    async def close(self) -> None:
+        """Stop renewing the lease.  Unacknowledged messages will be reaped."""
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    async def get_message(self, topic: str) -> Message:
+        [message] = await self.get_messages(topic, 1)
+        return message
+
+    async def _move(
+        self, topic: str, max_n: int, block_secs: float | None
+    ) -> list[bytes]:
+        """Move up to max_n messages to processing, blocking for the first."""
+        await self._join(topic)
+        processing = self._processing_key(topic, self.worker_id)
+        first: typing.Any
+        if block_secs is None:
+            first = await self.client.lmove(topic, processing, "LEFT", "RIGHT")
+        else:
+            first = await self.client.blmove(
+                topic, processing, block_secs, "LEFT", "RIGHT"
+            )
+        if first is None:
+            return []
+        bodies = [typing.cast(bytes, first)]
+        if max_n > 1:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for _ in range(max_n - 1):
+                    pipe.lmove(topic, processing, "LEFT", "RIGHT")
+                bodies += [b for b in await pipe.execute() if b is not None]
+        return bodies
+
+    async def get_messages(self, topic: str, max_n: int) -> Sequence[Message]:
+        bodies = await self._move(topic, max_n, self.recv_block_secs)
+        if not bodies:
+            raise QueueIsEmpty()
+        return [self._message(body) for body in bodies]
+
+    async def get_messages_any(
+        self, topics: Sequence[str], max_n: int
+    ) -> tuple[str, Sequence[Message]]:
+        # BLMOVE only takes a single list: check them all in order, then block
+        # on the first one for a bit, until there's something or time is up.
+        deadline = time.monotonic() + self.recv_block_secs
+        while True:
+            for topic in topics:
+                if bodies := await self._move(topic, max_n, None):
+                    return topic, [self._message(body) for body in bodies]
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise QueueIsEmpty()
+            if bodies := await self._move(topics[0], max_n, min(remaining, 1)):
+                return topics[0], [self._message(body) for body in bodies]
+
+    async def ack(self, topic: str, message: Message) -> None:
+        body = message.body_bytes
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.lrem(self._processing_key(topic, self.worker_id), 1, body)
+            pipe.hdel(self._deliveries_key(topic), body)
+            await pipe.execute()
+
+    async def nack(self, topic: str, message: Message) -> None:
+        result = await self._nack(
+            keys=[
+                self._processing_key(topic, self.worker_id),
+                self._delayed_key(topic),
+                self._deliveries_key(topic),
+                self._dead_key(topic),
+            ],
+            args=[
+                message.body_bytes,
+                self.max_deliveries,
+                int(self.retry_delay_secs * 1000),
+            ],
+        )
+        if result == 2:
+            logger.error(f"Dead lettered {message!r} on {topic}")
+
+
+# Compare-and-set scripts.  Redis runs scripts atomically, so there's no need
+# for WATCH and the retries that come with it.  A missing key reads as false,
+# which never equals the expected value.
+
+_COMPARE_AND_SET = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+redis.call('SET', KEYS[1], ARGV[2])
+return 1
+"""
+
+_COMPARE_AND_DELETE = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+# KEYS: the compared key, then the items.  ARGV: whether the key must be
+# missing, the expected value, the new value, then the items' values.
+_SET_AND_COMPARE_AND_SET = """
+local current = redis.call('GET', KEYS[1])
+if ARGV[1] == '1' then
+  if current then return 0 end
+elseif current ~= ARGV[2] then
+  return 0
+end
+for i = 2, #KEYS do redis.call('SET', KEYS[i], ARGV[i + 2]) end
+redis.call('SET', KEYS[1], ARGV[3])
+return 1
+"""
+
+# KEYS: the items, the version.  ARGV: the expected version, then the items,
+# removed in chunks to stay clear of Lua's stack limit on unpack.
+_DELETE_ITEMS = """
+for i = 2, #ARGV, 1000 do
+  redis.call('ZREM', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+if tonumber(redis.call('GET', KEYS[2]) or '0') ~= tonumber(ARGV[1]) then
+  return 0
+end
+redis.call('DEL', KEYS[2])
+return 1
+"""
+
+
+# KEYS: the set, its groups.  ARGV: the member, its group.  A set which doesn't
+# exist yet starts without any groups, whatever was left behind.
+_ADD_TO_SET = """
+local created = redis.call('EXISTS', KEYS[1]) == 0 and 1 or 0
+if created == 1 then redis.call('DEL', KEYS[2]) end
+if redis.call('SADD', KEYS[1], ARGV[1]) == 0 then return {created, 0} end
+return {created, 1 - redis.call('SADD', KEYS[2], ARGV[2])}
+"""
+
+# KEYS: the set, its groups.  ARGV: the members, removed in chunks like above.
+# The groups go once the set is empty.
+_REMOVE_FROM_SET = """
+for i = 1, #ARGV, 1000 do
+  redis.call('SREM', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+local remaining = redis.call('SMEMBERS', KEYS[1])
+if #remaining == 0 then redis.call('DEL', KEYS[2]) end
+return remaining
+"""
+
+
+class RedisStore(Store):
+    """A store on a single Redis server, or a replicated one with failover.
+
+    Every key is prefixed with the given prefix, to share a Redis database
+    with other applications, or other brrr instances.  Redis Cluster is not
+    supported: several operations use more than one key at once.
+
+    Redis is read-after-write consistent, so get_with_retry never needs to
+    retry.  Mind that Redis only offers the durability it's configured for.
+
+    """
+
+    client: Redis[typing.Any]
+
+    supports_set_and_compare_and_set = True
+    supports_items = True
+    supports_sets = True
+
+    def __init__(self, client: Redis[typing.Any], *, prefix: str = ""):
+        self.client = client
+        self.prefix = prefix
+        self._compare_and_set = client.register_script(_COMPARE_AND_SET)
+        self._compare_and_delete = client.register_script(_COMPARE_AND_DELETE)
+        self._set_and_compare_and_set = client.register_script(_SET_AND_COMPARE_AND_SET)
+        self._delete_items = client.register_script(_DELETE_ITEMS)
+        self._add_to_set = client.register_script(_ADD_TO_SET)
+        self._remove_from_set = client.register_script(_REMOVE_FROM_SET)
+
+    def key(self, mem_key: MemKey) -> str:
+        return f"{self.prefix}{mem_key.type}/{mem_key.call_hash}"
+
+    # Items live in a Redis sorted set next to a version counter, so neither
+    # ever clashes with the record at the key itself.  They all score 0, which
+    # orders them by their bytes: those with a prefix are a range.
+
+    def _items_key(self, mem_key: MemKey) -> str:
+        return f"{self.key(mem_key)}/items"
+
+    def _version_key(self, mem_key: MemKey) -> str:
+        return f"{self.key(mem_key)}/version"
+
+    def _set_key(self, mem_key: MemKey) -> str:
+        return f"{self.key(mem_key)}/set"
+
+    def _set_groups_key(self, mem_key: MemKey) -> str:
+        return f"{self.key(mem_key)}/set-groups"
+
+    async def has(self, key: MemKey) -> bool:
+        return bool(await self.client.exists(self.key(key)))
+
+    async def get(self, key: MemKey) -> bytes:
+        value = await self.client.get(self.key(key))
+        if value is None:
+            raise NotFoundError(key)
+        return typing.cast(bytes, value)
+
+    async def get_with_retry(self, key: MemKey) -> bytes:
+        return await self.get(key)
+
+    async def get_many(self, keys: Sequence[MemKey]) -> list[bytes | None]:
+        if not keys:
+            return []
+        return list(await self.client.mget([self.key(k) for k in keys]))
+
+    async def set(self, key: MemKey, value: bytes) -> None:
+        await self.client.set(self.key(key), value)
+
+    async def set_many(self, items: Sequence[tuple[MemKey, bytes]]) -> None:
+        if not items:
+            return
+        # A dict keeps the last value of a repeated key, as required
+        await self.client.mset({self.key(k): value for k, value in items})
+
+    async def delete(self, key: MemKey) -> None:
+        await self.client.delete(self.key(key))
+
+    async def set_new_value(self, key: MemKey, value: bytes) -> None:
+        if not await self.client.set(self.key(key), value, nx=True):
+            raise CompareMismatch()
+
+    async def compare_and_set(self, key: MemKey, value: bytes, expected: bytes) -> None:
+        if not await self._compare_and_set(
+            keys=[self.key(key)], args=[expected, value]
+        ):
+            raise CompareMismatch()
+
+    async def compare_and_delete(self, key: MemKey, expected: bytes) -> None:
+        if not await self._compare_and_delete(keys=[self.key(key)], args=[expected]):
+            raise CompareMismatch()
+
+    async def set_and_compare_and_set(
+        self,
+        items: Sequence[tuple[MemKey, bytes]],
+        key: MemKey,
+        value: bytes,
+        expected: bytes | None,
+    ) -> None:
+        missing = b"1" if expected is None else b"0"
+        if not await self._set_and_compare_and_set(
+            keys=[self.key(key), *(self.key(k) for k, _ in items)],
+            args=[missing, expected or b"", value, *(v for _, v in items)],
+        ):
+            raise CompareMismatch()
+
+    async def add_item(self, key: MemKey, item: bytes) -> int:
+        # One round trip, and atomic: the item is there with its version
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zadd(self._items_key(key), {item: 0})
+            pipe.incr(self._version_key(key))
+            _, version = await pipe.execute()
+        return int(version)
+
+    async def get_item_version(self, key: MemKey) -> int:
+        return int(await self.client.get(self._version_key(key)) or 0)
+
+    async def get_items(self, key: MemKey, prefix: bytes = b"") -> list[bytes]:
+        end = prefix_end(prefix)
+        return list(
+            await self.client.zrangebylex(
+                self._items_key(key),
+                b"[" + prefix,
+                b"+" if end is None else b"(" + end,
+            )
+        )
+
+    async def delete_items(
+        self, key: MemKey, items: Sequence[bytes], version: int
+    ) -> None:
+        if not await self._delete_items(
+            keys=[self._items_key(key), self._version_key(key)],
+            args=[version, *items],
+        ):
+            raise CompareMismatch()
+
+    # Sets are plain Redis sets, next to another one of their members' groups.
+    # An emptied set disappears by itself, the scripts take care of the groups.
+
+    async def add_to_set(
+        self, key: MemKey, member: bytes, group: bytes
+    ) -> tuple[bool, bool]:
+        created, regrouped = await self._add_to_set(
+            keys=[self._set_key(key), self._set_groups_key(key)],
+            args=[member, group],
+        )
+        return bool(created), bool(regrouped)
+
+    async def get_set(self, key: MemKey) -> frozenset[bytes]:
+        return frozenset(await self.client.smembers(self._set_key(key)))
+
+    async def remove_from_set(
+        self, key: MemKey, members: Iterable[bytes]
+    ) -> frozenset[bytes]:
+        remaining = await self._remove_from_set(
+            keys=[self._set_key(key), self._set_groups_key(key)],
+            args=list(members),
+        )
+        return frozenset(remaining)
@@ -0,0 +1,640 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import tempfile
+import time
+import uuid
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import override
+
+from ..queue import Message, Queue, QueueInfo, QueueIsEmpty
+from ..store import Cache, CompareMismatch, MemKey, NotFoundError, Store, prefix_end
+
+logger = logging.getLogger(__name__)
+
+
+# Queue bodies have no declared type, so SQLite keeps them as they were put
+# in: text comes back out as str, blobs as bytes.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS store (
+    key TEXT PRIMARY KEY, value BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT NOT NULL, item BLOB NOT NULL, PRIMARY KEY (key, item)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS versions (
+    key TEXT PRIMARY KEY, version INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sets (
+    key TEXT NOT NULL, member BLOB NOT NULL, PRIMARY KEY (key, member)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS set_groups (
+    key TEXT NOT NULL, grp BLOB NOT NULL, PRIMARY KEY (key, grp)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY, value INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, body NOT NULL
+);
+CREATE INDEX IF NOT EXISTS queue_topic ON queue (topic, id);
+"""
+
+# Stay well below SQLite's limit on the number of parameters in a statement
+_MAX_PARAMS = 500
+
+
+def _key2str(key: MemKey) -> str:
+    return f"{key.type}/{key.call_hash}"
+
+
+@contextlib.contextmanager
+def _transaction(conn: sqlite3.Connection) -> Iterator[None]:
+    # Take the write lock up front: a read transaction which later turns into
+    # a write can fail on a busy database, where this just waits its turn.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+class _Database:
+    """A connection to a SQLite file in WAL mode, on a thread of its own.
+
+    SQLite calls block, so they all run on this one thread, which also
+    serializes them.  Other processes using the same file each have their own
+    connection, and SQLite's file locks keep them apart.
+
+    """
+
+    def __init__(self, path: str | os.PathLike[str], busy_timeout_ms: int):
+        self.path = Path(path)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._conn: sqlite3.Connection | None = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="brrr-sqlite")
+
+    def _connect(self) -> sqlite3.Connection:
+        # No implicit transactions: they're all explicit, see _transaction
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        # Durable as of the last checkpoint, which is plenty for WAL mode
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def _call[T](self, f: Callable[[sqlite3.Connection], T]) -> T:
+        if self._conn is None:
+            self._conn = self._connect()
+        return f(self._conn)
+
+    async def run[T](self, f: Callable[[sqlite3.Connection], T]) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, f)
+
+    async def close(self) -> None:
+        def close(conn: sqlite3.Connection) -> None:
+            conn.close()
+            self._conn = None
+
+        if self._conn is not None:
+            await self.run(close)
+        self._executor.shutdown()
+
+
+class SqliteStore(Store, Cache):
+    """A durable store and cache in a local SQLite file.
+
+    Meant for deployments on a single machine: any number of workers, in any
+    number of processes, can share the same file.  Every operation is a single
+    statement or transaction, so compare-and-set is just a conditional write.
+
+    The file can be the same one as a SqliteQueue's.
+
+    """
+
+    supports_set_and_compare_and_set = True
+    supports_items = True
+    supports_sets = True
+
+    def __init__(self, path: str | os.PathLike[str], *, busy_timeout_ms: int = 5000):
+        self._db = _Database(path, busy_timeout_ms)
+
+    async def close(self) -> None:
+        await self._db.close()
+
+    @override
+    async def has(self, key: MemKey) -> bool:
+        def has(conn: sqlite3.Connection) -> bool:
+            sql = "SELECT 1 FROM store WHERE key = ?"
+            return conn.execute(sql, (_key2str(key),)).fetchone() is not None
+
+        return await self._db.run(has)
+
+    @override
+    async def get(self, key: MemKey) -> bytes:
+        def get(conn: sqlite3.Connection) -> bytes | None:
+            sql = "SELECT value FROM store WHERE key = ?"
+            row = conn.execute(sql, (_key2str(key),)).fetchone()
+            return None if row is None else row[0]
+
+        value = await self._db.run(get)
+        if value is None:
+            raise NotFoundError(key)
+        return value
+
+    @override
+    async def get_with_retry(self, key: MemKey) -> bytes:
+        # Always read-after-write consistent
+        return await self.get(key)
+
+    @override
+    async def get_many(self, keys: Sequence[MemKey]) -> list[bytes | None]:
+        strs = list(map(_key2str, keys))
+
+        def get_many(conn: sqlite3.Connection) -> dict[str, bytes]:
+            found: dict[str, bytes] = {}
+            for i in range(0, len(strs), _MAX_PARAMS):
+                chunk = strs[i : i + _MAX_PARAMS]
+                marks = ", ".join("?" * len(chunk))
+                sql = f"SELECT key, value FROM store WHERE key IN ({marks})"
+                found.update(conn.execute(sql, chunk).fetchall())
+            return found
+
+        found = await self._db.run(get_many) if strs else {}
+        return [found.get(k) for k in strs]
+
+    @override
+    async def set(self, key: MemKey, value: bytes) -> None:
+        await self.set_many([(key, value)])
+
+    @override
+    async def set_many(self, items: Sequence[tuple[MemKey, bytes]]) -> None:
+        rows = [(_key2str(key), value) for key, value in items]
+
+        def set_many(conn: sqlite3.Connection) -> None:
+            with _transaction(conn):
+                conn.executemany(
+                    "INSERT INTO store (key, value) VALUES (?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    rows,
+                )
+
+        if rows:
+            await self._db.run(set_many)
+
+    @override
+    async def delete(self, key: MemKey) -> None:
+        def delete(conn: sqlite3.Connection) -> None:
+            conn.execute("DELETE FROM store WHERE key = ?", (_key2str(key),))
+
+        await self._db.run(delete)
+
+    @staticmethod
+    def _insert_new(conn: sqlite3.Connection, key: MemKey, value: bytes) -> bool:
+        cursor = conn.execute(
+            "INSERT INTO store (key, value) VALUES (?, ?) ON CONFLICT DO NOTHING",
+            (_key2str(key), value),
+        )
+        return cursor.rowcount == 1
+
+    @staticmethod
+    def _update(
+        conn: sqlite3.Connection, key: MemKey, value: bytes, expected: bytes
+    ) -> bool:
+        cursor = conn.execute(
+            "UPDATE store SET value = ? WHERE key = ? AND value = ?",
+            (value, _key2str(key), expected),
+        )
+        return cursor.rowcount == 1
+
+    @override
+    async def set_new_value(self, key: MemKey, value: bytes) -> None:
+        if not await self._db.run(lambda conn: self._insert_new(conn, key, value)):
+            raise CompareMismatch()
+
+    @override
+    async def compare_and_set(self, key: MemKey, value: bytes, expected: bytes) -> None:
+        if not await self._db.run(
+            lambda conn: self._update(conn, key, value, expected)
+        ):
+            raise CompareMismatch()
+
+    @override
+    async def compare_and_delete(self, key: MemKey, expected: bytes) -> None:
+        def compare_and_delete(conn: sqlite3.Connection) -> bool:
+            cursor = conn.execute(
+                "DELETE FROM store WHERE key = ? AND value = ?",
+                (_key2str(key), expected),
+            )
+            return cursor.rowcount == 1
+
+        if not await self._db.run(compare_and_delete):
+            raise CompareMismatch()
+
+    @override
+    async def set_and_compare_and_set(
+        self,
+        items: Sequence[tuple[MemKey, bytes]],
+        key: MemKey,
+        value: bytes,
+        expected: bytes | None,
+    ) -> None:
+        rows = [(_key2str(k), v) for k, v in items]
+
+        def set_and_compare_and_set(conn: sqlite3.Connection) -> None:
+            with _transaction(conn):
+                if expected is None:
+                    ok = self._insert_new(conn, key, value)
+                else:
+                    ok = self._update(conn, key, value, expected)
+                if not ok:
+                    raise CompareMismatch()
+                conn.executemany(
+                    "INSERT INTO store (key, value) VALUES (?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    rows,
+                )
+
+        await self._db.run(set_and_compare_and_set)
+
+    @override
+    async def add_item(self, key: MemKey, item: bytes) -> int:
+        k = _key2str(key)
+
+        def add_item(conn: sqlite3.Connection) -> int:
+            with _transaction(conn):
+                conn.execute(
+                    "INSERT INTO items (key, item) VALUES (?, ?) "
+                    "ON CONFLICT DO NOTHING",
+                    (k, item),
+                )
+                (version,) = conn.execute(
+                    "INSERT INTO versions (key, version) VALUES (?, 1) "
+                    "ON CONFLICT (key) DO UPDATE SET version = version + 1 "
+                    "RETURNING version",
+                    (k,),
+                ).fetchone()
+            return int(version)
+
+        return await self._db.run(add_item)
+
+    @staticmethod
+    def _version(conn: sqlite3.Connection, k: str) -> int:
+        sql = "SELECT version FROM versions WHERE key = ?"
+        row = conn.execute(sql, (k,)).fetchone()
+        return 0 if row is None else int(row[0])
+
+    @override
+    async def get_item_version(self, key: MemKey) -> int:
+        return await self._db.run(lambda conn: self._version(conn, _key2str(key)))
+
+    @override
+    async def get_items(self, key: MemKey, prefix: bytes = b"") -> list[bytes]:
+        # Blobs compare by their bytes, so the primary key finds the range
+        end = prefix_end(prefix)
+        sql = "SELECT item FROM items WHERE key = ? AND item >= ?"
+        args: tuple[str | bytes, ...] = (_key2str(key), prefix)
+        if end is not None:
+            sql += " AND item < ?"
+            args += (end,)
+
+        def get_items(conn: sqlite3.Connection) -> list[bytes]:
+            return [row[0] for row in conn.execute(sql, args)]
+
+        return await self._db.run(get_items)
+
+    @override
+    async def delete_items(
+        self, key: MemKey, items: Sequence[bytes], version: int
+    ) -> None:
+        k = _key2str(key)
+
+        def delete_items(conn: sqlite3.Connection) -> bool:
+            with _transaction(conn):
+                conn.executemany(
+                    "DELETE FROM items WHERE key = ? AND item = ?",
+                    [(k, item) for item in items],
+                )
+                if self._version(conn, k) != version:
+                    return False
+                conn.execute("DELETE FROM versions WHERE key = ?", (k,))
+                return True
+
+        if not await self._db.run(delete_items):
+            raise CompareMismatch()
+
+    @staticmethod
+    def _members(conn: sqlite3.Connection, k: str) -> frozenset[bytes]:
+        sql = "SELECT member FROM sets WHERE key = ?"
+        return frozenset(row[0] for row in conn.execute(sql, (k,)))
+
+    @override
+    async def add_to_set(
+        self, key: MemKey, member: bytes, group: bytes
+    ) -> tuple[bool, bool]:
+        k = _key2str(key)
+
+        def add_to_set(conn: sqlite3.Connection) -> tuple[bool, bool]:
+            with _transaction(conn):
+                sql = "SELECT 1 FROM sets WHERE key = ? LIMIT 1"
+                created = conn.execute(sql, (k,)).fetchone() is None
+                added = conn.execute(
+                    "INSERT INTO sets (key, member) VALUES (?, ?) "
+                    "ON CONFLICT DO NOTHING",
+                    (k, member),
+                ).rowcount
+                if not added:
+                    return created, False
+                grouped = conn.execute(
+                    "INSERT INTO set_groups (key, grp) VALUES (?, ?) "
+                    "ON CONFLICT DO NOTHING",
+                    (k, group),
+                ).rowcount
+                return created, not grouped
+
+        return await self._db.run(add_to_set)
+
+    @override
+    async def get_set(self, key: MemKey) -> frozenset[bytes]:
+        return await self._db.run(lambda conn: self._members(conn, _key2str(key)))
+
+    @override
+    async def remove_from_set(
+        self, key: MemKey, members: Iterable[bytes]
+    ) -> frozenset[bytes]:
+        k = _key2str(key)
+        rows = [(k, member) for member in members]
+
+        def remove_from_set(conn: sqlite3.Connection) -> frozenset[bytes]:
+            with _transaction(conn):
+                conn.executemany("DELETE FROM sets WHERE key = ? AND member = ?", rows)
+                remaining = self._members(conn, k)
+                if not remaining:
+                    conn.execute("DELETE FROM set_groups WHERE key = ?", (k,))
+                return remaining
+
+        return await self._db.run(remove_from_set)
+
+    @override
+    async def incr(self, key: str) -> int:
+        return await self.incr_by(key, 1)
+
+    @override
+    async def incr_by(self, key: str, n: int) -> int:
+        def incr_by(conn: sqlite3.Connection) -> int:
+            (value,) = conn.execute(
+                "INSERT INTO cache (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = value + excluded.value "
+                "RETURNING value",
+                (key, n),
+            ).fetchone()
+            return int(value)
+
+        return await self._db.run(incr_by)
+
+
+# Longer topics wake up every receiver instead
+_MAX_WAKEUP_TOPIC = 1024
+
+
+class _Wakeups:
+    """Wake up receivers waiting on the same SQLite file, in any local process.
+
+    Every queue binds a Unix datagram socket in a directory which belongs to
+    the file, and every put sends its topic to all of them.  One reader per
+    socket wakes up all of that queue's receivers waiting on the topic.
+    Sockets left behind by dead processes are cleaned up by the next put.
+    Without Unix sockets, receivers fall back to polling.
+
+    """
+
+    def __init__(self, path: Path):
+        # Socket paths are limited to about a hundred bytes, so not next to
+        # the file itself.
+        digest = hashlib.sha256(str(path.resolve()).encode("utf-8")).hexdigest()
+        self.dir = Path(tempfile.gettempdir()) / f"brrr-sqlite-{digest[:16]}"
+        self._sock: socket.socket | None = None
+        self._sock_path: Path | None = None
+        self._sender: socket.socket | None = None
+        # The loop reading from the socket, and who's waiting for which topic
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._watchers: dict[str, set[asyncio.Event]] = {}
+
+    @property
+    def supported(self) -> bool:
+        return hasattr(socket, "AF_UNIX")
+
+    def _listen(self) -> None:
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            path = self.dir / f"{os.getpid()}-{uuid.uuid4().hex[:12]}.sock"
+            while True:
+                self.dir.mkdir(exist_ok=True)
+                try:
+                    sock.bind(str(path))
+                    break
+                except FileNotFoundError:
+                    # Removed by another process closing, just now
+                    continue
+            self._sock, self._sock_path = sock, path
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.remove_reader(self._sock)
+            loop.add_reader(self._sock, self._read)
+            self._loop = loop
+
+    def _read(self) -> None:
+        assert self._sock is not None
+        with contextlib.suppress(BlockingIOError):
+            while True:
+                topic = self._sock.recv(_MAX_WAKEUP_TOPIC).decode("utf-8")
+                if topic:
+                    woken = list(self._watchers.get(topic, ()))
+                else:
+                    woken = [e for events in self._watchers.values() for e in events]
+                for event in woken:
+                    event.set()
+
+    @contextlib.contextmanager
+    def watch(self, topics: Sequence[str]) -> Iterator[asyncio.Event]:
+        """An event which is set by every put on these topics, from now on."""
+        event = asyncio.Event()
+        if self.supported:
+            self._listen()
+        for topic in topics:
+            self._watchers.setdefault(topic, set()).add(event)
+        try:
+            yield event
+        finally:
+            for topic in topics:
+                watchers = self._watchers[topic]
+                watchers.discard(event)
+                if not watchers:
+                    del self._watchers[topic]
+
+    def notify(self, topic: str) -> None:
+        """Wake up everybody waiting on this topic.
+
+        Blocking, for the database's thread.
+
+        """
+        if not self.supported:
+            return
+        if self._sender is None:
+            self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sender.setblocking(False)
+        try:
+            names = os.listdir(self.dir)
+        except FileNotFoundError:
+            return
+        wakeup = topic.encode("utf-8")
+        if len(wakeup) > _MAX_WAKEUP_TOPIC:
+            wakeup = b""
+        for name in names:
+            path = self.dir / name
+            try:
+                self._sender.sendto(wakeup, str(path))
+            except BlockingIOError:
+                # Its buffer is full of wake-ups already
+                pass
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Nobody listening anymore
+                with contextlib.suppress(FileNotFoundError):
+                    path.unlink()
+            except OSError as e:
+                logger.debug(f"Failed to wake up {path}: {e}")
+
+    def close(self) -> None:
+        if self._loop is not None and self._sock is not None:
+            if not self._loop.is_closed():
+                self._loop.remove_reader(self._sock)
+            self._loop = None
+        for sock in (self._sock, self._sender):
+            if sock is not None:
+                sock.close()
+        if self._sock_path is not None:
+            with contextlib.suppress(FileNotFoundError):
+                self._sock_path.unlink()
+            # Unless somebody else is still waiting
+            with contextlib.suppress(OSError):
+                self.dir.rmdir()
+        self._sock = self._sock_path = self._sender = None
+
+
+class SqliteQueue(Queue):
+    """A durable queue in a local SQLite file, shared between local processes.
+
+    Messages are deleted as they are received.  Receivers block until a
+    message is put on the queue by any process using the same file, or until
+    recv_block_secs have passed.  They check the file every poll_secs anyway,
+    in case a wake-up was missed.
+
+    """
+
+    has_accurate_info = True
+
+    def __init__(
+        self,
+        path: str | os.PathLike[str],
+        *,
+        busy_timeout_ms: int = 5000,
+        poll_secs: float = 1.0,
+    ):
+        self._db = _Database(path, busy_timeout_ms)
+        self._wakeups = _Wakeups(self._db.path)
+        self.poll_secs = poll_secs
+
+    async def close(self) -> None:
+        self._wakeups.close()
+        await self._db.close()
+
+    async def _put(self, topic: str, bodies: Sequence[str | bytes]) -> None:
+        rows = [(topic, body) for body in bodies]
+
+        def put(conn: sqlite3.Connection) -> None:
+            with _transaction(conn):
+                conn.executemany("INSERT INTO queue (topic, body) VALUES (?, ?)", rows)
+            self._wakeups.notify(topic)
+
+        if rows:
+            await self._db.run(put)
+
+    @override
+    async def put_message(self, topic: str, body: str) -> None:
+        await self._put(topic, [body])
+
+    @override
+    async def put_messages(self, topic: str, bodies: Sequence[str]) -> None:
+        await self._put(topic, bodies)
+
+    @override
+    async def put_message_bytes(self, topic: str, body: bytes) -> None:
+        await self._put(topic, [body])
+
+    @override
+    async def put_messages_bytes(self, topic: str, bodies: Sequence[bytes]) -> None:
+        await self._put(topic, bodies)
+
+    def _pop(
+        self, conn: sqlite3.Connection, topics: Sequence[str], max_n: int
+    ) -> tuple[str, list[Message]] | None:
+        for topic in topics:
+            # A single statement, so no two receivers get the same message
+            rows = conn.execute(
+                "DELETE FROM queue WHERE id IN "
+                "(SELECT id FROM queue WHERE topic = ? ORDER BY id LIMIT ?) "
+                "RETURNING id, body",
+                (topic, max_n),
+            ).fetchall()
+            if rows:
+                return topic, [Message(body) for _, body in sorted(rows)]
+        return None
+
+    @override
+    async def get_messages_any(
+        self, topics: Sequence[str], max_n: int
+    ) -> tuple[str, Sequence[Message]]:
+        deadline = time.monotonic() + self.recv_block_secs
+        with self._wakeups.watch(topics) as woken:
+            while True:
+                # Clear before checking so nothing put in the meantime is missed
+                woken.clear()
+                found = await self._db.run(lambda conn: self._pop(conn, topics, max_n))
+                if found is not None:
+                    return found
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise QueueIsEmpty()
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(woken.wait(), min(remaining, self.poll_secs))
+
+    @override
+    async def get_messages(self, topic: str, max_n: int) -> Sequence[Message]:
+        _, messages = await self.get_messages_any([topic], max_n)
+        return messages
+
+    @override
+    async def get_message(self, topic: str) -> Message:
+        [message] = await self.get_messages(topic, 1)
+        return message
+
+    async def get_info(self, topic: str) -> QueueInfo:
+        def count(conn: sqlite3.Connection) -> int:
+            sql = "SELECT count(*) FROM queue WHERE topic = ?"
+            return int(conn.execute(sql, (topic,)).fetchone()[0])
+
+        return QueueInfo(num_messages=await self._db.run(count))
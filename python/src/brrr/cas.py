@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import random
+from abc import ABC, abstractmethod
+from collections import Counter
+from collections.abc import Mapping
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .store import MemKey
+
+
+class CasRetryPolicy(ABC):
+    """When, and whether, to retry a compare-and-set operation which lost."""
+
+    @abstractmethod
+    def delay(self, key: MemKey, attempt: int) -> float | None:
+        """Seconds to wait before the next attempt, or None to give up.
+
+        The attempt is the number of attempts on this key which failed so far,
+        starting at 1.
+
+        """
+        raise NotImplementedError()
+
+
+class ImmediateRetry(CasRetryPolicy):
+    """Retry straight away, up to a fixed number of attempts."""
+
+    def __init__(self, max_attempts: int = 100):
+        self.max_attempts = max_attempts
+
+    def delay(self, key: MemKey, attempt: int) -> float | None:
+        return None if attempt >= self.max_attempts else 0.0
+
+
+class ExponentialBackoff(CasRetryPolicy):
+    """Exponential backoff with full jitter.
+
+    Every worker waiting on a hot key picks a random delay up to an
+    exponentially growing limit, which spreads their retries out rather than
+    having them all collide again on the next attempt.
+
+    The maximum number of attempts can be overridden per key type, e.g.
+    "pending_returns", to give up sooner on anything else.  It applies to
+    every key of that type alike, not to any key in particular.
+
+    """
+
+    def __init__(
+        self,
+        base: float = 0.002,
+        cap: float = 0.5,
+        max_attempts: int = 100,
+        max_attempts_by_type: Mapping[str, int] | None = None,
+    ):
+        self.base = base
+        self.cap = cap
+        self.max_attempts = max_attempts
+        self.max_attempts_by_type = dict(max_attempts_by_type or {})
+
+    def delay(self, key: MemKey, attempt: int) -> float | None:
+        if attempt >= self.max_attempts_by_type.get(key.type, self.max_attempts):
+            return None
+        # Don't compute huge powers only to cap them
+        limit = self.cap if attempt > 30 else min(self.cap, self.base * 2**attempt)
+        return random.uniform(0, limit)
+
+
+class CasStats:
+    """Counts of compare-and-set attempts, by key type.
+
+    Every operation records how many attempts it took in a histogram, so the
+    contention on every kind of key, and the conditional writes wasted on it,
+    are easy to tell.  Not thread safe, like the rest of Memory.
+
+    """
+
+    # Key type -> attempts -> number of operations which took that many
+    attempts: dict[str, Counter[int]]
+    # Key type -> number of operations which ran out of attempts
+    exhausted: Counter[str]
+
+    def __init__(self) -> None:
+        self.attempts = {}
+        self.exhausted = Counter()
+
+    def record(self, key: MemKey, attempts: int, exhausted: bool = False) -> None:
+        self.attempts.setdefault(key.type, Counter())[attempts] += 1
+        if exhausted:
+            self.exhausted[key.type] += 1
+
+    def operations(self, key_type: str) -> int:
+        return self.attempts.get(key_type, Counter()).total()
+
+    def conflicts(self, key_type: str) -> int:
+        """Failed attempts, i.e. wasted conditional writes, on this key type."""
+        histogram = self.attempts.get(key_type, Counter())
+        # Every operation's last attempt succeeded, unless it gave up
+        failed = sum((n - 1) * count for n, count in histogram.items())
+        return failed + self.exhausted[key_type]
+
+    def clear(self) -> None:
+        self.attempts.clear()
+        self.exhausted.clear()
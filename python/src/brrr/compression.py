@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import lzma
+import zlib
+from collections.abc import Callable
+from typing import Any, Literal
+
+type Algorithm = Literal["zlib", "lzma", "zstd"]
+
+# Compressed records start with this magic, followed by a single byte for the
+# algorithm.  Anything else is a plain, uncompressed record, which is how
+# records written before compression existed still decode.  Plain records which
+# happen to start with the magic themselves are escaped as algorithm 0.
+MAGIC = b"\x00brrr-z\x00"
+
+_RAW = 0
+_IDS: dict[Algorithm, int] = {"zlib": 1, "lzma": 2, "zstd": 3}
+
+
+def _zstd() -> Any:
+    try:
+        import zstandard  # type: ignore[import-not-found, unused-ignore]
+    except ImportError as e:
+        raise ImportError("zstd compression requires the zstandard package") from e
+    return zstandard
+
+
+def _compressor(algorithm: Algorithm) -> Callable[[bytes], bytes]:
+    match algorithm:
+        case "zlib":
+            return zlib.compress
+        case "lzma":
+            return lzma.compress
+        case "zstd":
+            compressor = _zstd().ZstdCompressor()
+            return lambda data: bytes(compressor.compress(data))
+
+
+_DECOMPRESSORS: dict[int, Callable[[bytes], bytes]] = {
+    _RAW: lambda data: data,
+    _IDS["zlib"]: zlib.decompress,
+    _IDS["lzma"]: lzma.decompress,
+    _IDS["zstd"]: lambda data: bytes(_zstd().ZstdDecompressor().decompress(data)),
+}
+
+
+class Compression:
+    """Compress records at or above a size threshold.
+
+    Only keeps the compressed version if it is actually smaller.  Decompression
+    always works, regardless of the configured algorithm, so workers with
+    different settings can share a store.
+
+    """
+
+    def __init__(self, algorithm: Algorithm | None = None, threshold: int = 1024):
+        self.algorithm = algorithm
+        self.threshold = threshold
+        self._compress = _compressor(algorithm) if algorithm else None
+
+    def compress(self, data: bytes) -> bytes:
+        if self._compress is not None and len(data) >= self.threshold:
+            compressed = self._compress(data)
+            if len(compressed) + len(MAGIC) + 1 < len(data):
+                assert self.algorithm
+                return MAGIC + bytes([_IDS[self.algorithm]]) + compressed
+        if data.startswith(MAGIC):
+            return MAGIC + bytes([_RAW]) + data
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        if not data.startswith(MAGIC):
+            return data
+        algorithm_id = data[len(MAGIC)]
+        if algorithm_id not in _DECOMPRESSORS:
+            raise ValueError(f"Unknown compression algorithm: {algorithm_id}")
+        return _DECOMPRESSORS[algorithm_id](data[len(MAGIC) + 1 :])
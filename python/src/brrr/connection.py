@@ -8,16 +8,21 @@ from collections.abc import (
     Awaitable,
     Callable,
     Iterable,
+    Iterator,
+    Mapping,
+    Sequence,
 )
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
 from dataclasses import dataclass
+from typing import Any, Unpack
 from uuid import uuid4
 
 from .call import Call
-from .queue import Queue, QueueIsClosed, QueueIsEmpty
+from .queue import Message, Queue, QueueIsClosed, QueueIsEmpty
 from .store import (
     Cache,
     Memory,
+    MemoryOptions,
     NotFoundError,
     Store,
 )
@@ -64,30 +69,75 @@ class Response:
     payload: bytes
 
 
+@dataclass
+class DrainReport:
+    # Messages which were handled to completion, or failed, during the drain
+    finished: int
+    # Messages which were cancelled halfway through their handler when the
+    # drain timed out, with their topic
+    abandoned: list[tuple[str, Message]]
+
+
+@dataclass
+class _EagerBudget:
+    # Inline handler calls left for this message
+    calls: int
+
+
 type Handler = Callable[[Request, Connection], Awaitable[Response | Defer]]
 
 
 @asynccontextmanager
 async def connect(
-    queue: Queue, store: Store, cache: Cache
+    queue: Queue, store: Store, cache: Cache, **options: Unpack[MemoryOptions]
 ) -> AsyncIterator[Connection]:
     """Create a client-only connection without the ability to handle jobs.
 
-    It can schedule new tasks and read values from the kv store though!
+    It can schedule new tasks and read values from the kv store though!  See
+    MemoryOptions for the options.
 
     """
     # Technically unnecessary for this to be a contextmanager today but it fits
     # the expected API for this, and it leaves the door open for some activity
     # on join / leave (e.g. counting active clients in the cache).
-    yield Connection(queue, store, cache)
+    yield Connection(queue, store, cache, **options)
 
 
 @asynccontextmanager
-async def serve(queue: Queue, store: Store, cache: Cache) -> AsyncIterator[Server]:
+async def serve(
+    queue: Queue,
+    store: Store,
+    cache: Cache,
+    *,
+    eager_depth: int = 0,
+    eager_calls: int = 100,
+    **options: Unpack[MemoryOptions],
+) -> AsyncIterator[Server]:
+    """Create a server which can handle jobs with Server.loop.
+
+    Setting eager_depth makes the server handle children on its own topic
+    right away, up to that many levels deep, instead of putting them on the
+    queue and waiting for them to come back around.  Their values and pending
+    returns are stored all the same, so to the rest of brrr it's as if they
+    went via the queue.  At most eager_calls handlers are run this way for any
+    one message from the queue, after which it's back to the queue as usual.
+    This saves a lot of queue round trips for deep and narrow call graphs, at
+    the cost of parallelism: eager children are handled one at a time.
+
+    Any other options are passed on to Memory, see MemoryOptions.
+
+    """
     # I guess you could give the end user even more control but at some
     # point I think this API is fine.  Who really needs access to the server
     # instance?
-    yield Server(queue, store, cache)
+    yield Server(
+        queue,
+        store,
+        cache,
+        eager_depth=eager_depth,
+        eager_calls=eager_calls,
+        **options,
+    )
 
 
 class Connection:
@@ -117,30 +167,68 @@ class Connection:
     # A queue of call keys to be processed
     _queue: Queue
 
-    def __init__(self, queue: Queue, store: Store, cache: Cache):
+    def __init__(
+        self,
+        queue: Queue,
+        store: Store,
+        cache: Cache,
+        **options: Unpack[MemoryOptions],
+    ):
         self._cache = cache
-        self._memory = Memory(store)
+        self._memory = Memory(store, **options)
         self._queue = queue
 
     async def _put_job(self, topic: str, job: ScheduleMessage) -> None:
+        await self._put_jobs(topic, [job])
+
+    async def _put_jobs(self, topic: str, jobs: Sequence[ScheduleMessage]) -> None:
+        """Put these jobs on the queue, as few round trips as possible.
+
+        Jobs are counted against the spawn limit in the order given.  Those
+        which fit within the limit are enqueued before raising a
+        SpawnLimitError for the rest.
+
+        """
+        allowed, rejected = await self._admit(jobs)
+        await self._queue.put_messages_bytes(topic, [job.encode() for job in allowed])
+        if rejected:
+            raise self._spawn_limit_error(rejected[0])
+
+    async def _admit(
+        self, jobs: Sequence[ScheduleMessage]
+    ) -> tuple[list[ScheduleMessage], list[ScheduleMessage]]:
+        """Count jobs against the spawn limit: which ones are allowed to run?"""
         # Incredibly mother-of-all ad-hoc definitions.  Doesn’t use the topic
         # for counting spawn limits: the spawn limit is currently intended to
         # never be hit at all: it’s a /semantic/ check, not a /runtime/ check.
         # It’s not intended for example to give paying customers a higher spawn
         # limit than free ones.  It’s intended to catch infinite recursion and
         # non-idempotent call graphs.
-        if (await self._cache.incr(f"brrr_count/{job.root_id}")) > self._spawn_limit:
-            msg = f"Spawn limit {self._spawn_limit} reached for {job.root_id} at job {job.call_hash}"
-            logger.error(msg)
-            # Throw here because it allows the user of brrrlib to decide how to
-            # handle this: what kind of logging?  Does the worker crash in order
-            # to flag the problem to the service orchestrator, relying on auto
-            # restarts to maintain uptime while allowing monitoring to go flag a
-            # bigger issue to admins?  Or just wrap it in a while True loop
-            # which catches and ignores specifically this error?
-            raise SpawnLimitError(msg)
-
-        await self._queue.put_message(topic, job.encode().decode("utf-8"))
+        by_root: dict[str, list[ScheduleMessage]] = {}
+        for job in jobs:
+            by_root.setdefault(job.root_id, []).append(job)
+
+        allowed: list[ScheduleMessage] = []
+        rejected: list[ScheduleMessage] = []
+        for root_id, root_jobs in by_root.items():
+            n = len(root_jobs)
+            count = await self._cache.incr_by(f"brrr_count/{root_id}", n)
+            # How many of these were still below the limit before we came in
+            room = max(0, min(n, self._spawn_limit - (count - n)))
+            allowed.extend(root_jobs[:room])
+            rejected.extend(root_jobs[room:])
+        return allowed, rejected
+
+    def _spawn_limit_error(self, job: ScheduleMessage) -> SpawnLimitError:
+        msg = f"Spawn limit {self._spawn_limit} reached for {job.root_id} at job {job.call_hash}"
+        logger.error(msg)
+        # Throw here because it allows the user of brrrlib to decide how to
+        # handle this: what kind of logging?  Does the worker crash in order
+        # to flag the problem to the service orchestrator, relying on auto
+        # restarts to maintain uptime while allowing monitoring to go flag a
+        # bigger issue to admins?  Or just wrap it in a while True loop which
+        # catches and ignores specifically this error?
+        return SpawnLimitError(msg)
 
     async def schedule_raw(
         self, topic: str, idempotency_key: str, task_name: str, payload: bytes
@@ -175,6 +263,34 @@ class Connection:
             return None
 
 
+class _WeightedRoundRobin:
+    """Smooth weighted round-robin, as popularized by nginx.
+
+    Every round, each topic earns its weight in credit, and the topic with the
+    most credit goes first and pays for it.  Over total-weight rounds every
+    topic goes first exactly weight times, interleaved rather than in bursts.
+
+    """
+
+    def __init__(self, weights: Mapping[str, int]):
+        for topic, weight in weights.items():
+            if weight < 1:
+                raise ValueError(f"Weight for topic {topic} must be at least 1")
+        if not weights:
+            raise ValueError("Need at least one topic")
+        self._weights = dict(weights)
+        self._total = sum(weights.values())
+        self._credit = dict.fromkeys(weights, 0)
+
+    def next_order(self) -> list[str]:
+        """All topics in order of preference for this round."""
+        for topic, weight in self._weights.items():
+            self._credit[topic] += weight
+        order = sorted(self._credit, key=self._credit.__getitem__, reverse=True)
+        self._credit[order[0]] -= self._total
+        return order
+
+
 # Separate classes for now, might not need to be, although it does leave open
 # the possibility of having different queue protocols: consumer vs producer
 # queue?
@@ -189,8 +305,51 @@ class Server(Connection):
     # Singleton to count global number of workers for logging purposes only
     _total_workers = 0
 
-    def __init__(self, queue: Queue, store: Store, cache: Cache):
-        super().__init__(queue, store, cache)
+    # Set once draining starts: no loop takes any new messages after that.
+    _draining: asyncio.Event
+    # Every message being handled by any loop on this server, by the task
+    # handling it, with a future which is done once it's over: cancelled if it
+    # was abandoned.
+    _in_flight: dict[asyncio.Task[Any], tuple[str, Message, asyncio.Future[None]]]
+    # The subset of those tasks which are done calling the handler and are
+    # writing out the result.
+    _committing: set[asyncio.Task[Any]]
+    # Loops waiting for a message in their own task, for a drain to interrupt.
+    _receiving: set[asyncio.Task[Any]]
+    # Every loop running on this server, by its task, with a future which is
+    # done once it returns.  A drain waits for those: a loop can hold messages
+    # it received but hasn't started handling yet.
+    _loops: dict[asyncio.Task[Any], asyncio.Future[None]]
+    # Drains waiting to hear about messages starting, in case they're late.
+    _tracking: set[asyncio.Future[None]]
+    # Messages handled to the end by any loop on this server, ever.
+    _handled: int
+
+    # Handle children on our own topic inline, up to this deep.  0 is off.
+    _eager_depth: int
+    # Maximum inline handler calls per message from the queue.
+    _eager_calls: int
+
+    def __init__(
+        self,
+        queue: Queue,
+        store: Store,
+        cache: Cache,
+        *,
+        eager_depth: int = 0,
+        eager_calls: int = 100,
+        **options: Unpack[MemoryOptions],
+    ):
+        super().__init__(queue, store, cache, **options)
+        self._eager_depth = eager_depth
+        self._eager_calls = eager_calls
+        self._draining = asyncio.Event()
+        self._in_flight = {}
+        self._committing = set()
+        self._receiving = set()
+        self._loops = {}
+        self._tracking = set()
+        self._handled = 0
         self._n = Server._total_workers
         Server._total_workers += 1
 
@@ -198,10 +357,10 @@ class Server(Connection):
         job = ScheduleMessage(root_id=ret.root_id, call_hash=ret.call_hash)
         await self._put_job(ret.topic, job)
 
-    async def _schedule_call_nested(
+    async def _schedule_calls_nested(
         self,
         my_topic: str,
-        child: DeferredCall,
+        children: Iterable[DeferredCall],
         parent: ScheduleMessage,
     ) -> None:
         """Schedule this call on the brrr workforce.
@@ -215,38 +374,137 @@ class Server(Connection):
         must kick off the parent (which is the thread doing the calling of this
         function, "now").
 
-        This will always kick off the call, it doesn't check if a return value
-        already exists for this call.
+        This will always kick off the calls, it doesn't check if a return
+        value already exists for them.
+
+        The resulting jobs are grouped by topic and enqueued in bulk, so wide
+        fan-outs only cost a few round trips to the cache and the queue.
 
         """
-        # First the call because it is perennial, it just describes the actual
-        # call being made, it doesn’t cause any further action and it’s safe
-        # under all races.
-        await self._memory.set_call(child.call)
-        # Note this can be immediately read out by a racing return call. The
+        ret = PendingReturn(
+            root_id=parent.root_id,
+            call_hash=parent.call_hash,
+            topic=my_topic,
+        )
+
+        # First the calls because they are perennial, they just describe the
+        # actual call being made, they don’t cause any further action and it’s
+        # safe under all races.  Then the pending returns.
+        #
+        # Note those can be immediately read out by a racing return call.  The
         # pathological case is: we are late to a party and another worker is
         # actually just done handling this call, and just before it reads out
         # the addresses to which to return, it is added here.  That’s still OK
         # because it will then immediately call this parent flow back, which is
         # fine because the result does in fact exist.
-        child_topic = child.topic or my_topic
-        call_hash = child.call.call_hash
-        ret = PendingReturn(
-            root_id=parent.root_id,
-            call_hash=parent.call_hash,
-            topic=my_topic,
+        children = list(children)
+        should_schedule = await self._memory.add_calls_with_pending_return(
+            [child.call for child in children], ret
         )
-        should_schedule = await self._memory.add_pending_return(call_hash, ret)
-        if should_schedule:
-            job = ScheduleMessage(
-                call_hash=call_hash,
-                root_id=parent.root_id,
-            )
-            await self._put_job(child_topic, job)
 
-    async def _handle_msg(self, handler: Handler, my_topic: str, payload: str) -> None:
-        msg = ScheduleMessage.decode(payload.encode("utf-8"))
-        call = await self._memory.get_call(msg.call_hash)
+        by_topic: dict[str, list[ScheduleMessage]] = {}
+        for child, schedule in zip(children, should_schedule):
+            if schedule:
+                job = ScheduleMessage(
+                    call_hash=child.call.call_hash, root_id=parent.root_id
+                )
+                by_topic.setdefault(child.topic or my_topic, []).append(job)
+
+        # Don't stop at the first spawn limit error: every topic gets as many
+        # of its jobs enqueued as allowed, just like separate puts would.
+        results = await asyncio.gather(
+            *(self._put_jobs(topic, jobs) for topic, jobs in by_topic.items()),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _handle_msg(
+        self, handler: Handler, my_topic: str, payload: bytes
+    ) -> None:
+        msg = ScheduleMessage.decode(payload)
+        await self._handle_job(handler, my_topic, msg, _EagerBudget(self._eager_calls))
+
+    async def _handle_and_ack(
+        self, handler: Handler, my_topic: str, message: Message
+    ) -> None:
+        try:
+            await self._handle_msg(handler, my_topic, message.body_bytes)
+        except SpawnLimitError:
+            # Handling this again can only hit the same limit
+            with self._committing_phase():
+                await self._queue.ack(my_topic, message)
+            raise
+        except Exception:
+            # This worker is alive and well: no need for the queue to wait
+            # until it looks dead to redeliver this.
+            with self._committing_phase():
+                await self._queue.nack(my_topic, message)
+            raise
+        # Only once it's done: a message whose handler failed, or whose worker
+        # died, is redelivered by queues which support that.
+        with self._committing_phase():
+            await self._queue.ack(my_topic, message)
+
+    def _track(self, task: asyncio.Task[Any], topic: str, message: Message) -> None:
+        handled = asyncio.get_running_loop().create_future()
+        self._in_flight[task] = (topic, message, handled)
+        for tracking in self._tracking:
+            if not tracking.done():
+                tracking.set_result(None)
+
+    def _untrack(self, task: asyncio.Task[Any], cancelled: bool) -> None:
+        _, _, handled = self._in_flight.pop(task)
+        if cancelled:
+            handled.cancel()
+        else:
+            self._handled += 1
+            handled.set_result(None)
+
+    def _drained(self, task: asyncio.Task[Any]) -> bool:
+        """Whether the drain, and only the drain, cancelled this task.
+
+        If so the cancellation is taken back: the loop in it just returns.
+
+        """
+        if self._draining.is_set() and task.cancelling() == 1:
+            task.uncancel()
+            return True
+        return False
+
+    @contextmanager
+    def _committing_phase(self) -> Iterator[None]:
+        # Getting interrupted while writing out results means the handler must
+        # be run again, and possibly its children too.  Make a drain wait for
+        # this instead.
+        task = asyncio.current_task()
+        assert task is not None
+        self._committing.add(task)
+        try:
+            yield
+        finally:
+            self._committing.discard(task)
+
+    async def _handle_job(
+        self,
+        handler: Handler,
+        my_topic: str,
+        msg: ScheduleMessage,
+        budget: _EagerBudget,
+        depth: int = 0,
+        call: Call | None = None,
+        absorb: PendingReturn | None = None,
+    ) -> bool:
+        """Handle a job, either from the queue or eagerly from its parent.
+
+        The pending return `absorb', if any, is not scheduled on the queue
+        when this call completes: the eager parent replays itself instead.
+        Returns whether that happened.
+
+        """
+        if call is None:
+            call = await self._memory.get_call(msg.call_hash)
 
         logger.debug(
             f"Calling {my_topic} -> {msg.root_id}/{msg.call_hash} -> {call.task_name}"
@@ -256,6 +514,19 @@ class Server(Connection):
         if isinstance(ret, Defer):
             logger.debug(f"Deferring {msg.root_id}/{msg.call_hash}: {call.task_name}")
 
+            eager: list[DeferredCall] = []
+            scheduled: list[DeferredCall] = []
+            for child in ret.calls:
+                if (
+                    depth < self._eager_depth
+                    and (child.topic or my_topic) == my_topic
+                    and budget.calls > 0
+                ):
+                    budget.calls -= 1
+                    eager.append(child)
+                else:
+                    scheduled.append(child)
+
             # Any of these calls could throw a SpawnLimitError: let that bubble
             # up.  This is very ugly but I want to keep the contract of throwing
             # exceptions on spawn limits, even though it’s _technically_ a user
@@ -266,53 +537,146 @@ class Server(Connection):
             # is Lisp’s restarts, where an exception doesn’t unroll the stack
             # but allows the caller to handle it from the point at which it
             # occurs.
-            async def handle_child(child: DeferredCall) -> None:
-                await self._schedule_call_nested(my_topic, child, msg)
-
-            await asyncio.gather(*map(handle_child, ret.calls))
-            return
+            with self._committing_phase():
+                await self._schedule_calls_nested(my_topic, scheduled, msg)
+            if not eager:
+                return False
+            return await self._run_eager(
+                handler, my_topic, eager, msg, call, budget, depth, absorb
+            )
 
         elif isinstance(ret, Response):
             logger.info(
                 f"Handled {my_topic} -> {msg.root_id}/{msg.call_hash} -> {call.task_name}"
             )
 
-            # This can end up in a race against another worker to write the
-            # value.
-            await self._memory.set_value(msg.call_hash, ret.payload)
-
-            # This is ugly and it’s tempting to use asyncio.gather with
-            # ‘return_exceptions=True’.  However note I don’t want to blanket catch
-            # all errors: only SpawnLimitError.  You’d need to do manual filtering
-            # of errors, check if there are any non-spawnlimiterrors, if so throw
-            # those immediately from the context block, otherwise throw a spawnlimit
-            # error once the context finishes.  It’s about as convoluted as just
-            # doing it this way, without any of the clarity.
-            spawn_limit_err = None
-
-            async def schedule_returns(returns: Iterable[PendingReturn]) -> None:
-                for pending in returns:
-                    try:
-                        await self._schedule_return_call(pending)
-                    except SpawnLimitError as e:
-                        logger.info(
-                            f"Spawn limit reached returning from {msg.call_hash} to {pending}; clearing the return"
-                        )
-                        nonlocal spawn_limit_err
-                        spawn_limit_err = e
-
-            await self._memory.with_pending_returns_remove(
-                msg.call_hash, schedule_returns
-            )
+            with self._committing_phase():
+                # This can end up in a race against another worker to write the
+                # value.
+                await self._memory.set_value(msg.call_hash, ret.payload)
+
+                # This is ugly and it’s tempting to use asyncio.gather with
+                # ‘return_exceptions=True’.  However note I don’t want to blanket catch
+                # all errors: only SpawnLimitError.  You’d need to do manual filtering
+                # of errors, check if there are any non-spawnlimiterrors, if so throw
+                # those immediately from the context block, otherwise throw a spawnlimit
+                # error once the context finishes.  It’s about as convoluted as just
+                # doing it this way, without any of the clarity.
+                spawn_limit_err = None
+                absorbed = False
+
+                async def schedule_returns(returns: Iterable[PendingReturn]) -> None:
+                    nonlocal absorbed
+                    for pending in returns:
+                        if pending == absorb:
+                            absorbed = True
+                            continue
+                        try:
+                            await self._schedule_return_call(pending)
+                        except SpawnLimitError as e:
+                            logger.info(
+                                f"Spawn limit reached returning from {msg.call_hash} to {pending}; clearing the return"
+                            )
+                            nonlocal spawn_limit_err
+                            spawn_limit_err = e
+
+                await self._memory.with_pending_returns_remove(
+                    msg.call_hash, schedule_returns
+                )
             if spawn_limit_err is not None:
                 raise spawn_limit_err
-            return
+            return absorbed
 
         else:
             raise ValueError("Unexpected return value from handler")
 
-    async def loop(self, topic: str, handler: Handler) -> None:
-        """Workers take jobs from the queue, one at a time, and handle them.
+    async def _run_eager(
+        self,
+        handler: Handler,
+        my_topic: str,
+        children: Sequence[DeferredCall],
+        parent: ScheduleMessage,
+        parent_call: Call,
+        budget: _EagerBudget,
+        depth: int,
+        absorb: PendingReturn | None,
+    ) -> bool:
+        """Handle these children right here, instead of via the queue.
+
+        The children are registered exactly as usual, pending return and all,
+        so to any other worker it looks like they were scheduled on the queue.
+        Their return to this parent is absorbed, and once they're done the
+        parent is replayed right here too.
+
+        """
+        ret = PendingReturn(
+            root_id=parent.root_id,
+            call_hash=parent.call_hash,
+            topic=my_topic,
+        )
+
+        with self._committing_phase():
+            # See _schedule_calls_nested
+            should_schedule = await self._memory.add_calls_with_pending_return(
+                [child.call for child in children], ret
+            )
+            prepared = [
+                (
+                    ScheduleMessage(
+                        call_hash=child.call.call_hash, root_id=parent.root_id
+                    ),
+                    child.call,
+                )
+                for child, schedule in zip(children, should_schedule)
+                if schedule
+            ]
+            # Inline runs count against the spawn limit just the same.
+            allowed, rejected = await self._admit([job for job, _ in prepared])
+            if rejected:
+                await self._queue.put_messages_bytes(
+                    my_topic, [job.encode() for job in allowed]
+                )
+                raise self._spawn_limit_error(rejected[0])
+
+        # One at a time, in this task, so a drain can tell when this is
+        # writing out results.
+        absorbed = False
+        for i, (job, call) in enumerate(prepared):
+            try:
+                absorbed |= await self._handle_job(
+                    handler, my_topic, job, budget, depth + 1, call, ret
+                )
+            except BaseException:
+                # Nobody else is going to run this child, nor its siblings
+                # which haven't run yet: their pending returns are already
+                # taken.  Fall back to the queue.
+                await self._queue.put_messages_bytes(
+                    my_topic, [j.encode() for j, _ in prepared[i:]]
+                )
+                raise
+
+        if not absorbed:
+            return False
+        if budget.calls < 1:
+            with self._committing_phase():
+                await self._put_job(my_topic, parent)
+            return False
+        budget.calls -= 1
+        _, rejected = await self._admit([parent])
+        if rejected:
+            raise self._spawn_limit_error(parent)
+        return await self._handle_job(
+            handler, my_topic, parent, budget, depth, parent_call, absorb
+        )
+
+    async def loop(
+        self,
+        topic: str | Mapping[str, int],
+        handler: Handler,
+        *,
+        max_in_flight: int = 1,
+    ) -> None:
+        """Workers take jobs from the queue and handle them.
         They have read and write access to the store, and are responsible for
         Managing the output of tasks and scheduling new ones
 
@@ -327,19 +691,247 @@ class Server(Connection):
         Rejecting a job will be considered a job failure by the queue [in any
         decent queue implementation, e.g. SQS dead lettering after a while].
 
+        To serve multiple topics from one loop, pass a mapping from topic to
+        weight, e.g. {"interactive": 5, "batch": 1}.  While all topics have
+        messages waiting, they are served in proportion to their weight, but
+        a topic without messages doesn't hold up the others: idle capacity is
+        always used for whatever is available.  This requires a queue which
+        implements Queue.get_messages_any.
+
+        By default messages are handled one at a time, right in the task
+        running this loop.  Handlers which spend most of their time waiting on
+        IO can set max_in_flight to keep up to that many messages in progress
+        at once.  No new message is taken off the queue while that many are
+        being handled.  Spare capacity is filled in one go using
+        Queue.get_messages.
+
+        If handling a message raises, e.g. a SpawnLimitError, no new messages
+        are taken and the messages still in flight are allowed to finish
+        before the error is raised from this method.  When the queue is
+        closed, or the server is drained, the loop waits for all messages in
+        flight and returns.
+
         """
+        if max_in_flight < 1:
+            raise ValueError(f"max_in_flight must be at least 1: {max_in_flight}")
+        weights = {topic: 1} if isinstance(topic, str) else topic
         num = f"{self._n}/{Server._total_workers}"
-        logger.info(f"Worker {num} listening on {topic}")
-        while True:
+        logger.info(f"Worker {num} listening on {', '.join(weights)}")
+
+        task = asyncio.current_task()
+        assert task is not None
+        self._loops[task] = asyncio.get_running_loop().create_future()
+        try:
+            if max_in_flight == 1 and len(weights) == 1:
+                [only] = weights
+                await self._loop_serial(only, handler, num)
+            else:
+                await self._loop_concurrent(weights, handler, max_in_flight, num)
+        finally:
+            self._loops.pop(task).set_result(None)
+
+    async def _loop_concurrent(
+        self,
+        weights: Mapping[str, int],
+        handler: Handler,
+        max_in_flight: int,
+        num: str,
+    ) -> None:
+        """Handle up to max_in_flight messages at once, each in its own task."""
+        rr = _WeightedRoundRobin(weights)
+        topics = ", ".join(weights)
+
+        async def receive(capacity: int) -> tuple[str, Sequence[Message]]:
+            if len(weights) == 1:
+                [only] = weights
+                return only, await self._queue.get_messages(only, capacity)
+            return await self._queue.get_messages_any(rr.next_order(), capacity)
+
+        def start(msg_topic: str, message: Message) -> None:
+            logger.debug(f"Worker {num} got {msg_topic} message {message!r}")
+            task = asyncio.create_task(
+                self._handle_and_ack(handler, msg_topic, message)
+            )
+            in_flight.add(task)
+            self._track(task, msg_topic, message)
+            task.add_done_callback(lambda t: self._untrack(t, t.cancelled()))
+
+        in_flight: set[asyncio.Task[None]] = set()
+        receiving: asyncio.Task[tuple[str, Sequence[Message]]] | None = None
+        draining = asyncio.create_task(self._draining.wait())
+        closed = False
+        try:
+            while in_flight or not (closed or self._draining.is_set()):
+                capacity = max_in_flight - len(in_flight)
+                if (
+                    not (closed or self._draining.is_set())
+                    and receiving is None
+                    and capacity > 0
+                ):
+                    # This is presumed to be a long poll
+                    receiving = asyncio.create_task(receive(capacity))
+                waiting: set[asyncio.Task[Any]] = set(in_flight)
+                if receiving is not None:
+                    waiting |= {receiving, draining}
+                done, _ = await asyncio.wait(
+                    waiting, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if receiving is not None and self._draining.is_set():
+                    # Stop listening.  If the messages came in anyway, they
+                    # are handled as usual, and the drain waits for them.
+                    receiving.cancel()
+                    await asyncio.wait([receiving])
+                    done.add(receiving)
+
+                # Start handling freshly received messages before surfacing
+                # any errors from other messages: they're already off the
+                # queue, and the error path waits for everything in flight.
+                if receiving is not None and receiving in done:
+                    received, receiving = receiving, None
+                    try:
+                        msg_topic, messages = received.result()
+                    except asyncio.CancelledError:
+                        logger.info(f"Worker {num} is draining")
+                    except QueueIsEmpty:
+                        logger.debug(f"Worker {num}'s queue {topics} is empty")
+                    except QueueIsClosed:
+                        logger.info(f"Worker {num}'s queue {topics} is closed")
+                        closed = True
+                    else:
+                        for message in messages:
+                            start(msg_topic, message)
+
+                for task in in_flight & done:
+                    in_flight.remove(task)
+                    if task.cancelled() and self._draining.is_set():
+                        # Abandoned by the drain, which reports it
+                        continue
+                    task.result()
+        except asyncio.CancelledError:
+            for task in in_flight:
+                task.cancel()
+            raise
+        finally:
+            draining.cancel()
+            stragglers: list[asyncio.Task[Any]] = list(in_flight)
+            if receiving is not None:
+                receiving.cancel()
+                stragglers.append(receiving)
+            results = await asyncio.gather(*stragglers, return_exceptions=True)
+            for result in results:
+                # Only one error can be raised: at least log the others.
+                if isinstance(result, Exception) and not isinstance(
+                    result, (QueueIsEmpty, QueueIsClosed)
+                ):
+                    logger.error(f"Worker {num} concurrent handler failed: {result!r}")
+
+    async def _loop_serial(self, topic: str, handler: Handler, num: str) -> None:
+        """Handle one message at a time, right in this task.
+
+        The common case, without the overhead of a task per message.
+
+        """
+        task = asyncio.current_task()
+        assert task is not None
+        while not self._draining.is_set():
+            self._receiving.add(task)
             try:
                 # This is presumed to be a long poll
-                message = await self._queue.get_message(topic)
-                logger.debug(f"Worker {num} got {topic} message {repr(message)}")
+                [message] = await self._queue.get_messages(topic, 1)
             except QueueIsEmpty:
                 logger.debug(f"Worker {num}'s queue {topic} is empty")
                 continue
             except QueueIsClosed:
                 logger.info(f"Worker {num}'s queue {topic} is closed")
                 return
+            except asyncio.CancelledError:
+                if self._drained(task):
+                    logger.info(f"Worker {num} is draining")
+                    return
+                raise
+            finally:
+                self._receiving.discard(task)
+
+            logger.debug(f"Worker {num} got {topic} message {message!r}")
+            self._track(task, topic, message)
+            cancelled = False
+            try:
+                await self._handle_and_ack(handler, topic, message)
+            except asyncio.CancelledError:
+                cancelled = True
+                if self._drained(task):
+                    # Abandoned by the drain, which reports it
+                    return
+                raise
+            finally:
+                self._untrack(task, cancelled)
+
+    async def drain(
+        self, timeout: float | None = None, *, requeue: bool = True
+    ) -> DrainReport:
+        """Stop taking new messages and wait for those in flight.
+
+        Every loop on this server stops listening, waits for its messages to
+        be handled and returns, as if the queue was closed.  This method
+        returns once they're all done.
+
+        If handlers are still running after timeout seconds, they are
+        cancelled and reported as abandoned.  With requeue they are put back
+        on their topic so another worker can pick them up.  Messages whose
+        handler has already finished are never cancelled: their value and
+        returns are always written out, however long that takes.  Getting
+        interrupted halfway through that means doing all the work over.
 
-            await self._handle_msg(handler, topic, message.body)
+        """
+        self._draining.set()
+        for task in self._receiving:
+            task.cancel()
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        handled_before = self._handled
+        abandoned: list[tuple[str, Message]] = []
+        cancelled: set[asyncio.Task[Any]] = set()
+        # Not done until every loop is: they can still start messages which
+        # were received just as the drain started.  A drain from within a loop
+        # can't wait for that loop, though.
+        current = asyncio.current_task()
+        while True:
+            entries = dict(self._in_flight)
+            loops = [f for task, f in self._loops.items() if task is not current]
+            if not entries and not loops:
+                break
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                remaining = None
+                for task, (topic, message, _) in entries.items():
+                    if task not in self._committing and task not in cancelled:
+                        abandoned.append((topic, message))
+                        cancelled.add(task)
+                        task.cancel()
+            tracking = loop.create_future()
+            self._tracking.add(tracking)
+            try:
+                await asyncio.wait(
+                    [tracking, *loops, *(f for _, _, f in entries.values())],
+                    timeout=remaining,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+            finally:
+                self._tracking.discard(tracking)
+                tracking.cancel()
+        finished = self._handled - handled_before
+
+        logger.info(
+            f"Drained server {self._n}: {finished} finished, {len(abandoned)} abandoned"
+        )
+        if requeue and abandoned:
+            by_topic: dict[str, list[bytes]] = {}
+            for topic, message in abandoned:
+                by_topic.setdefault(topic, []).append(message.body_bytes)
+            for topic, bodies in by_topic.items():
+                await self._queue.put_messages_bytes(topic, bodies)
+            # Requeued by hand, so they mustn't be redelivered as well
+            for topic, message in abandoned:
+                await self._queue.ack(topic, message)
+        return DrainReport(finished=finished, abandoned=abandoned)
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from collections.abc import Callable
+
+
+class LruCache[K, V]:
+    """A least-recently-used cache with a total weight budget.
+
+    Every value has a weight, 1 by default, and the least recently used
+    entries are evicted until the total fits within max_weight.  A value
+    heavier than the entire budget is not cached at all.
+
+    Not thread safe.  Keeps hit and miss counters for monitoring.
+
+    """
+
+    hits: int
+    misses: int
+
+    def __init__(self, max_weight: int, weigh: Callable[[V], int] = lambda _: 1):
+        self.max_weight = max_weight
+        self._weigh = weigh
+        self._entries: OrderedDict[K, tuple[V, int]] = OrderedDict()
+        self._weight = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        """Check for a key without counting it as a use, nor a hit or a miss."""
+        return key in self._entries
+
+    @property
+    def weight(self) -> int:
+        return self._weight
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups which were hits, 0 if there were none yet."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: K) -> V | None:
+        try:
+            value, _ = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        self.pop(key)
+        weight = self._weigh(value)
+        if weight > self.max_weight:
+            return
+        self._entries[key] = (value, weight)
+        self._weight += weight
+        while self._weight > self.max_weight:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._weight -= evicted
+
+    def pop(self, key: K) -> V | None:
+        try:
+            value, weight = self._entries.pop(key)
+        except KeyError:
+            return None
+        self._weight -= weight
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._weight = 0
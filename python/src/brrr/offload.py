@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+from collections.abc import Iterable, Sequence
+
+from .store import MemKey, Store
+
+# Records in the primary store which start with this are a reference to a
+# blob, the rest of the record being its content address.  Records which start
+# with this by coincidence are always offloaded, whatever their size, so there
+# is never any confusion.
+MAGIC = b"\x00brrr-blob\x00"
+
+
+class BlobStore(ABC):
+    """Storage for large, immutable blobs of bytes, by content address.
+
+    Blobs are never overwritten with different contents, nor deleted by brrr,
+    so any store which can hold large files will do: S3, a shared filesystem,
+    etc.
+
+    """
+
+    @abstractmethod
+    async def put(self, address: str, data: bytes) -> None:
+        """Store this blob.  It may already exist, with the exact same data."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get(self, address: str) -> bytes:
+        raise NotImplementedError()
+
+
+class OffloadingStore(Store):
+    """Store records above a size threshold in a blob store.
+
+    Only a reference to the blob is stored in the wrapped store.  Use this to
+    store results larger than the wrapped store supports, e.g. Dynamo's 400KB
+    item limit.
+
+    References are derived from the contents, so compare and set operations on
+    the wrapped store still work as expected.  Blobs are always written before
+    their reference, so a reference never points to a missing blob.
+
+    """
+
+    def __init__(self, inner: Store, blobs: BlobStore, threshold: int = 300_000):
+        self.inner = inner
+        self.blobs = blobs
+        self.threshold = threshold
+        self.supports_set_and_compare_and_set = inner.supports_set_and_compare_and_set
+        self.supports_items = inner.supports_items
+        self.supports_sets = inner.supports_sets
+
+    def _address(self, value: bytes) -> str:
+        return hashlib.sha256(value).hexdigest()
+
+    def _ref(self, value: bytes) -> bytes:
+        """What the wrapped store gets for this value, without any I/O."""
+        if len(value) < self.threshold and not value.startswith(MAGIC):
+            return value
+        return MAGIC + self._address(value).encode("ascii")
+
+    async def _offload(self, value: bytes) -> bytes:
+        ref = self._ref(value)
+        if ref.startswith(MAGIC):
+            await self.blobs.put(self._address(value), value)
+        return ref
+
+    async def _load(self, ref: bytes) -> bytes:
+        if not ref.startswith(MAGIC):
+            return ref
+        return await self.blobs.get(ref[len(MAGIC) :].decode("ascii"))
+
+    async def has(self, key: MemKey) -> bool:
+        return await self.inner.has(key)
+
+    async def get(self, key: MemKey) -> bytes:
+        return await self._load(await self.inner.get(key))
+
+    async def get_with_retry(self, key: MemKey) -> bytes:
+        return await self._load(await self.inner.get_with_retry(key))
+
+    async def get_many(self, keys: Sequence[MemKey]) -> list[bytes | None]:
+        refs = await self.inner.get_many(keys)
+
+        async def load(ref: bytes | None) -> bytes | None:
+            return None if ref is None else await self._load(ref)
+
+        return list(await asyncio.gather(*map(load, refs)))
+
+    async def set(self, key: MemKey, value: bytes) -> None:
+        await self.inner.set(key, await self._offload(value))
+
+    async def set_many(self, items: Sequence[tuple[MemKey, bytes]]) -> None:
+        refs = await asyncio.gather(*(self._offload(value) for _, value in items))
+        await self.inner.set_many([(k, ref) for (k, _), ref in zip(items, refs)])
+
+    async def delete(self, key: MemKey) -> None:
+        # The blob stays: it is content addressed so it might be shared
+        await self.inner.delete(key)
+
+    async def set_new_value(self, key: MemKey, value: bytes) -> None:
+        await self.inner.set_new_value(key, await self._offload(value))
+
+    async def compare_and_set(self, key: MemKey, value: bytes, expected: bytes) -> None:
+        await self.inner.compare_and_set(
+            key, await self._offload(value), self._ref(expected)
+        )
+
+    async def compare_and_delete(self, key: MemKey, expected: bytes) -> None:
+        await self.inner.compare_and_delete(key, self._ref(expected))
+
+    async def set_and_compare_and_set(
+        self,
+        items: Sequence[tuple[MemKey, bytes]],
+        key: MemKey,
+        value: bytes,
+        expected: bytes | None,
+    ) -> None:
+        refs = await asyncio.gather(*(self._offload(v) for _, v in items))
+        await self.inner.set_and_compare_and_set(
+            [(k, ref) for (k, _), ref in zip(items, refs)],
+            key,
+            await self._offload(value),
+            None if expected is None else self._ref(expected),
+        )
+
+    # Items and set members are small by nature: left to the wrapped store
+
+    async def add_item(self, key: MemKey, item: bytes) -> int:
+        return await self.inner.add_item(key, item)
+
+    async def get_item_version(self, key: MemKey) -> int:
+        return await self.inner.get_item_version(key)
+
+    async def get_items(self, key: MemKey, prefix: bytes = b"") -> list[bytes]:
+        return await self.inner.get_items(key, prefix)
+
+    async def delete_items(
+        self, key: MemKey, items: Sequence[bytes], version: int
+    ) -> None:
+        await self.inner.delete_items(key, items, version)
+
+    async def add_to_set(
+        self, key: MemKey, member: bytes, group: bytes
+    ) -> tuple[bool, bool]:
+        return await self.inner.add_to_set(key, member, group)
+
+    async def get_set(self, key: MemKey) -> frozenset[bytes]:
+        return await self.inner.get_set(key)
+
+    async def remove_from_set(
+        self, key: MemKey, members: Iterable[bytes]
+    ) -> frozenset[bytes]:
+        return await self.inner.remove_from_set(key, members)
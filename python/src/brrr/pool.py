@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from collections.abc import Callable, Mapping
+from contextlib import AbstractAsyncContextManager
+from multiprocessing.connection import wait
+from multiprocessing.context import ForkContext, ForkServerContext, SpawnContext
+from multiprocessing.process import BaseProcess
+from types import FrameType
+from typing import Unpack
+
+from .connection import DrainReport, Handler, Server, serve
+from .queue import Queue
+from .store import Cache, MemoryOptions, Store
+
+logger = logging.getLogger(__name__)
+
+type Backends = Callable[[], AbstractAsyncContextManager[tuple[Queue, Store, Cache]]]
+type MakeHandler = Callable[[Server], Handler]
+
+
+async def _serve_worker(
+    backends: Backends,
+    make_handler: MakeHandler,
+    topic: str | Mapping[str, int],
+    max_in_flight: int,
+    drain_timeout_secs: float,
+    eager_depth: int,
+    eager_calls: int,
+    options: MemoryOptions,
+) -> None:
+    main = asyncio.current_task()
+    assert main is not None
+    loop = asyncio.get_running_loop()
+    # The supervisor asks us to stop with a SIGTERM.  Until there's a server
+    # to drain, there's nothing to lose by just cancelling.
+    loop.add_signal_handler(signal.SIGTERM, main.cancel)
+    async with (
+        backends() as (queue, store, cache),
+        serve(
+            queue,
+            store,
+            cache,
+            eager_depth=eager_depth,
+            eager_calls=eager_calls,
+            **options,
+        ) as server,
+    ):
+        drains: list[asyncio.Task[DrainReport]] = []
+
+        def drain() -> None:
+            if not drains:
+                drains.append(loop.create_task(server.drain(drain_timeout_secs)))
+
+        loop.add_signal_handler(signal.SIGTERM, drain)
+        await server.loop(topic, make_handler(server), max_in_flight=max_in_flight)
+        # Wait for the abandoned messages to be requeued
+        for task in drains:
+            await task
+
+
+def _run_worker(
+    backends: Backends,
+    make_handler: MakeHandler,
+    topic: str | Mapping[str, int],
+    max_in_flight: int,
+    drain_timeout_secs: float,
+    eager_depth: int,
+    eager_calls: int,
+    options: MemoryOptions,
+) -> None:
+    # A ^C in the terminal is sent to the entire process group.  Leave it to
+    # the supervisor to decide what that means for the workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Forked workers inherit the supervisor's SIGTERM handler.  Until the event
+    # loop installs its own, a SIGTERM should just stop the worker.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        asyncio.run(
+            _serve_worker(
+                backends,
+                make_handler,
+                topic,
+                max_in_flight,
+                drain_timeout_secs,
+                eager_depth,
+                eager_calls,
+                options,
+            )
+        )
+    except asyncio.CancelledError:
+        logger.info(f"Pool worker {os.getpid()} stopped")
+
+
+def serve_pool(
+    backends: Backends,
+    make_handler: MakeHandler,
+    topic: str | Mapping[str, int],
+    *,
+    processes: int | None = None,
+    max_in_flight: int = 1,
+    restart_delay_secs: float = 1,
+    drain_timeout_secs: float = 20,
+    shutdown_timeout_secs: float = 30,
+    mp_context: ForkContext | ForkServerContext | SpawnContext | None = None,
+    eager_depth: int = 0,
+    eager_calls: int = 100,
+    **options: Unpack[MemoryOptions],
+) -> None:
+    """Serve a topic from a pool of worker processes, one per core by default.
+
+    Every process creates its own queue, store and cache by entering the
+    `backends' context manager factory, and runs Server.loop with the handler
+    returned by `make_handler', e.g.:
+
+        serve_pool(
+            my_backends,
+            lambda conn: AppWorker(handlers=..., codec=..., connection=conn).handle,
+            "my-topic",
+        )
+
+    The topic can also be a mapping of topics to weights, as in Server.loop.
+    Every worker's server gets eager_depth, eager_calls and any other options,
+    see serve.
+
+    A worker which dies with an error is restarted after restart_delay_secs.
+    A worker which exits cleanly, i.e. because its queue was closed, is not.
+    This call blocks until all workers have exited.
+
+    On SIGTERM or SIGINT, all workers are sent a SIGTERM which drains their
+    server: messages in flight get drain_timeout_secs to finish, after which
+    they're put back on the queue.  Workers still running after
+    shutdown_timeout_secs are killed, so leave some margin between the two.
+
+    Processes are forked by default, so the factories can be closures.  Pass a
+    different multiprocessing context if forking isn't safe on your platform,
+    at which point the factories must be picklable.
+
+    Must be called from the main thread, outside of any asyncio event loop.
+
+    """
+    n = processes or os.cpu_count() or 1
+    ctx = mp_context or multiprocessing.get_context("fork")
+    workers: dict[int, BaseProcess] = {}
+    restarts: dict[int, float] = {}
+    stopping = False
+    kill_at: float | None = None
+    # Signal handlers run between the retries of a wait, without ending it.
+    # Waiting on this pipe too lets stop() end it, to recompute the timeout.
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_r, False)
+    os.set_blocking(wake_w, False)
+
+    def start(i: int) -> None:
+        p = ctx.Process(
+            target=_run_worker,
+            args=(
+                backends,
+                make_handler,
+                topic,
+                max_in_flight,
+                drain_timeout_secs,
+                eager_depth,
+                eager_calls,
+                options,
+            ),
+            name=f"brrr-worker-{i}",
+        )
+        p.start()
+        logger.info(f"Started pool worker {i} (pid {p.pid})")
+        workers[i] = p
+        # Told to stop while this one was starting, so stop() missed it
+        if stopping:
+            p.terminate()
+
+    def stop(signum: int, frame: FrameType | None) -> None:
+        nonlocal stopping, kill_at
+        if stopping:
+            return
+        logger.info(f"Received signal {signum}: stopping {len(workers)} workers")
+        stopping = True
+        kill_at = time.monotonic() + shutdown_timeout_secs
+        restarts.clear()
+        for p in workers.values():
+            p.terminate()
+        try:
+            os.write(wake_w, b"\0")
+        except BlockingIOError:
+            pass  # Already full of wake ups
+
+    previous = {s: signal.signal(s, stop) for s in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        for i in range(n):
+            if not stopping:
+                start(i)
+
+        while workers or restarts:
+            now = time.monotonic()
+            for i, at in list(restarts.items()):
+                if at <= now:
+                    del restarts[i]
+                    start(i)
+
+            deadlines = list(restarts.values())
+            if kill_at is not None:
+                deadlines.append(kill_at)
+            timeout = max(0, min(deadlines) - now) if deadlines else None
+            wait([wake_r, *(p.sentinel for p in workers.values())], timeout)
+            try:
+                os.read(wake_r, 64)
+            except BlockingIOError:
+                pass
+
+            for i, p in list(workers.items()):
+                if p.exitcode is None:
+                    continue
+                p.join()
+                del workers[i]
+                if p.exitcode == 0 or stopping:
+                    logger.info(f"Pool worker {i} (pid {p.pid}) exited")
+                    continue
+                logger.error(
+                    f"Pool worker {i} (pid {p.pid}) died with exit code {p.exitcode}: restarting"
+                )
+                restarts[i] = time.monotonic() + restart_delay_secs
+
+            if kill_at is not None and time.monotonic() >= kill_at:
+                for i, p in workers.items():
+                    logger.error(f"Pool worker {i} (pid {p.pid}) did not stop: killing")
+                    p.kill()
+                kill_at = None
+    finally:
+        # Don't leave orphans behind, no matter how we got here.
+        for p in workers.values():
+            p.kill()
+            p.join()
+        for s, handler in previous.items():
+            signal.signal(s, handler)
+        os.close(wake_r)
+        os.close(wake_w)
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from collections.abc import Sequence
 from dataclasses import dataclass
 
 
@@ -18,9 +19,18 @@ class Message:
 
     YAGNI and all but something tells me this will be necessary again soon.
 
+    Queues which support bytes natively may return the body as bytes, just as
+    it was put on the queue.
+
     """
 
-    body: str
+    body: str | bytes
+
+    @property
+    def body_bytes(self) -> bytes:
+        if isinstance(self.body, bytes):
+            return self.body
+        return self.body.encode("utf-8")
 
 
 @dataclass
@@ -55,3 +65,81 @@ class Queue(ABC):
     async def put_message(self, topic: str, body: str) -> None: ...
     @abstractmethod
     async def get_message(self, topic: str) -> Message: ...
+
+    async def get_messages(self, topic: str, max_n: int) -> Sequence[Message]:
+        """Receive between 1 and max_n messages in one go.
+
+        Blocks like get_message while there are no messages, and returns as
+        soon as there are any: this never waits to fill up a batch.  Override
+        this if the underlying queue can receive multiple messages per round
+        trip.  The default just gets a single message.
+
+        """
+        return [await self.get_message(topic)]
+
+    async def get_messages_any(
+        self, topics: Sequence[str], max_n: int
+    ) -> tuple[str, Sequence[Message]]:
+        """Receive between 1 and max_n messages from any one of these topics.
+
+        Topics are given in order of preference: when several of them have
+        messages waiting, take them from the first one.  Blocks like
+        get_message while none of them have any messages.  Raises QueueIsClosed
+        only once all of them are closed.
+
+        Returns the topic which the messages were taken from.  The default
+        only supports a single topic.
+
+        """
+        if len(topics) != 1:
+            raise NotImplementedError(
+                f"{type(self).__name__} can't listen on multiple topics at once"
+            )
+        [topic] = topics
+        return topic, await self.get_messages(topic, max_n)
+
+    async def put_messages(self, topic: str, bodies: Sequence[str]) -> None:
+        """Put all these messages on the queue, in order.
+
+        Override this if the underlying queue can send multiple messages per
+        round trip.  The default just puts them one by one.
+
+        """
+        for body in bodies:
+            await self.put_message(topic, body)
+
+    async def put_message_bytes(self, topic: str, body: bytes) -> None:
+        """Put a message on the queue which is already encoded as UTF-8.
+
+        Brrr's own messages are always put on the queue through this method.
+        Override this if the underlying queue can take bytes as they are.  The
+        default decodes them and calls put_message.
+
+        """
+        await self.put_message(topic, body.decode("utf-8"))
+
+    async def put_messages_bytes(self, topic: str, bodies: Sequence[bytes]) -> None:
+        """See put_message_bytes and put_messages."""
+        await self.put_messages(topic, [body.decode("utf-8") for body in bodies])
+
+    async def ack(self, topic: str, message: Message) -> None:
+        """Acknowledge that this message was handled, and can be forgotten.
+
+        Brrr calls this once a message's handler has completed.  Queues which
+        redeliver messages that are never acknowledged, e.g. because their
+        worker died, override this.  The default does nothing: the message
+        was deleted when it was received.
+
+        """
+
+    async def nack(self, topic: str, message: Message) -> None:
+        """Give up on this message for now: its handler raised.
+
+        Queues which redeliver messages that are never acknowledged override
+        this to make it available again soon, instead of only once its worker
+        is considered dead.  The default does nothing.
+
+        Brrr acknowledges, rather than gives up on, messages which hit the
+        spawn limit: handling them again can never succeed.
+
+        """
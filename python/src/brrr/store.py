@@ -1,15 +1,18 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 import time
 from abc import ABC, abstractmethod
-from collections.abc import Awaitable, Callable, Iterable
+from collections.abc import Awaitable, Callable, Iterable, Sequence
 from dataclasses import dataclass
-from typing import Literal, Self
-
-import bencodepy
+from typing import Literal, Self, TypedDict, Unpack
 
+from . import wire
 from .call import Call
+from .cas import CasRetryPolicy, CasStats, ExponentialBackoff
+from .compression import Algorithm, Compression
+from .lru import LruCache
 from .tagged_tuple import PendingReturn
 
 logger = logging.getLogger(__name__)
@@ -29,9 +32,6 @@ class Info:
     log_prints: bool | None
 
 
-_bc = bencodepy.Bencode(encoding="utf-8")
-
-
 @dataclass
 class PendingReturns:
     """Set of parents waiting for a child call to complete.
@@ -55,22 +55,14 @@ class PendingReturns:
     returns: set[PendingReturn]
 
     def encode(self) -> bytes:
-        x: bytes = _bc.encode(
-            {
-                "returns": list(sorted(map(lambda x: x.astuple(), self.returns))),
-                **({"scheduled_at": self.scheduled_at} if self.scheduled_at else {}),
-            }
+        return wire.encode_pending_returns(
+            self.scheduled_at, sorted(x.astuple() for x in self.returns)
         )
-        return x
 
     @classmethod
     def decode(cls, enc: bytes) -> Self:
-        decoded = _bc.decode(enc)
-        returns = decoded["returns"]
-        return cls(
-            decoded.get("scheduled_at"),
-            set(map(PendingReturn.fromtuple, returns)),
-        )
+        scheduled_at, returns = wire.decode_pending_returns(enc)
+        return cls(scheduled_at, set(map(PendingReturn.fromtuple, returns)))
 
 
 @dataclass
@@ -96,6 +88,18 @@ class Store(ABC):
 
     """
 
+    # Whether set_and_compare_and_set is implemented.  Memory uses it to
+    # schedule a child call in a single round trip.
+    supports_set_and_compare_and_set: bool = False
+
+    # Whether add_item, get_item_version, get_items and delete_items are
+    # implemented.  Memory uses them for the "items" pending returns layout.
+    supports_items: bool = False
+
+    # Whether add_to_set, get_set and remove_from_set are implemented.  Memory
+    # uses them for the "set" pending returns layout.
+    supports_sets: bool = False
+
     @abstractmethod
     async def has(self, key: MemKey) -> bool:
         """Inherently racy operation, be careful when using this"""
@@ -157,6 +161,131 @@ class Store(ABC):
         """
         raise NotImplementedError()
 
+    async def set_and_compare_and_set(
+        self,
+        items: Sequence[tuple[MemKey, bytes]],
+        key: MemKey,
+        value: bytes,
+        expected: bytes | None,
+    ) -> None:
+        """Set these items and compare-and-set key, as one atomic operation.
+
+        If expected is None the key must not exist yet, like set_new_value,
+        otherwise it is compared like compare_and_set.  On a mismatch nothing
+        at all is written.
+
+        Optional: only called if supports_set_and_compare_and_set is set.
+
+        """
+        raise NotImplementedError()
+
+    async def add_item(self, key: MemKey, item: bytes) -> int:
+        """Add an item to the set at this key, and bump the set's version.
+
+        Concurrent adds must not conflict with each other: they all succeed,
+        no compare-and-set.  Adding an item which is already there is fine,
+        and still bumps the version.  The item must be stored before the
+        version is bumped.
+
+        Returns the new version, which is 1 if the set didn't exist yet.
+
+        Optional: only called if supports_items is set.
+
+        """
+        raise NotImplementedError()
+
+    async def get_item_version(self, key: MemKey) -> int:
+        """The version of the set at this key, 0 if it doesn't exist."""
+        raise NotImplementedError()
+
+    async def get_items(self, key: MemKey, prefix: bytes = b"") -> list[bytes]:
+        """All items in the set at this key which start with this prefix."""
+        raise NotImplementedError()
+
+    async def delete_items(
+        self, key: MemKey, items: Sequence[bytes], version: int
+    ) -> None:
+        """Remove these items, and then the set itself if still at this version.
+
+        Raise CompareMismatch if the version has changed, i.e. if more items
+        were added since.  The given items are removed regardless.  Once the
+        set is gone, the next add_item starts again from version 1.
+
+        """
+        raise NotImplementedError()
+
+    async def add_to_set(
+        self, key: MemKey, member: bytes, group: bytes
+    ) -> tuple[bool, bool]:
+        """Atomically add a member to the set at this key, creating it if needed.
+
+        Every member belongs to a group, e.g. a prefix of it.  Concurrent adds
+        must not conflict with each other, and only two flags are read back,
+        so adding to a large set stays cheap.  Returns whether this created
+        the set, and whether the member is new to a group which already had
+        another member.  Groups are only forgotten along with the whole set,
+        so the latter may also hold if the others were removed since.
+
+        Optional: only called if supports_sets is set.
+
+        """
+        raise NotImplementedError()
+
+    async def get_set(self, key: MemKey) -> frozenset[bytes]:
+        """The members of the set at this key, empty if it doesn't exist."""
+        raise NotImplementedError()
+
+    async def remove_from_set(
+        self, key: MemKey, members: Iterable[bytes]
+    ) -> frozenset[bytes]:
+        """Atomically remove these members, and the set itself once empty.
+
+        Returns the members which are left, i.e. those which were added since
+        the given members were read.
+
+        """
+        raise NotImplementedError()
+
+    async def get_many(self, keys: Sequence[MemKey]) -> list[bytes | None]:
+        """Get all these keys at once, None for those which are missing.
+
+        Override this if the store can read multiple keys per round trip.  The
+        default gets them all concurrently.
+
+        """
+
+        async def get(key: MemKey) -> bytes | None:
+            try:
+                return await self.get(key)
+            except NotFoundError:
+                return None
+
+        return list(await asyncio.gather(*map(get, keys)))
+
+    async def set_many(self, items: Sequence[tuple[MemKey, bytes]]) -> None:
+        """Set all these keys at once, as with set.
+
+        Override this if the store can write multiple keys per round trip.
+        The default sets them all concurrently.  If the same key occurs more
+        than once, the last value wins.
+
+        """
+        last = {(key.type, key.call_hash): (key, value) for key, value in items}
+        await asyncio.gather(*(self.set(key, value) for key, value in last.values()))
+
+
+def prefix_end(prefix: bytes) -> bytes | None:
+    """The first bytes after all those starting with prefix, if there are any.
+
+    For stores which look items up by range: those starting with prefix are
+    at least prefix, and less than this.
+
+    """
+    stripped = prefix.rstrip(b"\xff")
+    if not stripped:
+        return None
+    return stripped[:-1] + bytes([stripped[-1] + 1])
+
 
 class Cache(ABC):
     """A best-effort store for light-weight, non-critical data.
@@ -196,19 +325,109 @@ class Cache(ABC):
         """
         raise NotImplementedError()
 
+    async def incr_by(self, key: str, n: int) -> int:
+        """Increase by n and return the new value.
+
+        Override this if the cache can do it in a single operation.  The
+        default just calls incr n times.
+
+        """
+        value = 0
+        for _ in range(n):
+            value = await self.incr(key)
+        return value
+
+
+def _enc_call(call: Call) -> bytes:
+    return wire.encode_call(call.task_name, call.payload)
+
+
+def _return_item(r: PendingReturn) -> bytes:
+    # Parent first, so all roots waiting on the same parent share a prefix
+    return wire.encode_tagged((r.tag, r.call_hash, r.topic, r.root_id))
+
+
+def _return_item_prefix(r: PendingReturn) -> bytes:
+    return wire.encode_tagged((r.tag, r.call_hash, r.topic))[:-1]
+
+
+def _decode_return_item(item: bytes) -> PendingReturn:
+    tag, call_hash, topic, root_id = wire.decode_tagged(item)
+    return PendingReturn.fromtuple((tag, root_id, call_hash, topic))
+
+
+# Only a hint, to skip guessing that a call is new: a hash per entry is cheap
+_RECENTLY_SCHEDULED = 10_000
+
+
+class MemoryOptions(TypedDict, total=False):
+    """Tuning knobs for Memory, passed through from serve and connect."""
+
+    # Keep up to this many bytes of values in a worker-local LRU cache.
+    # Values never change once written, so there's no invalidation to worry
+    # about.  Off by default.
+    value_cache_bytes: int
+    # Keep up to this many decoded calls in a worker-local LRU cache.  Calls
+    # never change for a given hash either, and every parent is read again
+    # every time it is woken back up.  Any call in this cache is known to be
+    # stored, so it isn't written again when a replayed parent schedules its
+    # children again.  Off by default.
+    call_cache_size: int
+    # Compress stored calls and values with this algorithm.  Records written
+    # without compression keep working, either way.  Off by default.
+    compression: Algorithm
+    # Only compress records of at least this many bytes, 1024 by default.
+    compression_threshold: int
+    # How pending returns are stored.  By default, all pending returns of a
+    # call form a single "record" which is updated with compare-and-set.  With
+    # "items", every pending return is a separate item instead, which can be
+    # added without any contention, at the cost of an extra read to drain
+    # them.  Requires a store which supports items, and all workers must use
+    # the same layout.  With "set", the pending returns are a set which the
+    # store adds members to atomically, in a single write.  Requires a store
+    # which supports sets.
+    pending_returns_layout: Literal["record", "items", "set"]
+    # When to retry compare-and-set operations which lost a race.  Exponential
+    # backoff with jitter by default.
+    cas_retry: CasRetryPolicy
+
 
 class Memory:
-    def __init__(self, store: Store):
+    # Recently read and written values, by call hash
+    value_cache: LruCache[str, bytes]
+    # Recently read and written calls, by call hash
+    call_cache: LruCache[str, Call]
+    # Calls this worker recently added pending returns to, by call hash
+    recently_scheduled: LruCache[str, bool]
+    # Attempts per compare-and-set operation, by key type
+    cas_stats: CasStats
+
+    def __init__(self, store: Store, **options: Unpack[MemoryOptions]):
         self.store = store
+        self.value_cache = LruCache(options.get("value_cache_bytes", 0), len)
+        self.call_cache = LruCache(options.get("call_cache_size", 0))
+        self.recently_scheduled = LruCache(_RECENTLY_SCHEDULED)
+        self.compression = Compression(
+            options.get("compression"), options.get("compression_threshold", 1024)
+        )
+        self.pending_returns_layout = options.get("pending_returns_layout", "record")
+        self.cas_retry = options.get("cas_retry") or ExponentialBackoff()
+        self.cas_stats = CasStats()
+        if self.pending_returns_layout == "items" and not store.supports_items:
+            raise ValueError(f"{type(store).__name__} doesn't support items")
+        if self.pending_returns_layout == "set" and not store.supports_sets:
+            raise ValueError(f"{type(store).__name__} doesn't support sets")
 
     async def get_call(self, call_hash: str) -> Call:
-        enc = await self.store.get_with_retry(MemKey("call", call_hash))
-        decoded = bencodepy.decode(enc)
-        task_name = decoded[b"task_name"]
-        payload = decoded[b"payload"]
-        return Call(
-            task_name=task_name.decode("utf-8"), payload=payload, call_hash=call_hash
+        if (cached := self.call_cache.get(call_hash)) is not None:
+            return cached
+        enc = self.compression.decompress(
+            await self.store.get_with_retry(MemKey("call", call_hash))
         )
+        task_name, payload = wire.decode_call(enc)
+        call = Call(task_name=task_name, payload=payload, call_hash=call_hash)
+        self.call_cache.put(call_hash, call)
+        return call
 
     async def set_call(self, call: Call) -> None:
         """Store this call in the storage layer.
@@ -218,14 +437,33 @@ class Memory:
         the exact same byte representation, but it must _decode_ to the same
         call.
 
+        Calls which are known to be stored already are skipped.
+
         """
-        enc = bencodepy.encode(
-            {
-                b"task_name": call.task_name.encode("utf-8"),
-                b"payload": call.payload,
-            }
+        if call.call_hash in self.call_cache:
+            return
+        await self.store.set(
+            MemKey(type="call", call_hash=call.call_hash),
+            self.compression.compress(_enc_call(call)),
         )
-        await self.store.set(MemKey(type="call", call_hash=call.call_hash), enc)
+        self.call_cache.put(call.call_hash, call)
+
+    async def set_calls(self, calls: Iterable[Call]) -> None:
+        """Store all these calls in one go, see set_call."""
+        calls = [c for c in calls if c.call_hash not in self.call_cache]
+        if not calls:
+            return
+        await self.store.set_many(
+            [
+                (
+                    MemKey(type="call", call_hash=c.call_hash),
+                    self.compression.compress(_enc_call(c)),
+                )
+                for c in calls
+            ]
+        )
+        for call in calls:
+            self.call_cache.put(call.call_hash, call)
 
     async def has_value(self, call_hash: str) -> bool:
         """Inherently racy check for existence of a value.
@@ -235,10 +473,37 @@ class Memory:
         time the function returned.
 
         """
+        if call_hash in self.value_cache:
+            return True
         return await self.store.has(MemKey("value", call_hash))
 
+    async def get_values(self, call_hashes: Iterable[str]) -> dict[str, bytes]:
+        """Get all these values in one go.  Missing values are left out."""
+        values: dict[str, bytes] = {}
+        missing: list[str] = []
+        for call_hash in dict.fromkeys(call_hashes):
+            if (cached := self.value_cache.get(call_hash)) is not None:
+                values[call_hash] = cached
+            else:
+                missing.append(call_hash)
+
+        if missing:
+            found = await self.store.get_many([MemKey("value", h) for h in missing])
+            for call_hash, value in zip(missing, found):
+                if value is not None:
+                    value = self.compression.decompress(value)
+                    self.value_cache.put(call_hash, value)
+                    values[call_hash] = value
+        return values
+
     async def get_value(self, call_hash: str) -> bytes:
-        return await self.store.get(MemKey("value", call_hash))
+        if (cached := self.value_cache.get(call_hash)) is not None:
+            return cached
+        value = self.compression.decompress(
+            await self.store.get(MemKey("value", call_hash))
+        )
+        self.value_cache.put(call_hash, value)
+        return value
 
     async def set_value(self, call_hash: str, payload: bytes) -> None:
         """Set a [return] value for this call.
@@ -260,34 +525,45 @@ class Memory:
         layer?
 
         """
-        await self.store.set(MemKey("value", call_hash), payload)
+        await self.store.set(
+            MemKey("value", call_hash), self.compression.compress(payload)
+        )
+        self.value_cache.put(call_hash, payload)
 
-    async def _with_cas[T](self, f: Callable[[], Awaitable[T]]) -> T:
-        """Wrap a CAS exception generating body.
+    async def _with_cas[T](self, key: MemKey, f: Callable[[], Awaitable[T]]) -> T:
+        """Wrap a CAS exception generating body on this key.
 
         This abstracts the retry nature of a CAS gated operation.  The with
         block will be retried as long as it keeps throwing CompareMismatch
         exceptions.  Once it completes without throwing that, this with block
-        will exit.  The retries are capped at a hard-coded 100, after which a
-        generic error is returned (don't reach that, I guess).
+        will exit.  The retry policy decides how long to wait between attempts,
+        and when to give up, after which a generic error is returned (don't
+        reach that, I guess).
 
         """
-        i = 0
+        attempt = 0
         while True:
+            attempt += 1
             try:
-                return await f()
+                result = await f()
             except CompareMismatch as e:
-                i += 1
                 # Do this within the catch so we can attach the last
                 # CompareMismatch exception to the new exception.
-                if i > 100:
+                delay = self.cas_retry.delay(key, attempt)
+                if delay is None:
+                    self.cas_stats.record(key, attempt, exhausted=True)
                     # Very ad-hoc.  This should never be encountered, but let’s
                     # at least set _some_ kind of error message here so someone
                     # could debug this, if it ever happens.  It almost certainly
                     # indicates an issue in the underlying store’s
                     # compare_and_set implementation.
                     raise Exception("exceeded CAS retry limit") from e
+                logger.debug(f"CAS attempt {attempt} on {key} lost, retrying")
+                if delay:
+                    await asyncio.sleep(delay)
                 continue
+            self.cas_stats.record(key, attempt)
+            return result
 
     async def add_pending_return(
         self, call_hash: str, new_return: PendingReturn
@@ -303,18 +579,97 @@ class Memory:
         Return value indicates whether we need to schedule this call.
 
         """
+        if self.pending_returns_layout == "items":
+            return await self._add_pending_return_item(call_hash, new_return)
+        if self.pending_returns_layout == "set":
+            return await self._add_pending_return_member(call_hash, new_return)
+        return await self._add_pending_return(call_hash, new_return, None, False)
+
+    async def add_calls_with_pending_return(
+        self, calls: Sequence[Call], new_return: PendingReturn
+    ) -> list[bool]:
+        """Store these calls and register a pending return for each of them.
+
+        The same as set_calls followed by add_pending_return for every call,
+        but if the store supports it, each call and its pending return are
+        written in one single operation instead.  In the common case, where
+        nobody else has scheduled the call yet, that's one round trip per call.
+
+        Returns whether each call needs to be scheduled, in order.
+
+        """
+        if (
+            not self.store.supports_set_and_compare_and_set
+            or self.pending_returns_layout != "record"
+        ):
+            await self.set_calls(calls)
+            return list(
+                await asyncio.gather(
+                    *(self.add_pending_return(c.call_hash, new_return) for c in calls)
+                )
+            )
 
-        def is_repeated_call(existing: PendingReturn) -> bool:
-            return (
-                existing.root_id != new_return.root_id
-                and existing.call_hash == new_return.call_hash
-                and existing.topic == new_return.topic
+        async def add(call: Call) -> bool:
+            items = []
+            if call.call_hash not in self.call_cache:
+                key = MemKey(type="call", call_hash=call.call_hash)
+                items.append((key, self.compression.compress(_enc_call(call))))
+            # A replayed parent schedules the same calls again: those likely
+            # have pending returns already, so don't guess they're new.
+            blind = (
+                call.call_hash not in self.call_cache
+                and call.call_hash not in self.recently_scheduled
             )
+            should_schedule = await self._add_pending_return(
+                call.call_hash, new_return, items, blind
+            )
+            self.call_cache.put(call.call_hash, call)
+            self.recently_scheduled.put(call.call_hash, True)
+            return should_schedule
+
+        return list(await asyncio.gather(*map(add, calls)))
+
+    async def _add_pending_return(
+        self,
+        call_hash: str,
+        new_return: PendingReturn,
+        items: Sequence[tuple[MemKey, bytes]] | None,
+        blind: bool,
+    ) -> bool:
+        """See add_pending_return.
+
+        If items are given, even none, the store's set_and_compare_and_set is
+        used to write them in the same operation as the pending returns.
+
+        If blind, don't look for existing pending returns first: just try to
+        create them, and only read them when that fails.  That saves a round
+        trip for new calls, and costs one for existing ones.
+
+        """
+        memkey = MemKey("pending_returns", call_hash)
+
+        async def write(value: bytes, expected: bytes | None) -> None:
+            if items is not None:
+                await self.store.set_and_compare_and_set(items, memkey, value, expected)
+            elif expected is None:
+                await self.store.set_new_value(memkey, value)
+            else:
+                await self.store.compare_and_set(memkey, value, expected)
 
         # Beware race conditions here!  Be aware of concurrency corner cases on
         # every single line.
         async def cas_body() -> bool:
-            memkey = MemKey("pending_returns", call_hash)
+            nonlocal blind
+            if blind:
+                blind = False
+                created = PendingReturns(int(time.time()), {new_return})
+                try:
+                    await write(created.encode(), None)
+                    return True
+                except CompareMismatch:
+                    # A wrong guess rather than a lost race: no need to back
+                    # off, just read what's there.
+                    pass
 
             logger.debug(f"Looking for existing pending returns for {call_hash}...")
             try:
@@ -325,15 +680,41 @@ class Memory:
                 existing = PendingReturns(int(time.time()), {new_return})
                 existing_enc = existing.encode()
                 logger.debug(f"    ... none found. Creating new: {existing_enc!r}")
-                await self.store.set_new_value(memkey, existing_enc)
+                await write(existing_enc, None)
                 return True
 
-            should_schedule = any(map(is_repeated_call, existing.returns))
+            should_schedule = any(map(new_return.is_repeated_call, existing.returns))
             existing.returns.add(new_return)
-            await self.store.compare_and_set(memkey, existing.encode(), existing_enc)
+            await write(existing.encode(), existing_enc)
             return should_schedule
 
-        return await self._with_cas(cas_body)
+        return await self._with_cas(memkey, cas_body)
+
+    async def _add_pending_return_item(
+        self, call_hash: str, new_return: PendingReturn
+    ) -> bool:
+        """See add_pending_return, for the "items" layout."""
+        memkey = MemKey("pending_returns", call_hash)
+        version = await self.store.add_item(memkey, _return_item(new_return))
+        if version == 1:
+            return True
+        # Only other roots waiting on the same parent matter
+        items = await self.store.get_items(memkey, _return_item_prefix(new_return))
+        existing = map(_decode_return_item, items)
+        return any(map(new_return.is_repeated_call, existing))
+
+    async def _add_pending_return_member(
+        self, call_hash: str, new_return: PendingReturn
+    ) -> bool:
+        """See add_pending_return, for the "set" layout."""
+        memkey = MemKey("pending_returns", call_hash)
+        # Grouped by parent: another root in the same group means the root
+        # was retried.  Unlike the other layouts, re-adding a pending return
+        # which is already there never schedules the call again.
+        created, regrouped = await self.store.add_to_set(
+            memkey, _return_item(new_return), _return_item_prefix(new_return)
+        )
+        return created or regrouped
 
     async def with_pending_returns_remove(
         self, call_hash: str, f: Callable[[Iterable[PendingReturn]], Awaitable[None]]
@@ -341,6 +722,36 @@ class Memory:
         memkey = MemKey("pending_returns", call_hash)
         handled: set[PendingReturn] = set()
 
+        if self.pending_returns_layout == "items":
+
+            async def items_body() -> None:
+                nonlocal handled
+                # The version first: anything added after it was read, and
+                # thus maybe missed below, bumps the version.
+                version = await self.store.get_item_version(memkey)
+                items = await self.store.get_items(memkey)
+                to_handle = set(map(_decode_return_item, items)) - handled
+                logger.debug(f"Handling returns for {call_hash}: {to_handle}...")
+                await f(to_handle)
+                handled |= to_handle
+                await self.store.delete_items(memkey, items, version)
+
+            return await self._with_cas(memkey, items_body)
+
+        if self.pending_returns_layout == "set":
+            members = await self.store.get_set(memkey)
+            while True:
+                to_handle = set(map(_decode_return_item, members)) - handled
+                logger.debug(f"Handling returns for {call_hash}: {to_handle}...")
+                await f(to_handle)
+                handled |= to_handle
+                if not members:
+                    return
+                # Anything left was added while handling these: go again
+                members = await self.store.remove_from_set(memkey, members)
+                if not members:
+                    return
+
         async def cas_body() -> None:
             nonlocal handled
             try:
@@ -359,4 +770,4 @@ class Memory:
             handled |= to_handle
             await self.store.compare_and_delete(memkey, pending_enc)
 
-        return await self._with_cas(cas_body)
+        return await self._with_cas(memkey, cas_body)
@@ -1,10 +1,9 @@
-import dataclasses
+from __future__ import annotations
+
 from dataclasses import dataclass
 from typing import Any, ClassVar, Self
 
-import bencodepy
-
-_bc = bencodepy.Bencode(encoding="utf-8")
+from . import wire
 
 
 @dataclass(frozen=True)
@@ -32,7 +31,9 @@ class TaggedTuple:
     tag: ClassVar[int]
 
     def astuple(self) -> tuple[Any, ...]:
-        return (self.tag,) + dataclasses.astuple(self)
+        # Not dataclasses.astuple: that deep copies every field.  The fields
+        # are set in order by __init__, and there's nothing else.
+        return (self.tag, *vars(self).values())
 
     @classmethod
     def fromtuple(cls, t: tuple[Any, ...]) -> Self:
@@ -44,12 +45,11 @@ class TaggedTuple:
 @dataclass(frozen=True)
 class TaggedTupleStrings(TaggedTuple):
     def encode(self) -> bytes:
-        x: bytes = _bc.encode(self.astuple())
-        return x
+        return wire.encode_tagged(self.astuple())
 
     @classmethod
     def decode(cls, enc: bytes) -> Self:
-        return cls.fromtuple(_bc.decode(enc))
+        return cls.fromtuple(wire.decode_tagged(enc))
 
 
 @dataclass(frozen=True)
@@ -59,6 +59,14 @@ class PendingReturn(TaggedTuple):
     call_hash: str
     topic: str
 
+    def is_repeated_call(self, other: PendingReturn) -> bool:
+        """Same parent, but from a different root: the root was retried."""
+        return (
+            self.root_id != other.root_id
+            and self.call_hash == other.call_hash
+            and self.topic == other.topic
+        )
+
 
 @dataclass(frozen=True)
 class ScheduleMessage(TaggedTupleStrings):
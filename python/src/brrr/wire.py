@@ -0,0 +1,141 @@
+"""Fast bencoding of brrr's own wire records.
+
+Every message and every store operation encodes and decodes a few small records
+of a fixed shape: tagged tuples of strings, pending returns and calls.  These
+functions do just that, without any of the generality of bencodepy.
+
+The output is byte for byte what bencodepy produces, which is what the other
+brrr implementations expect.  Anything which doesn't have the exact expected
+shape is decoded by bencodepy instead, so the same inputs decode to the same
+results, or fail the same way.
+
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterable
+from typing import Any
+
+import bencodepy
+
+_bc = bencodepy.Bencode(encoding="utf-8")
+
+
+# Decoding a record of an unexpected shape fails with one of these, at which
+# point it's left to bencodepy.
+_SHAPE_ERRORS = (ValueError, IndexError)
+
+
+def _read_bytes(enc: bytes, i: int) -> tuple[bytes, int]:
+    colon = enc.index(b":", i)
+    length = enc[i:colon]
+    if not length.isdigit():
+        raise ValueError()
+    start = colon + 1
+    end = start + int(length)
+    if end > len(enc):
+        raise ValueError()
+    return enc[start:end], end
+
+
+def _read_int(enc: bytes, i: int) -> tuple[int, int]:
+    if enc[i] != ord("i"):
+        raise ValueError()
+    end = enc.index(b"e", i + 1)
+    digits = enc[i + 1 : end]
+    if not digits.isdigit():
+        raise ValueError()
+    return int(digits), end + 1
+
+
+def _read_tagged(enc: bytes, i: int) -> tuple[tuple[Any, ...], int]:
+    """Read a list of an int followed by strings, the hot path."""
+    if enc[i] != ord("l"):
+        raise ValueError()
+    tag, i = _read_int(enc, i + 1)
+    fields: list[Any] = [tag]
+    while enc[i] != ord("e"):
+        colon = enc.index(b":", i)
+        length = enc[i:colon]
+        if not length.isdigit():
+            raise ValueError()
+        start = colon + 1
+        i = start + int(length)
+        fields.append(enc[start:i].decode("utf-8"))
+    return tuple(fields), i + 1
+
+
+def encode_tagged(t: tuple[Any, ...]) -> bytes:
+    """Encode a (tag, *strings) tuple."""
+    out = b"li%de" % t[0]
+    for field in t[1:]:
+        b = field.encode("utf-8")
+        out += b"%d:%s" % (len(b), b)
+    return out + b"e"
+
+
+def decode_tagged(enc: bytes) -> tuple[Any, ...]:
+    try:
+        t, end = _read_tagged(enc, 0)
+        if end == len(enc):
+            return t
+    except _SHAPE_ERRORS:
+        pass
+    return tuple(_bc.decode(enc))
+
+
+def encode_pending_returns(
+    scheduled_at: int | None, returns: Iterable[tuple[Any, ...]]
+) -> bytes:
+    """Encode pending returns, which must be sorted already."""
+    returns_enc = b"".join(map(encode_tagged, returns))
+    if scheduled_at:
+        return b"d7:returnsl%se12:scheduled_ati%dee" % (returns_enc, scheduled_at)
+    return b"d7:returnsl%see" % returns_enc
+
+
+def decode_pending_returns(
+    enc: bytes,
+) -> tuple[int | None, list[tuple[Any, ...]]]:
+    try:
+        if enc.startswith(b"d7:returnsl"):
+            i = 11
+            returns = []
+            while enc[i : i + 1] == b"l":
+                t, i = _read_tagged(enc, i)
+                returns.append(t)
+            if enc[i : i + 1] == b"e":
+                i += 1
+                scheduled_at = None
+                if enc.startswith(b"12:scheduled_at", i):
+                    scheduled_at, i = _read_int(enc, i + 15)
+                if enc[i:] == b"e":
+                    return scheduled_at, returns
+    except _SHAPE_ERRORS:
+        pass
+    decoded = _bc.decode(enc)
+    return decoded.get("scheduled_at"), list(map(tuple, decoded["returns"]))
+
+
+def encode_call(task_name: str, payload: bytes) -> bytes:
+    name = task_name.encode("utf-8")
+    return b"d7:payload%d:%s9:task_name%d:%se" % (
+        len(payload),
+        payload,
+        len(name),
+        name,
+    )
+
+
+def decode_call(enc: bytes) -> tuple[str, bytes]:
+    try:
+        if enc.startswith(b"d7:payload"):
+            payload, i = _read_bytes(enc, 10)
+            if enc.startswith(b"9:task_name", i):
+                task_name, i = _read_bytes(enc, i + 11)
+                if enc[i:] == b"e":
+                    return task_name.decode("utf-8"), payload
+    except _SHAPE_ERRORS:
+        pass
+    decoded = bencodepy.decode(enc)
+    return decoded[b"task_name"].decode("utf-8"), decoded[b"payload"]
@@ -56,3 +56,64 @@ class QueueContract(ABC):
             assert (await queue.get_message("test2")).body == "two"
             assert (await queue.get_message("test1")).body == "one"
             assert (await queue.get_message("test1")).body == "one"
+
+    async def test_put_messages(self) -> None:
+        queue: Queue
+        async with self.with_queue(["test-topic"]) as queue:
+            await queue.put_messages("test-topic", [])
+            await queue.put_messages("test-topic", ["one", "two", "three"])
+            assert (await queue.get_message("test-topic")).body == "one"
+            assert (await queue.get_message("test-topic")).body == "two"
+            assert (await queue.get_message("test-topic")).body == "three"
+            with pytest.raises(QueueIsEmpty):
+                await queue.get_message("test-topic")
+
+    async def test_get_messages_any(self) -> None:
+        queue: Queue
+        async with self.with_queue(["test1", "test2"]) as queue:
+            with pytest.raises(QueueIsEmpty):
+                await queue.get_messages_any(["test1", "test2"], 2)
+
+            await queue.put_message("test2", "two")
+            topic, batch = await queue.get_messages_any(["test1", "test2"], 2)
+            assert topic == "test2"
+            assert [m.body for m in batch] == ["two"]
+
+            await queue.put_message("test1", "one")
+            await queue.put_message("test2", "two")
+            topic, batch = await queue.get_messages_any(["test2", "test1"], 2)
+            assert topic == "test2"
+            assert [m.body for m in batch] == ["two"]
+            topic, batch = await queue.get_messages_any(["test2", "test1"], 2)
+            assert topic == "test1"
+            assert [m.body for m in batch] == ["one"]
+
+    async def test_get_messages(self) -> None:
+        queue: Queue
+        async with self.with_queue(["test-topic"]) as queue:
+            messages = {"message-1", "message-2", "message-3"}
+            for msg in messages:
+                await queue.put_message("test-topic", msg)
+
+            received: list[str] = []
+            while len(received) < len(messages):
+                batch = await queue.get_messages("test-topic", 2)
+                assert 1 <= len(batch) <= 2
+                received.extend(m.body for m in batch)
+            assert sorted(received) == sorted(messages)
+
+            with pytest.raises(QueueIsEmpty):
+                await queue.get_messages("test-topic", 2)
+
+    async def test_bytes(self) -> None:
+        async with self.with_queue(["test-topic"]) as queue:
+            await queue.put_message_bytes("test-topic", "één".encode())
+            await queue.put_messages_bytes("test-topic", [b"two", b"three"])
+            await queue.put_message("test-topic", "four")
+            bodies = [
+                message.body_bytes
+                for message in await queue.get_messages("test-topic", 4)
+            ]
+            while len(bodies) < 4:
+                bodies.append((await queue.get_message("test-topic")).body_bytes)
+            assert bodies == ["één".encode(), b"two", b"three", b"four"]
@@ -2,7 +2,7 @@ import dataclasses
 from abc import ABC, abstractmethod
 from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
-from typing import Awaitable, Callable
+from typing import Awaitable, Callable, Unpack
 
 import pytest
 from brrr.call import Call
@@ -10,6 +10,7 @@ from brrr.store import (
     CompareMismatch,
     MemKey,
     Memory,
+    MemoryOptions,
     NotFoundError,
     Store,
 )
@@ -126,6 +127,47 @@ class ByteStoreContract(ABC):
 
             await self.read_after_write(r1)
 
+    async def test_get_many(self) -> None:
+        async with self.with_store() as store:
+            a1 = MemKey("call", "id-1")
+            a2 = MemKey("call", "id-2")
+            b1 = MemKey("value", "id-1")
+
+            assert await store.get_many([]) == []
+            await store.set(a1, b"value-1")
+            await store.set(b1, b"value-3")
+
+            async def r1():
+                assert await store.get_many([a1, a2, b1, a1]) == [
+                    b"value-1",
+                    None,
+                    b"value-3",
+                    b"value-1",
+                ]
+
+            await self.read_after_write(r1)
+
+    async def test_set_many(self) -> None:
+        async with self.with_store() as store:
+            a1 = MemKey("call", "id-1")
+            a2 = MemKey("call", "id-2")
+            b1 = MemKey("value", "id-1")
+
+            await store.set_many([])
+            await store.set(a2, b"old")
+            await store.set_many(
+                [(a1, b"value-1"), (a2, b"value-2"), (b1, b"value-3"), (a1, b"last")]
+            )
+
+            async def r1():
+                assert await store.get_many([a1, a2, b1]) == [
+                    b"last",
+                    b"value-2",
+                    b"value-3",
+                ]
+
+            await self.read_after_write(r1)
+
     async def test_key_error(self) -> None:
         async with self.with_store() as store:
             a1 = MemKey("value", "id-1")
@@ -210,6 +252,149 @@ class ByteStoreContract(ABC):
 
             await self.read_after_write(r2)
 
+    async def test_set_and_compare_and_set(self) -> None:
+        async with self.with_store() as store:
+            if not store.supports_set_and_compare_and_set:
+                pytest.skip("Not supported by this store")
+
+            a1 = MemKey("call", "id-1")
+            b1 = MemKey("pending_returns", "id-1")
+
+            await store.set_and_compare_and_set([(a1, b"call-1")], b1, b"pr-1", None)
+
+            async def r1() -> None:
+                assert await store.get_many([a1, b1]) == [b"call-1", b"pr-1"]
+                # Nothing is written on a mismatch
+                with pytest.raises(CompareMismatch):
+                    await store.set_and_compare_and_set(
+                        [(a1, b"call-2")], b1, b"pr-2", None
+                    )
+                with pytest.raises(CompareMismatch):
+                    await store.set_and_compare_and_set(
+                        [(a1, b"call-2")], b1, b"pr-2", b"pr-3"
+                    )
+
+            await self.read_after_write(r1)
+
+            async def r2() -> None:
+                assert await store.get_many([a1, b1]) == [b"call-1", b"pr-1"]
+                await store.set_and_compare_and_set(
+                    [(a1, b"call-2")], b1, b"pr-2", b"pr-1"
+                )
+
+            await self.read_after_write(r2)
+
+            async def r3() -> None:
+                assert await store.get_many([a1, b1]) == [b"call-2", b"pr-2"]
+
+            await self.read_after_write(r3)
+
+    async def test_items(self) -> None:
+        async with self.with_store() as store:
+            if not store.supports_items:
+                pytest.skip("Not supported by this store")
+
+            a1 = MemKey("pending_returns", "id-1")
+            a2 = MemKey("pending_returns", "id-2")
+
+            assert await store.get_item_version(a1) == 0
+            assert await store.add_item(a1, b"x-one") == 1
+            assert await store.add_item(a1, b"x-two") == 2
+            assert await store.add_item(a1, b"y-one") == 3
+            # Adding it again still bumps the version
+            assert await store.add_item(a1, b"x-one") == 4
+            assert await store.add_item(a2, b"x-one") == 1
+
+            async def r1() -> None:
+                assert await store.get_item_version(a1) == 4
+                assert sorted(await store.get_items(a1)) == [
+                    b"x-one",
+                    b"x-two",
+                    b"y-one",
+                ]
+                assert sorted(await store.get_items(a1, b"x-")) == [b"x-one", b"x-two"]
+                assert await store.get_items(a1, b"z") == []
+
+            await self.read_after_write(r1)
+
+            # An outdated version only removes the items
+            with pytest.raises(CompareMismatch):
+                await store.delete_items(a1, [b"x-one", b"x-two"], 3)
+
+            async def r2() -> None:
+                assert await store.get_items(a1) == [b"y-one"]
+                await store.delete_items(a1, [b"y-one"], 4)
+
+            await self.read_after_write(r2)
+
+            async def r3() -> None:
+                assert await store.get_item_version(a1) == 0
+                assert await store.get_items(a1) == []
+                assert await store.get_items(a2) == [b"x-one"]
+                # Nothing to delete, but the set must not exist either
+                await store.delete_items(a1, [], 0)
+                with pytest.raises(CompareMismatch):
+                    await store.delete_items(a2, [], 0)
+
+            await self.read_after_write(r3)
+
+            assert await store.add_item(a1, b"x-one") == 1
+
+    async def test_items_prefix_bytes(self) -> None:
+        async with self.with_store() as store:
+            if not store.supports_items:
+                pytest.skip("Not supported by this store")
+
+            a1 = MemKey("pending_returns", "id-1")
+            items = [b"", b"a", b"a\x00", b"a\xff", b"a\xff\xff", b"b", b"\xff"]
+            for item in items:
+                await store.add_item(a1, item)
+
+            async def r1() -> None:
+                assert sorted(await store.get_items(a1)) == items
+                assert sorted(await store.get_items(a1, b"a")) == items[1:5]
+                assert sorted(await store.get_items(a1, b"a\xff")) == items[3:5]
+                assert sorted(await store.get_items(a1, b"\xff")) == [b"\xff"]
+
+            await self.read_after_write(r1)
+
+    async def test_sets(self) -> None:
+        async with self.with_store() as store:
+            if not store.supports_sets:
+                pytest.skip("Not supported by this store")
+
+            a1 = MemKey("pending_returns", "id-1")
+            a2 = MemKey("pending_returns", "id-2")
+
+            assert await store.get_set(a1) == frozenset()
+            assert await store.add_to_set(a1, b"x-one", b"x") == (True, False)
+            assert await store.add_to_set(a1, b"y-one", b"y") == (False, False)
+            assert await store.add_to_set(a1, b"x-two", b"x") == (False, True)
+            # Already a member
+            assert await store.add_to_set(a1, b"x-one", b"x") == (False, False)
+            assert await store.add_to_set(a2, b"x-one", b"x") == (True, False)
+
+            async def r1() -> None:
+                assert await store.get_set(a1) == {b"x-one", b"y-one", b"x-two"}
+                assert await store.get_set(a2) == {b"x-one"}
+
+            await self.read_after_write(r1)
+
+            assert await store.remove_from_set(a1, [b"x-one", b"y-one", b"z"]) == {
+                b"x-two"
+            }
+            assert await store.remove_from_set(a1, [b"x-two"]) == frozenset()
+
+            async def r2() -> None:
+                assert await store.get_set(a1) == frozenset()
+                assert await store.get_set(a2) == {b"x-one"}
+
+            await self.read_after_write(r2)
+
+            # Gone entirely, groups and all, so it starts from scratch
+            assert await store.add_to_set(a1, b"x-three", b"x") == (True, False)
+            assert await store.add_to_set(a1, b"y-two", b"y") == (False, False)
+
     async def test_compare_and_delete(self) -> None:
         async with self.with_store() as store:
             a1 = MemKey("value", "id-1")
@@ -238,9 +423,16 @@ class ByteStoreContract(ABC):
 
 class MemoryContract(ByteStoreContract):
     @asynccontextmanager
-    async def with_memory(self) -> AsyncIterator[Memory]:
+    async def with_memory(
+        self, **options: Unpack[MemoryOptions]
+    ) -> AsyncIterator[Memory]:
         async with self.with_store() as store:
-            yield Memory(store)
+            layout = options.get("pending_returns_layout")
+            if layout == "items" and not store.supports_items:
+                pytest.skip("Items not supported by this store")
+            if layout == "set" and not store.supports_sets:
+                pytest.skip("Sets not supported by this store")
+            yield Memory(store, **options)
 
     async def test_call(self) -> None:
         async with self.with_memory() as memory:
@@ -282,8 +474,9 @@ class MemoryContract(ByteStoreContract):
 
             await self.read_after_write(r2)
 
-    async def test_pending_returns(self, topic) -> None:
-        async with self.with_memory() as memory:
+    @pytest.mark.parametrize("layout", ["record", "items", "set"])
+    async def test_pending_returns(self, topic, layout) -> None:
+        async with self.with_memory(pending_returns_layout=layout) as memory:
 
             async def body(keys) -> None:
                 assert not keys
@@ -1,8 +1,11 @@
 import asyncio
 import dataclasses
+import threading
 import typing
 from collections import Counter
-from typing import cast
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal, cast
 
 import brrr
 import pytest
@@ -20,6 +23,8 @@ from brrr import (
 from brrr.backends.in_memory import InMemoryByteStore, InMemoryQueue
 from brrr.local_app import LocalBrrr, local_app
 from brrr.pickle_codec import PickleCodec
+from brrr.queue import Message
+from brrr.store import MemKey
 
 from .parametrize import names
 
@@ -177,6 +182,88 @@ async def test_app_gather(topic: str, task_name: str) -> None:
     assert foo4 < bar8
 
 
+async def test_gather_batched(topic: str, task_name: str) -> None:
+    class CountingStore(InMemoryByteStore):
+        gets = 0
+        batches = 0
+
+        async def get(self, key: MemKey) -> bytes:
+            self.gets += 1
+            return await super().get(key)
+
+        async def get_many(self, keys: Sequence[MemKey]) -> list[bytes | None]:
+            self.batches += 1
+            return await super().get_many(keys)
+
+    store = CountingStore()
+    queue = InMemoryQueue([topic])
+
+    @brrr.handler_no_arg
+    async def one(a: int) -> int:
+        return a
+
+    async with brrr.serve(queue, store, store) as conn:
+        app = AppWorker(handlers={task_name: one}, codec=PickleCodec(), connection=conn)
+        for a in range(10):
+            await app.schedule(one, topic=topic)(a)
+        queue.flush()
+        await conn.loop(topic, app.handle)
+
+        worker = ActiveWorker(conn, PickleCodec(), app.tasks)
+        store.gets = 0
+        with pytest.raises(Defer) as e:
+            await worker.gather(*map(worker.call(one), range(20)))
+        assert len(list(e.value.calls)) == 10
+        assert (store.batches, store.gets) == (1, 0)
+
+        # Anything else is awaited concurrently
+        values = await worker.gather(
+            *map(worker.call(one), range(10)), asyncio.sleep(0, "other")
+        )
+        assert values == [*range(10), "other"]
+        assert (store.batches, store.gets) == (2, 0)
+
+
+async def test_gather_error_order(topic: str, task_name: str) -> None:
+    class MyError(Exception):
+        pass
+
+    async def fail(i: int) -> None:
+        await asyncio.sleep(0.01 / i)
+        raise MyError(i)
+
+    @brrr.handler
+    async def top(app: ActiveWorker) -> int:
+        try:
+            await app.gather(fail(1), fail(2))
+        except MyError as e:
+            return e.args[0]
+        assert False
+
+    b = LocalBrrr(topic=topic, handlers={task_name: top}, codec=PickleCodec())
+    assert await b.run(top)() == 1
+
+
+async def test_call_is_coroutine(topic: str, task_name: str) -> None:
+    name_top, name_one = names(task_name, ("top", "one"))
+
+    @brrr.handler_no_arg
+    async def one(a: int) -> int:
+        return a
+
+    @brrr.handler
+    async def top(app: ActiveWorker) -> int:
+        a = await asyncio.create_task(app.call(one)(1))
+        b = await asyncio.ensure_future(app.call(one)(2))
+        [c] = await app.gather(asyncio.ensure_future(app.call(one)(3)))
+        return a + b + c
+
+    b = LocalBrrr(
+        topic=topic, handlers={name_top: top, name_one: one}, codec=PickleCodec()
+    )
+    assert await b.run(top)() == 6
+
+
 async def test_asyncio_gather(topic: str, task_name: str) -> None:
     """
     Since asyncio.gather raises the first Defer, top should Defer four times.
@@ -278,6 +365,60 @@ async def test_topics_same_app(topic: str, task_name) -> None:
     await queue.join()
 
 
+async def test_topics_one_loop(topic: str, task_name) -> None:
+    store = InMemoryByteStore()
+    t1, t2 = names(topic, ("1", "2"))
+    queue = InMemoryQueue([t1, t2])
+    name_one, name_two = names(task_name, ("one", "two"))
+
+    @brrr.handler_no_arg
+    async def one(a: int) -> int:
+        return a + 5
+
+    @brrr.handler
+    async def two(app: ActiveWorker, a: int) -> int:
+        # The return to this parent must go to t2, not wherever the child ran
+        return await app.call(name_one, topic=t1)(a + 3)
+
+    async with brrr.serve(queue, store, store) as conn:
+        app = AppWorker(
+            handlers={name_one: one, name_two: two},
+            codec=PickleCodec(),
+            connection=conn,
+        )
+        await app.schedule(name_two, topic=t2)(7)
+        queue.flush()
+        await conn.loop({t1: 1, t2: 1}, app.handle)
+
+        assert await app.read(name_two)(7) == 15
+        assert await app.read(name_one)(10) == 15
+
+
+async def test_topics_weighted(topic: str, task_name) -> None:
+    store = InMemoryByteStore()
+    t1, t2 = names(topic, ("1", "2"))
+    queue = InMemoryQueue([t1, t2])
+    handled: list[str] = []
+
+    @brrr.handler_no_arg
+    async def record(t: str, a: int) -> None:
+        handled.append(t)
+
+    async with brrr.serve(queue, store, store) as conn:
+        app = AppWorker(
+            handlers={task_name: record}, codec=PickleCodec(), connection=conn
+        )
+        for a in range(6):
+            await app.schedule(task_name, topic=t1)(t1, a)
+            await app.schedule(task_name, topic=t2)(t2, a)
+        queue.flush()
+        await conn.loop({t1: 2, t2: 1}, app.handle)
+
+    # Served 2:1 while both have messages, then whatever is left over
+    assert Counter(handled[:6]) == {t1: 4, t2: 2}
+    assert Counter(handled) == {t1: 6, t2: 6}
+
+
 async def test_weird_names(topic: str, task_name: str) -> None:
     store = InMemoryByteStore()
     queue = InMemoryQueue([topic])
@@ -389,7 +530,89 @@ async def test_parallel(topic: str, task_name: str, use_gather: bool) -> None:
         await queue.join()
 
 
-async def test_stress_parallel(topic: str, task_name: str) -> None:
+async def test_parallel_in_flight(topic: str, task_name: str) -> None:
+    store = InMemoryByteStore()
+    queue = InMemoryQueue([topic])
+    name_top, name_block = names(task_name, ("top", "block"))
+
+    parallel = 5
+    barrier: asyncio.Barrier | None = asyncio.Barrier(parallel)
+
+    top_calls = 0
+
+    @brrr.handler_no_arg
+    async def block(a: int) -> int:
+        nonlocal barrier
+        if barrier is not None:
+            # Only passes if a single loop handles all blocks concurrently
+            await barrier.wait()
+        barrier = None
+        return a
+
+    @brrr.handler
+    async def top(app: ActiveWorker) -> None:
+        await app.gather(*(app.call(block)(x) for x in range(parallel)))
+        # See test_parallel
+        nonlocal top_calls
+        top_calls += 1
+        if top_calls == parallel:
+            await queue.close()
+
+    async with brrr.serve(queue, store, store) as conn:
+        app = AppWorker(
+            handlers={name_top: top, name_block: block},
+            codec=PickleCodec(),
+            connection=conn,
+        )
+        await app.schedule(top, topic=topic)()
+        await conn.loop(topic, app.handle, max_in_flight=parallel)
+        await queue.join()
+
+
+async def test_sync_handler(topic: str, task_name: str) -> None:
+    store = InMemoryByteStore()
+    queue = InMemoryQueue([topic])
+    name_top, name_block = names(task_name, ("top", "block"))
+
+    parallel = 3
+    # A threading barrier would deadlock the event loop if the handlers ran on
+    # it: only passes if the blocking handlers run in their own threads.
+    barrier = threading.Barrier(parallel, timeout=5)
+
+    @brrr.handler_sync(executor=ThreadPoolExecutor(max_workers=parallel))
+    def block(a: int) -> int:
+        barrier.wait()
+        return a * 2
+
+    @brrr.handler
+    async def top(app: ActiveWorker) -> int:
+        return sum(await app.gather(*(app.call(block)(x) for x in range(parallel))))
+
+    async with brrr.serve(queue, store, store) as conn:
+        app = AppWorker(
+            handlers={name_top: top, name_block: block},
+            codec=PickleCodec(),
+            connection=conn,
+        )
+        await app.schedule(top, topic=topic)()
+
+        async def close_when_done() -> None:
+            while not await conn.read_raw(
+                PickleCodec().encode_call(name_top, (), {}).call_hash
+            ):
+                await asyncio.sleep(0.01)
+            await queue.close()
+
+        await asyncio.gather(
+            conn.loop(topic, app.handle, max_in_flight=parallel), close_when_done()
+        )
+        assert await app.read(top)() == 6
+
+
+@pytest.mark.parametrize("layout", ["record", "items", "set"])
+async def test_stress_parallel(
+    topic: str, task_name: str, layout: Literal["record", "items", "set"]
+) -> None:
     store = InMemoryByteStore()
     queue = InMemoryQueue([topic])
 
@@ -414,7 +637,7 @@ async def test_stress_parallel(topic: str, task_name: str) -> None:
             == 43466557686937456435688527675040625802564660517371780402481729089536555417949051890403879840079255169295922593080322634775209689623239873322471161642996440906533187938298969649928516003704476137795166849228875
         )
 
-    async with brrr.serve(queue, store, store) as conn:
+    async with brrr.serve(queue, store, store, pending_returns_layout=layout) as conn:
         app = AppWorker(
             handlers={name_top: top, name_fib: fib},
             codec=PickleCodec(),
@@ -506,7 +729,11 @@ async def test_app_loop_resumable(topic: str) -> None:
     assert errors == 0
 
 
-async def test_app_loop_resumable_nested(topic: str, task_name: str) -> None:
+# Eager children which fail are put back on the queue
+@pytest.mark.parametrize("eager_depth", [0, 1])
+async def test_app_loop_resumable_nested(
+    topic: str, task_name: str, eager_depth: int
+) -> None:
     store = InMemoryByteStore()
     queue = InMemoryQueue([topic])
     queue.flush()
@@ -530,7 +757,7 @@ async def test_app_loop_resumable_nested(topic: str, task_name: str) -> None:
     async def foo(app: ActiveWorker, a: int) -> int:
         return await app.call(bar)(a)
 
-    async with brrr.serve(queue, store, store) as conn:
+    async with brrr.serve(queue, store, store, eager_depth=eager_depth) as conn:
         app = AppWorker(
             handlers={name_foo: foo, name_bar: bar},
             codec=PickleCodec(),
@@ -548,6 +775,164 @@ async def test_app_loop_resumable_nested(topic: str, task_name: str) -> None:
     assert errors == 0
 
 
+class RedeliveringQueue(InMemoryQueue):
+    """Puts messages which were received but never acked back, on demand."""
+
+    def __init__(self, topics: Sequence[str]):
+        super().__init__(topics)
+        self.unacked: list[tuple[str, Message]] = []
+
+    async def get_messages(self, topic: str, max_n: int) -> Sequence[Message]:
+        messages = await super().get_messages(topic, max_n)
+        self.unacked.extend((topic, message) for message in messages)
+        return messages
+
+    async def ack(self, topic: str, message: Message) -> None:
+        self.unacked = [(t, m) for t, m in self.unacked if m is not message]
+
+    async def redeliver(self) -> None:
+        unacked, self.unacked = self.unacked, []
+        for topic, message in unacked:
+            await self.put_message_bytes(topic, message.body_bytes)
+
+
+# Siblings of a failed eager child still run once the parent is redelivered
+@pytest.mark.parametrize("eager_depth", [0, 1])
+async def test_eager_failing_sibling(
+    topic: str, task_name: str, eager_depth: int
+) -> None:
+    store = InMemoryByteStore()
+    queue = RedeliveringQueue([topic])
+    queue.flush()
+
+    name_top, name_leaf = names(task_name, ("top", "leaf"))
+
+    errors = 1
+
+    class MyError(Exception):
+        pass
+
+    @brrr.handler_no_arg
+    async def leaf(a: int) -> int:
+        nonlocal errors
+        if a == 0 and errors:
+            errors -= 1
+            raise MyError("retry")
+        return 1
+
+    @brrr.handler
+    async def top(app: ActiveWorker) -> int:
+        return sum(await app.gather(*(app.call(leaf)(a) for a in range(3))))
+
+    async with brrr.serve(queue, store, store, eager_depth=eager_depth) as conn:
+        app = AppWorker(
+            handlers={name_top: top, name_leaf: leaf},
+            codec=PickleCodec(),
+            connection=conn,
+        )
+        await app.schedule(top, topic=topic)()
+        while True:
+            try:
+                await conn.loop(topic, app.handle)
+                break
+            except MyError:
+                await queue.redeliver()
+        assert await app.read(top)() == 3
+
+    assert errors == 0
+
+
+# Siblings of an eager child abandoned by a drain still run afterwards
+async def test_eager_drain_midway(topic: str, task_name: str) -> None:
+    store = InMemoryByteStore()
+    queue = InMemoryQueue([topic])
+
+    name_top, name_leaf = names(task_name, ("top", "leaf"))
+
+    started = asyncio.Event()
+    stuck = True
+
+    @brrr.handler_no_arg
+    async def leaf(a: int) -> int:
+        if a == 1 and stuck:
+            started.set()
+            await asyncio.Event().wait()
+        return 1
+
+    @brrr.handler
+    async def top(app: ActiveWorker) -> int:
+        return sum(await app.gather(*(app.call(leaf)(a) for a in range(3))))
+
+    handlers = {name_top: top, name_leaf: leaf}
+    async with brrr.serve(queue, store, store, eager_depth=1) as conn:
+        app = AppWorker(handlers=handlers, codec=PickleCodec(), connection=conn)
+        await app.schedule(top, topic=topic)()
+        loop = asyncio.create_task(conn.loop(topic, app.handle))
+        await started.wait()
+        report = await conn.drain(0.01)
+        await loop
+        assert len(report.abandoned) == 1
+
+    stuck = False
+    async with brrr.serve(queue, store, store, eager_depth=1) as conn:
+        app = AppWorker(handlers=handlers, codec=PickleCodec(), connection=conn)
+        queue.flush()
+        await conn.loop(topic, app.handle)
+        assert await app.read(top)() == 3
+
+
+class CountingQueue(InMemoryQueue):
+    received = 0
+
+    async def get_messages(self, topic: str, max_n: int) -> Sequence[Message]:
+        messages = await super().get_messages(topic, max_n)
+        self.received += len(messages)
+        return messages
+
+
+@pytest.mark.parametrize("eager_depth, received", [(0, 21), (4, 13), (100, 1)])
+async def test_eager_chain(
+    topic: str, task_name: str, eager_depth: int, received: int
+) -> None:
+    store = InMemoryByteStore()
+    queue = CountingQueue([topic])
+
+    @brrr.handler
+    async def foo(app: ActiveWorker, a: int) -> int:
+        if a == 0:
+            return 0
+        return await app.call(foo)(a - 1) + 1
+
+    async with brrr.serve(queue, store, store, eager_depth=eager_depth) as conn:
+        app = AppWorker(handlers={task_name: foo}, codec=PickleCodec(), connection=conn)
+        await app.schedule(foo, topic=topic)(10)
+        queue.flush()
+        await conn.loop(topic, app.handle)
+        assert await app.read(foo)(10) == 10
+
+    assert queue.received == received
+
+
+async def test_eager_calls_budget(topic: str, task_name: str) -> None:
+    store = InMemoryByteStore()
+    queue = CountingQueue([topic])
+
+    @brrr.handler
+    async def fib(app: ActiveWorker, a: int) -> int:
+        if a < 2:
+            return a
+        return sum(await app.gather(app.call(fib)(a - 1), app.call(fib)(a - 2)))
+
+    async with brrr.serve(queue, store, store, eager_depth=100, eager_calls=10) as conn:
+        app = AppWorker(handlers={task_name: fib}, codec=PickleCodec(), connection=conn)
+        await app.schedule(fib, topic=topic)(20)
+        queue.flush()
+        await conn.loop(topic, app.handle)
+        assert await app.read(fib)(20) == 6765
+
+    assert queue.received > 1
+
+
 async def test_app_handler_names(topic: str, task_name: str) -> None:
     name_foo, name_bar = names(task_name, ("foo", "bar"))
 
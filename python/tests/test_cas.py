@@ -0,0 +1,58 @@
+from collections import Counter
+
+import pytest
+from brrr.cas import CasStats, ExponentialBackoff, ImmediateRetry
+from brrr.store import MemKey
+
+PENDING = MemKey("pending_returns", "foo")
+VALUE = MemKey("value", "foo")
+
+
+def test_immediate_retry() -> None:
+    policy = ImmediateRetry(3)
+    assert [policy.delay(PENDING, n) for n in range(1, 5)] == [0.0, 0.0, None, None]
+
+
+def test_backoff_grows_within_cap() -> None:
+    policy = ExponentialBackoff(base=0.01, cap=0.1, max_attempts=1000)
+    for attempt in range(1, 1000):
+        delay = policy.delay(PENDING, attempt)
+        assert delay is not None
+        assert 0 <= delay <= min(0.1, 0.01 * 2**attempt)
+
+
+def test_backoff_is_jittered() -> None:
+    policy = ExponentialBackoff(base=1, cap=1)
+    assert len({policy.delay(PENDING, 5) for _ in range(10)}) > 1
+
+
+@pytest.mark.parametrize(
+    "key, attempts", [(PENDING, 50), (VALUE, 2), (MemKey("call", "foo"), 10)]
+)
+def test_backoff_max_attempts_by_type(key: MemKey, attempts: int) -> None:
+    policy = ExponentialBackoff(
+        max_attempts=10, max_attempts_by_type={"pending_returns": 50, "value": 2}
+    )
+    assert policy.delay(key, attempts - 1) is not None
+    assert policy.delay(key, attempts) is None
+
+
+def test_stats() -> None:
+    stats = CasStats()
+    stats.record(PENDING, 1)
+    stats.record(PENDING, 1)
+    stats.record(PENDING, 3)
+    stats.record(VALUE, 4, exhausted=True)
+
+    assert stats.attempts == {
+        "pending_returns": Counter({1: 2, 3: 1}),
+        "value": Counter({4: 1}),
+    }
+    assert stats.operations("pending_returns") == 3
+    assert stats.conflicts("pending_returns") == 2
+    assert stats.conflicts("value") == 4
+    assert stats.conflicts("call") == 0
+    assert stats.exhausted == Counter({"value": 1})
+
+    stats.clear()
+    assert stats.operations("pending_returns") == 0
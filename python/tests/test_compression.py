@@ -0,0 +1,48 @@
+import pytest
+from brrr.compression import MAGIC, Compression
+
+DATA = b'{"key": "value"}' * 100
+
+
+@pytest.mark.parametrize("algorithm", ["zlib", "lzma"])
+def test_round_trip(algorithm) -> None:
+    compression = Compression(algorithm, threshold=100)
+    compressed = compression.compress(DATA)
+    assert compressed.startswith(MAGIC)
+    assert len(compressed) < len(DATA) / 5
+    assert compression.decompress(compressed) == DATA
+    # Any reader can decompress it
+    assert Compression().decompress(compressed) == DATA
+
+
+def test_zstd() -> None:
+    pytest.importorskip("zstandard")
+    compression = Compression("zstd", threshold=100)
+    assert compression.decompress(compression.compress(DATA)) == DATA
+
+
+def test_threshold() -> None:
+    compression = Compression("zlib", threshold=len(DATA) + 1)
+    assert compression.compress(DATA) == DATA
+
+
+def test_incompressible() -> None:
+    data = bytes(range(256))
+    assert Compression("zlib", threshold=0).compress(data) == data
+
+
+def test_legacy() -> None:
+    assert Compression("zlib").decompress(b"plain") == b"plain"
+
+
+@pytest.mark.parametrize("algorithm", [None, "zlib"])
+def test_escape_magic(algorithm) -> None:
+    compression = Compression(algorithm, threshold=1000)
+    data = MAGIC + b"\x01not actually compressed"
+    assert compression.compress(data) != data
+    assert compression.decompress(compression.compress(data)) == data
+
+
+def test_unknown_algorithm() -> None:
+    with pytest.raises(ValueError):
+        Compression().decompress(MAGIC + b"\xff")
@@ -1,7 +1,12 @@
+import asyncio
+
 import brrr
+import pytest
 from brrr import Connection, Defer, DeferredCall, Request, Response
 from brrr.backends.in_memory import InMemoryByteStore, InMemoryQueue
 from brrr.call import Call
+from brrr.queue import Message
+from brrr.store import MemKey
 
 TOPIC = "brrr-test"
 
@@ -57,3 +62,214 @@ async def test_conn_nop_closed_queue() -> None:
         await conn.loop(TOPIC, handler)
         await conn.loop(TOPIC, handler)
         await conn.loop(TOPIC, handler)
+
+
+async def test_drain_finishes_in_flight() -> None:
+    store = InMemoryByteStore()
+    queue = InMemoryQueue([TOPIC])
+    started = asyncio.Barrier(3)
+    release = asyncio.Event()
+
+    async def handler(request: Request, conn: Connection) -> Defer | Response:
+        await started.wait()
+        await release.wait()
+        return Response(payload=request.call.payload)
+
+    async with brrr.serve(queue, store, store) as conn:
+        await conn.schedule_raw(TOPIC, "hash1", "foo", b"1")
+        await conn.schedule_raw(TOPIC, "hash2", "foo", b"2")
+        loop = asyncio.create_task(conn.loop(TOPIC, handler, max_in_flight=3))
+        await started.wait()
+        drain = asyncio.create_task(conn.drain(10))
+        await asyncio.sleep(0)
+        release.set()
+        report = await drain
+        await loop
+        assert report.finished == 2
+        assert report.abandoned == []
+        assert await conn.read_raw("hash1") == b"1"
+        assert await conn.read_raw("hash2") == b"2"
+
+
+async def test_drain_stops_waiting_loop() -> None:
+    store = InMemoryByteStore()
+    queue = InMemoryQueue([TOPIC])
+    queue.recv_block_secs = 60
+
+    async def handler(request: Request, conn: Connection) -> Defer | Response:
+        assert False
+
+    async with brrr.serve(queue, store, store) as conn:
+        loop = asyncio.create_task(conn.loop(TOPIC, handler))
+        await asyncio.sleep(0.01)
+        async with asyncio.timeout(1):
+            report = await conn.drain()
+            await loop
+        assert report.finished == 0
+        assert report.abandoned == []
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 2])
+async def test_drain_races_receive(max_in_flight: int) -> None:
+    store = InMemoryByteStore()
+    queue = InMemoryQueue([TOPIC])
+    queue.recv_block_secs = 60
+
+    async def handler(request: Request, conn: Connection) -> Defer | Response:
+        return Response(payload=request.call.payload)
+
+    async with brrr.serve(queue, store, store) as conn:
+        loop = asyncio.create_task(
+            conn.loop(TOPIC, handler, max_in_flight=max_in_flight)
+        )
+        await asyncio.sleep(0.01)
+        # Received, but the loop only gets to it once the drain has started
+        await conn.schedule_raw(TOPIC, "hash1", "foo", b"1")
+        async with asyncio.timeout(1):
+            report = await conn.drain()
+            await loop
+        assert report.abandoned == []
+        if max_in_flight == 1:
+            # Interrupted while receiving: never taken off the queue
+            assert report.finished == 0
+            assert (await queue.get_info(TOPIC)).num_messages == 1
+        else:
+            # Already taken off the queue: handled, and waited for
+            assert report.finished == 1
+            assert await conn.read_raw("hash1") == b"1"
+
+
+async def test_drain_abandons_after_timeout() -> None:
+    store = InMemoryByteStore()
+    queue = InMemoryQueue([TOPIC])
+    started = asyncio.Event()
+
+    async def handler(request: Request, conn: Connection) -> Defer | Response:
+        started.set()
+        await asyncio.Event().wait()
+        assert False
+
+    async with brrr.serve(queue, store, store) as conn:
+        await conn.schedule_raw(TOPIC, "hash1", "foo", b"1")
+        loop = asyncio.create_task(conn.loop(TOPIC, handler))
+        await started.wait()
+        report = await conn.drain(0.01)
+        await loop
+        assert report.finished == 0
+        [(topic, message)] = report.abandoned
+        assert topic == TOPIC
+        # Put back for someone else to pick up
+        assert (await queue.get_message(TOPIC)).body == message.body
+
+
+async def test_drain_waits_for_commit() -> None:
+    writing = asyncio.Event()
+    release = asyncio.Event()
+
+    class SlowStore(InMemoryByteStore):
+        async def set(self, key: MemKey, value: bytes) -> None:
+            if key.type == "value":
+                writing.set()
+                await release.wait()
+            await super().set(key, value)
+
+    store = SlowStore()
+    queue = InMemoryQueue([TOPIC])
+
+    async def handler(request: Request, conn: Connection) -> Defer | Response:
+        return Response(payload=b"done")
+
+    async with brrr.serve(queue, store, store) as conn:
+        await conn.schedule_raw(TOPIC, "hash1", "foo", b"1")
+        loop = asyncio.create_task(conn.loop(TOPIC, handler))
+        await writing.wait()
+        # The deadline passes while the value is being written
+        drain = asyncio.create_task(conn.drain(0))
+        await asyncio.sleep(0.01)
+        release.set()
+        report = await drain
+        await loop
+        assert report.finished == 1
+        assert report.abandoned == []
+        assert await conn.read_raw("hash1") == b"done"
+
+
+class AckingQueue(InMemoryQueue):
+    def __init__(self, topics: list[str]):
+        super().__init__(topics)
+        self.acked: list[tuple[str, Message]] = []
+        self.nacked: list[tuple[str, Message]] = []
+
+    async def ack(self, topic: str, message: Message) -> None:
+        self.acked.append((topic, message))
+
+    async def nack(self, topic: str, message: Message) -> None:
+        self.nacked.append((topic, message))
+
+
+async def test_loop_acks_handled_messages() -> None:
+    store = InMemoryByteStore()
+    queue = AckingQueue([TOPIC])
+
+    async def handler(request: Request, conn: Connection) -> Defer | Response:
+        if request.call.payload == b"fail":
+            raise ValueError("fail")
+        return Response(payload=request.call.payload)
+
+    async with brrr.serve(queue, store, store) as conn:
+        await conn.schedule_raw(TOPIC, "hash1", "foo", b"1")
+        queue.flush()
+        await conn.loop(TOPIC, handler)
+        [(topic, _)] = queue.acked
+        assert topic == TOPIC
+        assert queue.nacked == []
+        assert await conn.read_raw("hash1") == b"1"
+
+    queue = AckingQueue([TOPIC])
+    async with brrr.serve(queue, store, store) as conn:
+        await conn.schedule_raw(TOPIC, "hash2", "foo", b"fail")
+        with pytest.raises(ValueError):
+            await conn.loop(TOPIC, handler)
+        # Given back to the queue to redeliver
+        assert queue.acked == []
+        [(topic, _)] = queue.nacked
+        assert topic == TOPIC
+
+
+async def test_loop_acks_spawn_limited_messages() -> None:
+    store = InMemoryByteStore()
+    queue = AckingQueue([TOPIC])
+
+    async def handler(request: Request, conn: Connection) -> Defer | Response:
+        call = Call(call_hash="hash2", task_name="bar", payload=b"")
+        return Defer(calls=[DeferredCall(topic=None, call=call)])
+
+    async with brrr.serve(queue, store, store) as conn:
+        conn._spawn_limit = 1
+        await conn.schedule_raw(TOPIC, "hash1", "foo", b"1")
+        with pytest.raises(brrr.SpawnLimitError):
+            await conn.loop(TOPIC, handler)
+        # Redelivering it would only hit the limit again
+        [(topic, _)] = queue.acked
+        assert topic == TOPIC
+        assert queue.nacked == []
+
+
+async def test_drain_acks_requeued_messages() -> None:
+    store = InMemoryByteStore()
+    queue = AckingQueue([TOPIC])
+    started = asyncio.Event()
+
+    async def handler(request: Request, conn: Connection) -> Defer | Response:
+        started.set()
+        await asyncio.Event().wait()
+        assert False
+
+    async with brrr.serve(queue, store, store) as conn:
+        await conn.schedule_raw(TOPIC, "hash1", "foo", b"1")
+        loop = asyncio.create_task(conn.loop(TOPIC, handler))
+        await started.wait()
+        report = await conn.drain(0.01)
+        await loop
+        # Put back by the drain, so it mustn't be redelivered
+        assert queue.acked == report.abandoned
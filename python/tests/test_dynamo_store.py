@@ -7,11 +7,20 @@ from unittest.mock import AsyncMock, call
 import aioboto3
 import pytest
 from brrr.backends.dynamo import DynamoDbMemStore
-from brrr.store import MemKey, NotFoundError, Store
+from brrr.store import CompareMismatch, MemKey, NotFoundError, Store
 
 from .contract_store import MemoryContract
 
 
+class FakeConditionalCheck(Exception):
+    pass
+
+
+class FakeTransactionCanceled(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
 @pytest.mark.dependencies
 class TestDynamoByteStore(MemoryContract):
     @asynccontextmanager
@@ -83,3 +92,297 @@ class TestDynamoByteStoreUnit:
 
         with pytest.raises(KeyError):
             await mock_dynamo_mem_store.get_with_retry(MemKey("type", "call_hash"))
+
+    async def test_get_many__batches(self) -> None:
+        keys = [MemKey("value", f"id-{i}") for i in range(150)]
+
+        async def batch_get_item(RequestItems):
+            return {
+                "Responses": {
+                    "table": [
+                        {**k, "value": {"B": k["pk"]["S"].encode()}}
+                        for k in RequestItems["table"]["Keys"]
+                        if k["pk"]["S"] != "id-7"
+                    ]
+                }
+            }
+
+        mock_client = AsyncMock()
+        mock_client.batch_get_item.side_effect = batch_get_item
+
+        store = DynamoDbMemStore(mock_client, "table")
+        values = await store.get_many(keys + keys[:3])
+
+        assert mock_client.batch_get_item.call_count == 2
+        sizes = sorted(
+            len(c.kwargs["RequestItems"]["table"]["Keys"])
+            for c in mock_client.batch_get_item.call_args_list
+        )
+        assert sizes == [50, 100]
+        expected = [
+            None if k.call_hash == "id-7" else k.call_hash.encode() for k in keys
+        ]
+        assert values == expected + expected[:3]
+
+    async def test_get_many__unprocessed__retry(self) -> None:
+        key_a = {"pk": {"S": "a"}, "sk": {"S": "value"}}
+        key_b = {"pk": {"S": "b"}, "sk": {"S": "value"}}
+        mock_client = AsyncMock()
+        mock_client.batch_get_item.side_effect = [
+            {
+                "Responses": {"table": [{**key_a, "value": {"B": b"1"}}]},
+                "UnprocessedKeys": {"table": {"Keys": [key_b]}},
+            },
+            {"Responses": {"table": [{**key_b, "value": {"B": b"2"}}]}},
+        ]
+
+        store = DynamoDbMemStore(mock_client, "table")
+        values = await store.get_many([MemKey("value", "a"), MemKey("value", "b")])
+
+        assert values == [b"1", b"2"]
+        assert mock_client.batch_get_item.call_args_list == [
+            call(RequestItems={"table": {"Keys": [key_a, key_b]}}),
+            call(RequestItems={"table": {"Keys": [key_b]}}),
+        ]
+
+    async def test_set_many__batches(self) -> None:
+        mock_client = AsyncMock()
+        mock_client.batch_write_item.return_value = {}
+
+        store = DynamoDbMemStore(mock_client, "table")
+        items = [(MemKey("call", f"id-{i}"), b"old") for i in range(30)]
+        await store.set_many(items + [(MemKey("call", "id-0"), b"new")])
+
+        assert mock_client.batch_write_item.call_count == 2
+        written = [
+            request["PutRequest"]["Item"]
+            for c in mock_client.batch_write_item.call_args_list
+            for request in c.kwargs["RequestItems"]["table"]
+        ]
+        assert len(written) == 30
+        assert (
+            max(
+                len(c.kwargs["RequestItems"]["table"])
+                for c in mock_client.batch_write_item.call_args_list
+            )
+            == 25
+        )
+        by_hash = {item["pk"]["S"]: item["value"]["B"] for item in written}
+        assert by_hash["id-0"] == b"new"
+        assert by_hash["id-29"] == b"old"
+
+    async def test_set_many__unprocessed__retry(self) -> None:
+        put = {
+            "PutRequest": {
+                "Item": {"pk": {"S": "a"}, "sk": {"S": "call"}, "value": {"B": b"x"}}
+            }
+        }
+        mock_client = AsyncMock()
+        mock_client.batch_write_item.side_effect = [
+            {"UnprocessedItems": {"table": [put]}},
+            {"UnprocessedItems": {"table": [put]}},
+            {"UnprocessedItems": {}},
+        ]
+
+        store = DynamoDbMemStore(mock_client, "table")
+        await store.set_many([(MemKey("call", "a"), b"x")])
+
+        assert (
+            mock_client.batch_write_item.call_args_list
+            == [
+                call(RequestItems={"table": [put]}),
+            ]
+            * 3
+        )
+
+    async def test_set_many__unprocessed__gives_up(self) -> None:
+        put = {
+            "PutRequest": {
+                "Item": {"pk": {"S": "a"}, "sk": {"S": "call"}, "value": {"B": b"x"}}
+            }
+        }
+        mock_client = AsyncMock()
+        mock_client.batch_write_item.return_value = {
+            "UnprocessedItems": {"table": [put]}
+        }
+
+        store = DynamoDbMemStore(mock_client, "table")
+        store_sleep = asyncio.sleep
+
+        async def no_sleep(_: float) -> None:
+            await store_sleep(0)
+
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr(asyncio, "sleep", no_sleep)
+            with pytest.raises(RuntimeError):
+                await store.set_many([(MemKey("call", "a"), b"x")])
+
+    async def test_set_and_compare_and_set__transaction(self) -> None:
+        mock_client = AsyncMock()
+        store = DynamoDbMemStore(mock_client, "table")
+        await store.set_and_compare_and_set(
+            [(MemKey("call", "a"), b"call")],
+            MemKey("pending_returns", "a"),
+            b"new",
+            b"old",
+        )
+
+        mock_client.transact_write_items.assert_called_once_with(
+            TransactItems=[
+                {
+                    "Put": {
+                        "TableName": "table",
+                        "Item": {
+                            "pk": {"S": "a"},
+                            "sk": {"S": "call"},
+                            "value": {"B": b"call"},
+                        },
+                    }
+                },
+                {
+                    "Update": {
+                        "TableName": "table",
+                        "Key": {"pk": {"S": "a"}, "sk": {"S": "pending_returns"}},
+                        "UpdateExpression": "SET #value = :value",
+                        "ExpressionAttributeNames": {"#value": "value"},
+                        "ExpressionAttributeValues": {
+                            ":value": {"B": b"new"},
+                            ":expected": {"B": b"old"},
+                        },
+                        "ConditionExpression": "#value = :expected",
+                    }
+                },
+            ]
+        )
+
+    @pytest.mark.parametrize(
+        "code,raises",
+        [
+            ("ConditionalCheckFailed", CompareMismatch),
+            ("TransactionConflict", CompareMismatch),
+            ("ValidationError", FakeTransactionCanceled),
+        ],
+    )
+    async def test_set_and_compare_and_set__cancelled(
+        self, code: str, raises: type[Exception]
+    ) -> None:
+        mock_client = AsyncMock()
+        mock_client.exceptions.TransactionCanceledException = FakeTransactionCanceled
+        mock_client.transact_write_items.side_effect = FakeTransactionCanceled(
+            {"CancellationReasons": [{"Code": "None"}, {"Code": code}]}
+        )
+        store = DynamoDbMemStore(mock_client, "table")
+
+        with pytest.raises(raises):
+            await store.set_and_compare_and_set(
+                [(MemKey("call", "a"), b"call")],
+                MemKey("pending_returns", "a"),
+                b"new",
+                None,
+            )
+
+    async def test_set_and_compare_and_set__no_items(self) -> None:
+        mock_client = AsyncMock()
+        store = DynamoDbMemStore(mock_client, "table")
+        await store.set_and_compare_and_set(
+            [], MemKey("pending_returns", "a"), b"new", None
+        )
+
+        mock_client.transact_write_items.assert_not_called()
+        assert mock_client.update_item.call_count == 1
+
+    async def test_get_items__paginated(self) -> None:
+        mock_client = AsyncMock()
+        mock_client.query.side_effect = [
+            {
+                "Items": [{"sk": {"S": "pending_returns/x-\xff"}}],
+                "LastEvaluatedKey": {"pk": {"S": "a"}},
+            },
+            {"Items": [{"sk": {"S": "pending_returns/x-2"}}]},
+        ]
+        store = DynamoDbMemStore(mock_client, "table")
+
+        items = await store.get_items(MemKey("pending_returns", "a"), b"x-")
+
+        assert items == [b"x-\xff", b"x-2"]
+        assert mock_client.query.call_count == 2
+        first, second = mock_client.query.call_args_list
+        assert first.kwargs["ExpressionAttributeValues"] == {
+            ":pk": {"S": "a"},
+            ":prefix": {"S": "pending_returns/x-"},
+        }
+        assert second.kwargs["ExclusiveStartKey"] == {"pk": {"S": "a"}}
+
+    @pytest.mark.parametrize("version", [0, 3])
+    async def test_delete_items__version(self, version: int) -> None:
+        mock_client = AsyncMock()
+        mock_client.batch_write_item.return_value = {}
+        mock_client.exceptions.ConditionalCheckFailedException = FakeConditionalCheck
+        mock_client.delete_item.side_effect = FakeConditionalCheck()
+        store = DynamoDbMemStore(mock_client, "table")
+
+        with pytest.raises(CompareMismatch):
+            await store.delete_items(
+                MemKey("pending_returns", "a"), [b"x", b"x", b"y"], version
+            )
+
+        [batch] = mock_client.batch_write_item.call_args_list
+        assert [
+            r["DeleteRequest"]["Key"]["sk"]["S"]
+            for r in batch.kwargs["RequestItems"]["table"]
+        ] == ["pending_returns/x", "pending_returns/y"]
+        condition = mock_client.delete_item.call_args.kwargs["ConditionExpression"]
+        if version:
+            assert condition == "#version = :version"
+        else:
+            assert condition == "attribute_not_exists(#version)"
+
+    @pytest.mark.parametrize(
+        "failures, result",
+        [(0, (False, False)), (1, (True, False)), (2, (False, True))],
+    )
+    async def test_add_to_set(self, failures: int, result: tuple[bool, bool]) -> None:
+        mock_client = AsyncMock()
+        mock_client.exceptions.ConditionalCheckFailedException = FakeConditionalCheck
+        mock_client.update_item.side_effect = [FakeConditionalCheck()] * failures + [{}]
+        store = DynamoDbMemStore(mock_client, "table")
+
+        assert (
+            await store.add_to_set(MemKey("pending_returns", "a"), b"x-one", b"x")
+            == result
+        )
+
+        # Nothing but the new member and its group is ever sent or read back
+        for request in mock_client.update_item.call_args_list:
+            assert "ReturnValues" not in request.kwargs
+            values = request.kwargs["ExpressionAttributeValues"]
+            assert values[":new_members"] == {"BS": [b"x-one"]}
+            assert values[":new_groups"] == {"BS": [b"x"]}
+
+    async def test_add_to_set__raced(self) -> None:
+        mock_client = AsyncMock()
+        mock_client.exceptions.ConditionalCheckFailedException = FakeConditionalCheck
+        # The set is removed between the attempts, so none of them applied
+        mock_client.update_item.side_effect = [FakeConditionalCheck()] * 4 + [{}]
+        store = DynamoDbMemStore(mock_client, "table")
+
+        key = MemKey("pending_returns", "a")
+        assert await store.add_to_set(key, b"x-one", b"x") == (True, False)
+        assert mock_client.update_item.call_count == 5
+
+    async def test_remove_from_set__last_raced(self) -> None:
+        mock_client = AsyncMock()
+        mock_client.update_item.return_value = {"Attributes": {"pk": {"S": "a"}}}
+        mock_client.exceptions.ConditionalCheckFailedException = FakeConditionalCheck
+        mock_client.delete_item.side_effect = FakeConditionalCheck()
+        mock_client.get_item.return_value = {"Item": {"members": {"BS": [b"new"]}}}
+        store = DynamoDbMemStore(mock_client, "table")
+
+        remaining = await store.remove_from_set(
+            MemKey("pending_returns", "a"), [b"one"]
+        )
+
+        # Emptied, but someone added a member before the item was deleted
+        assert remaining == {b"new"}
+        condition = mock_client.delete_item.call_args.kwargs["ConditionExpression"]
+        assert condition == "attribute_not_exists(#members)"
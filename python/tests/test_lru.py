@@ -0,0 +1,53 @@
+from brrr.lru import LruCache
+
+
+def test_lru_evicts_least_recently_used() -> None:
+    cache = LruCache[str, int](3)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.put("c", 3)
+    assert cache.get("a") == 1
+    cache.put("d", 4)
+    assert "b" not in cache
+    assert [cache.get(k) for k in "acd"] == [1, 3, 4]
+    assert len(cache) == 3
+
+
+def test_lru_weight() -> None:
+    cache = LruCache[str, bytes](10, len)
+    cache.put("a", b"12345")
+    cache.put("b", b"1234")
+    assert cache.weight == 9
+    cache.put("c", b"12")
+    assert "a" not in cache
+    assert cache.weight == 6
+    # Replacing an entry replaces its weight
+    cache.put("b", b"1")
+    assert cache.weight == 3
+    # Too big to cache at all, and it doesn't evict anything else either
+    cache.put("d", b"12345678901")
+    assert "d" not in cache
+    assert len(cache) == 2
+
+
+def test_lru_counters() -> None:
+    cache = LruCache[str, int](2)
+    assert cache.hit_rate == 0
+    assert cache.get("a") is None
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    assert cache.get("a") == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert cache.pop("a") == 1
+    assert cache.get("a") is None
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert cache.hit_rate == 0.5
+
+
+def test_lru_disabled() -> None:
+    cache = LruCache[str, bytes](0, len)
+    cache.put("a", b"1")
+    assert cache.get("a") is None
+    # Empty values weigh nothing, which is fine
+    cache.put("b", b"")
+    assert cache.get("b") == b""
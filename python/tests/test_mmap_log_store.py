@@ -0,0 +1,111 @@
+import asyncio
+import tempfile
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import pytest
+from brrr.backends.mmap_log import MmapLogStore
+from brrr.store import MemKey, NotFoundError, Store
+
+from .contract_store import MemoryContract
+
+
+class TestMmapLogStore(MemoryContract):
+    @asynccontextmanager
+    async def with_store(self) -> AsyncIterator[Store]:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = MmapLogStore(tmp, segment_size=4096)
+            try:
+                yield store
+            finally:
+                store.close()
+
+
+async def test_reopen(tmp_path: Path) -> None:
+    a, b, c = (MemKey("value", k) for k in ("a", "b", "c"))
+    store = MmapLogStore(tmp_path, segment_size=256)
+    for i in range(20):
+        await store.set(a, b"a-%d" % i)
+    await store.set(b, b"b" * 1000)
+    await store.set(c, b"c")
+    await store.delete(c)
+    store.close()
+
+    store = MmapLogStore(tmp_path, segment_size=256)
+    assert await store.get(a) == b"a-19"
+    assert await store.get(b) == b"b" * 1000
+    assert not await store.has(c)
+    await store.set(c, b"again")
+    store.close()
+
+    store = MmapLogStore(tmp_path, segment_size=256)
+    assert await store.get(c) == b"again"
+    store.close()
+
+
+async def test_torn_record(tmp_path: Path) -> None:
+    store = MmapLogStore(tmp_path)
+    await store.set(MemKey("value", "a"), b"one")
+    await store.set(MemKey("value", "b"), b"two")
+    store.close()
+
+    [segment] = tmp_path.glob("*.log")
+    data = bytearray(segment.read_bytes())
+    # Corrupt the last byte of the last record's value
+    data[data.index(b"two") + 2] ^= 0xFF
+    segment.write_bytes(data)
+
+    store = MmapLogStore(tmp_path)
+    assert await store.get(MemKey("value", "a")) == b"one"
+    assert not await store.has(MemKey("value", "b"))
+    # The torn record is overwritten by the next one
+    await store.set(MemKey("value", "c"), b"three")
+    store.close()
+
+    store = MmapLogStore(tmp_path)
+    assert await store.get(MemKey("value", "c")) == b"three"
+    store.close()
+
+
+async def test_compaction(tmp_path: Path) -> None:
+    store = MmapLogStore(tmp_path, segment_size=1024)
+    keys = [MemKey("value", str(i)) for i in range(10)]
+    for round in range(50):
+        for key in keys:
+            await store.set(key, b"%s-%d" % (key.call_hash.encode(), round))
+        await asyncio.sleep(0)
+    await store.delete(keys[0])
+    await store.compact()
+
+    # Only the latest values are left, which fit in a few segments
+    assert len(list(tmp_path.glob("*.log"))) <= 2
+    for key in keys[1:]:
+        assert await store.get(key) == b"%s-49" % key.call_hash.encode()
+    assert not await store.has(keys[0])
+    store.close()
+
+    store = MmapLogStore(tmp_path, segment_size=1024)
+    for key in keys[1:]:
+        assert await store.get(key) == b"%s-49" % key.call_hash.encode()
+    assert not await store.has(keys[0])
+    store.close()
+
+
+async def test_get_view(tmp_path: Path) -> None:
+    store = MmapLogStore(tmp_path)
+    key = MemKey("value", "a")
+    with pytest.raises(NotFoundError):
+        store.get_view(key)
+    await store.set(key, b"value")
+    with store.get_view(key) as view:
+        assert view == b"value"
+    store.close()
+
+
+async def test_exclusive(tmp_path: Path) -> None:
+    store = MmapLogStore(tmp_path)
+    with pytest.raises(RuntimeError):
+        MmapLogStore(tmp_path)
+    store.close()
+    MmapLogStore(tmp_path).close()
@@ -0,0 +1,61 @@
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+import pytest
+from brrr.backends.filesystem import FileBlobStore
+from brrr.backends.in_memory import InMemoryBlobStore, InMemoryByteStore
+from brrr.offload import MAGIC, OffloadingStore
+from brrr.store import MemKey, Memory, Store
+
+from .contract_store import MemoryContract
+
+
+class TestOffloadingStore(MemoryContract):
+    @asynccontextmanager
+    async def with_store(self) -> AsyncIterator[Store]:
+        # Small enough to offload most records in the contract tests
+        yield OffloadingStore(InMemoryByteStore(), InMemoryBlobStore(), threshold=7)
+
+
+async def test_offload_large_values(tmp_path) -> None:
+    inner = InMemoryByteStore()
+    store = OffloadingStore(inner, FileBlobStore(tmp_path), threshold=100)
+    memory = Memory(store)
+    large = b"x" * 1000
+
+    await memory.set_value("large", large)
+    await memory.set_value("small", b"y")
+    assert await memory.get_value("large") == large
+    assert await Memory(store).get_values(["large", "small"]) == {
+        "large": large,
+        "small": b"y",
+    }
+
+    ref = await inner.get(MemKey("value", "large"))
+    assert ref.startswith(MAGIC)
+    assert len(ref) < 100
+    assert await inner.get(MemKey("value", "small")) == b"y"
+    assert len(list(tmp_path.glob("*/*"))) == 1
+
+
+async def test_offload_magic_prefix() -> None:
+    inner = InMemoryByteStore()
+    store = OffloadingStore(inner, InMemoryBlobStore())
+    tricky = MAGIC + b"not a reference"
+
+    await store.set(MemKey("value", "a"), tricky)
+    assert await store.get(MemKey("value", "a")) == tricky
+    assert await inner.get(MemKey("value", "a")) != tricky
+
+
+async def test_file_blob_store(tmp_path) -> None:
+    blobs = FileBlobStore(tmp_path)
+    await blobs.put("abcdef", b"data")
+    # Idempotent
+    await blobs.put("abcdef", b"data")
+    assert await blobs.get("abcdef") == b"data"
+    assert (tmp_path / "ab" / "abcdef").read_bytes() == b"data"
+    assert [p.name for p in (tmp_path / "ab").iterdir()] == ["abcdef"]
+
+    with pytest.raises(FileNotFoundError):
+        await blobs.get("missing")
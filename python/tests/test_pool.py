@@ -0,0 +1,139 @@
+import os
+import signal
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import brrr
+from brrr import Connection, Defer, Request, Response, Server
+from brrr.backends.in_memory import InMemoryByteStore, InMemoryQueue
+from brrr.connection import Handler
+from brrr.queue import Queue
+from brrr.store import Cache, Store
+
+TOPIC = "brrr-test"
+
+
+async def handler(request: Request, conn: Connection) -> Defer | Response:
+    assert False
+
+
+def make_handler(server: Server) -> Handler:
+    return handler
+
+
+def log_start(path: Path) -> int:
+    with path.open("a") as f:
+        f.write(f"{os.getpid()}\n")
+    return len(path.read_text().splitlines())
+
+
+def test_pool_closed_queue(tmp_path: Path) -> None:
+    starts = tmp_path / "starts"
+
+    @asynccontextmanager
+    async def backends() -> AsyncIterator[tuple[Queue, Store, Cache]]:
+        log_start(starts)
+        store = InMemoryByteStore()
+        queue = InMemoryQueue([TOPIC])
+        await queue.close()
+        yield queue, store, store
+
+    brrr.serve_pool(backends, make_handler, TOPIC, processes=3)
+
+    assert len(set(starts.read_text().splitlines())) == 3
+
+
+def test_pool_restarts_crashed_worker(tmp_path: Path) -> None:
+    starts = tmp_path / "starts"
+
+    @asynccontextmanager
+    async def backends() -> AsyncIterator[tuple[Queue, Store, Cache]]:
+        if log_start(starts) < 3:
+            raise RuntimeError("crash")
+        store = InMemoryByteStore()
+        queue = InMemoryQueue([TOPIC])
+        await queue.close()
+        yield queue, store, store
+
+    brrr.serve_pool(backends, make_handler, TOPIC, processes=1, restart_delay_secs=0)
+
+    assert len(starts.read_text().splitlines()) == 3
+
+
+def test_pool_stops_on_sigterm(tmp_path: Path) -> None:
+    starts = tmp_path / "starts"
+
+    @asynccontextmanager
+    async def backends() -> AsyncIterator[tuple[Queue, Store, Cache]]:
+        if log_start(starts) == 2:
+            # All workers are up: ask the supervisor to shut down
+            os.kill(os.getppid(), signal.SIGTERM)
+        store = InMemoryByteStore()
+        # Never closed: the workers only stop because they're told to
+        yield InMemoryQueue([TOPIC]), store, store
+
+    brrr.serve_pool(backends, make_handler, TOPIC, processes=2)
+
+    assert len(starts.read_text().splitlines()) == 2
+
+
+def test_pool_kills_stuck_worker(tmp_path: Path) -> None:
+    starts = tmp_path / "starts"
+
+    @asynccontextmanager
+    async def backends() -> AsyncIterator[tuple[Queue, Store, Cache]]:
+        store = InMemoryByteStore()
+        yield InMemoryQueue([TOPIC]), store, store
+
+    def make_handler(server: Server) -> Handler:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        log_start(starts)
+        os.kill(os.getppid(), signal.SIGTERM)
+        # Stuck for good, as far as the supervisor can tell
+        time.sleep(60)
+        return handler
+
+    start = time.monotonic()
+    brrr.serve_pool(
+        backends,
+        make_handler,
+        TOPIC,
+        processes=1,
+        drain_timeout_secs=0,
+        shutdown_timeout_secs=1,
+    )
+
+    assert time.monotonic() - start < 30
+    assert len(starts.read_text().splitlines()) == 1
+
+
+def test_pool_passes_server_options(tmp_path: Path) -> None:
+    options = tmp_path / "options"
+
+    @asynccontextmanager
+    async def backends() -> AsyncIterator[tuple[Queue, Store, Cache]]:
+        store = InMemoryByteStore()
+        queue = InMemoryQueue([TOPIC])
+        await queue.close()
+        yield queue, store, store
+
+    def make_handler(server: Server) -> Handler:
+        options.write_text(
+            f"{server._eager_depth} {server._eager_calls} "
+            f"{server._memory.call_cache.max_weight}"
+        )
+        return handler
+
+    brrr.serve_pool(
+        backends,
+        make_handler,
+        TOPIC,
+        processes=1,
+        eager_depth=2,
+        eager_calls=10,
+        call_cache_size=5,
+    )
+
+    assert options.read_text() == "2 10 5"
@@ -1,11 +1,14 @@
+import asyncio
 import os
+import typing
+import uuid
 from collections.abc import Sequence
 from contextlib import asynccontextmanager
 from typing import AsyncIterator
 
 import pytest
 import redis.asyncio as redis
-from brrr.backends.redis import RedisQueue
+from brrr.backends.redis import RedisQueue, ReliableRedisQueue
 from brrr.queue import Queue
 
 from tests.contract_queue import QueueContract
@@ -42,3 +45,109 @@ class TestRedisQueue(QueueContract):
         RedisQueue.recv_block_secs = 1
         async with with_redis(os.environ.get("BRRR_TEST_REDIS_URL")) as rc:
             yield RedisQueue(rc)
+
+
+async def test_redis_queue_single_message_uses_blpop() -> None:
+    class Redis6:
+        """Only the commands a Redis 6 server knows, of those used here."""
+
+        async def blpop(self, key: str, timeout: int) -> tuple[bytes, bytes]:
+            return key.encode("utf-8"), b"one"
+
+    queue = RedisQueue(typing.cast(redis.Redis, Redis6()))
+    [message] = await queue.get_messages("test-single", 1)
+    assert message.body == "one"
+
+
+@pytest.mark.dependencies
+async def test_redis_queue_bytes_bodies() -> None:
+    RedisQueue.recv_block_secs = 1
+    async with with_redis(os.environ.get("BRRR_TEST_REDIS_URL")) as rc:
+        queue = RedisQueue(rc, bytes_bodies=True)
+        await queue.put_message_bytes("test-bytes", b"one")
+        await queue.put_message("test-bytes", "two")
+        assert (await queue.get_message("test-bytes")).body == b"one"
+        assert (await queue.get_message("test-bytes")).body == b"two"
+
+
+@pytest.mark.dependencies
+class TestReliableRedisQueue(QueueContract):
+    has_accurate_info = True
+
+    @asynccontextmanager
+    async def with_queue(self, topics: Sequence[str]) -> AsyncIterator[Queue]:
+        ReliableRedisQueue.recv_block_secs = 1
+        async with with_redis(os.environ.get("BRRR_TEST_REDIS_URL")) as rc:
+            # Fresh topics, whatever was left behind by earlier runs
+            await rc.delete(*topics)
+            queue = ReliableRedisQueue(rc)
+            try:
+                yield queue
+            finally:
+                await queue.close()
+
+
+@pytest.mark.dependencies
+async def test_reliable_redis_queue_reaps_dead_workers() -> None:
+    ReliableRedisQueue.recv_block_secs = 1
+    topic = f"test-reliable-{uuid.uuid4()}"
+    async with with_redis(os.environ.get("BRRR_TEST_REDIS_URL")) as rc:
+        dead = ReliableRedisQueue(rc, lease_secs=0.2)
+        alive = ReliableRedisQueue(rc, lease_secs=0.2)
+        await dead.put_messages(topic, ["one", "two", "three"])
+
+        [one, two] = await dead.get_messages(topic, 2)
+        await dead.ack(topic, one)
+        await dead.close()
+        [three] = await alive.get_messages(topic, 1)
+        assert (one.body, two.body, three.body) == ("one", "two", "three")
+
+        await asyncio.sleep(0.5)
+        # Only the unacknowledged message of the dead worker comes back
+        assert await alive.reap(topic) == 1
+        assert (await alive.get_message(topic)).body == "two"
+        await alive.ack(topic, three)
+        assert await alive.reap(topic) == 0
+        await alive.close()
+
+
+@pytest.mark.dependencies
+async def test_reliable_redis_queue_nack() -> None:
+    ReliableRedisQueue.recv_block_secs = 1
+    topic = f"test-reliable-{uuid.uuid4()}"
+    async with with_redis(os.environ.get("BRRR_TEST_REDIS_URL")) as rc:
+        queue = ReliableRedisQueue(rc, max_deliveries=2, retry_delay_secs=0.2)
+        await queue.put_messages(topic, ["one", "two"])
+        one = await queue.get_message(topic)
+        await queue.nack(topic, one)
+        # Put aside for a bit, and no longer this worker's
+        assert (await queue.get_message(topic)).body == "two"
+        assert await rc.llen(topic) == 0
+        await asyncio.sleep(0.3)
+        assert (await queue.get_message(topic)).body == "one"
+        await queue.nack(topic, one)
+        # Given up on for good
+        assert await rc.lrange(f"{topic}:dead", 0, -1) == [b"one"]
+        assert await rc.zcard(f"{topic}:delayed") == 0
+        assert await rc.hlen(f"{topic}:deliveries") == 0
+        assert await queue.reap(topic) == 0
+        await queue.close()
+
+
+@pytest.mark.dependencies
+async def test_reliable_redis_queue_reaps_to_dead_letters() -> None:
+    ReliableRedisQueue.recv_block_secs = 1
+    topic = f"test-reliable-{uuid.uuid4()}"
+    async with with_redis(os.environ.get("BRRR_TEST_REDIS_URL")) as rc:
+        alive = ReliableRedisQueue(rc, lease_secs=0.2, max_deliveries=2)
+        await alive.put_message(topic, "one")
+        for _ in range(2):
+            dead = ReliableRedisQueue(rc, lease_secs=0.2, max_deliveries=2)
+            assert (await dead.get_message(topic)).body == "one"
+            await dead.close()
+            await asyncio.sleep(0.5)
+            await alive.reap(topic)
+        # Requeued once, then given up on
+        assert await rc.llen(topic) == 0
+        assert await rc.lrange(f"{topic}:dead", 0, -1) == [b"one"]
+        await alive.close()
@@ -0,0 +1,33 @@
+import os
+import uuid
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+import pytest
+from brrr.backends.redis import RedisStore
+from brrr.store import MemKey, Store
+
+from tests.contract_store import MemoryContract
+from tests.test_redis_queue import with_redis
+
+
+@pytest.mark.dependencies
+class TestRedisStore(MemoryContract):
+    @asynccontextmanager
+    async def with_store(self) -> AsyncIterator[Store]:
+        # A fresh prefix is as good as an empty database
+        async with with_redis(os.environ.get("BRRR_TEST_REDIS_URL")) as rc:
+            yield RedisStore(rc, prefix=f"brrr-test-{uuid.uuid4()}:")
+
+
+@pytest.mark.dependencies
+async def test_redis_store_prefix() -> None:
+    async with with_redis(os.environ.get("BRRR_TEST_REDIS_URL")) as rc:
+        prefix = f"brrr-test-{uuid.uuid4()}:"
+        one = RedisStore(rc, prefix=f"{prefix}one:")
+        two = RedisStore(rc, prefix=f"{prefix}two:")
+        key = MemKey("value", "id-1")
+
+        await one.set(key, b"one")
+        assert not await two.has(key)
+        assert await rc.get(f"{prefix}one:value/id-1") == b"one"
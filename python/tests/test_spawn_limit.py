@@ -9,7 +9,9 @@ from brrr.pickle_codec import PickleCodec
 from .parametrize import names
 
 
-async def test_spawn_limit_depth(topic: str, task_name: str) -> None:
+# Eager calls count towards the spawn limit just the same
+@pytest.mark.parametrize("eager_depth", [0, 5, 1000])
+async def test_spawn_limit_depth(topic: str, task_name: str, eager_depth: int) -> None:
     queue = InMemoryQueue([topic])
     store = InMemoryByteStore()
     n = 0
@@ -23,7 +25,7 @@ async def test_spawn_limit_depth(topic: str, task_name: str) -> None:
             return 0
         return await app.call(foo)(a - 1)
 
-    async with brrr.serve(queue, store, store) as conn:
+    async with brrr.serve(queue, store, store, eager_depth=eager_depth) as conn:
         conn._spawn_limit = 100
         app = AppWorker(handlers={task_name: foo}, codec=PickleCodec(), connection=conn)
         await app.schedule(task_name, topic=topic)(conn._spawn_limit + 3)
@@ -35,6 +37,31 @@ async def test_spawn_limit_depth(topic: str, task_name: str) -> None:
         assert n == conn._spawn_limit
 
 
+async def test_spawn_limit_in_flight(topic: str, task_name: str) -> None:
+    queue = InMemoryQueue([topic])
+    store = InMemoryByteStore()
+    n = 0
+
+    @brrr.handler
+    async def foo(app: ActiveWorker, a: int) -> int:
+        nonlocal n
+        n += 1
+        if a == 0:
+            return 0
+        return await app.call(foo)(a - 1)
+
+    async with brrr.serve(queue, store, store) as conn:
+        conn._spawn_limit = 100
+        app = AppWorker(handlers={task_name: foo}, codec=PickleCodec(), connection=conn)
+        await app.schedule(task_name, topic=topic)(conn._spawn_limit + 3)
+
+        # No flush: the pending receive must be cancelled for this to return
+        with pytest.raises(SpawnLimitError):
+            await conn.loop(topic, app.handle, max_in_flight=4)
+
+        assert n == conn._spawn_limit
+
+
 async def test_spawn_limit_breadth_mapped(topic: str, task_name: str) -> None:
     queue = InMemoryQueue([topic])
     store = InMemoryByteStore()
@@ -68,6 +95,36 @@ async def test_spawn_limit_breadth_mapped(topic: str, task_name: str) -> None:
     assert calls["foo"] == 1
 
 
+async def test_spawn_limit_breadth_partial(topic: str, task_name: str) -> None:
+    queue = InMemoryQueue([topic])
+    store = InMemoryByteStore()
+    name_one, name_foo = names(task_name, ("one", "foo"))
+
+    @brrr.handler_no_arg
+    async def one(_: int) -> int:
+        return 1
+
+    @brrr.handler
+    async def foo(app: ActiveWorker, a: int) -> int:
+        return sum(await app.gather(*map(app.call(one), range(a))))
+
+    async with brrr.serve(queue, store, store) as conn:
+        conn._spawn_limit = 100
+        app = AppWorker(
+            handlers={name_foo: foo, name_one: one},
+            codec=PickleCodec(),
+            connection=conn,
+        )
+        await app.schedule(name_foo, topic=topic)(conn._spawn_limit + 4)
+
+        with pytest.raises(SpawnLimitError):
+            await conn.loop(topic, app.handle)
+
+        # Children are enqueued in bulk, up to the limit, before raising
+        info = await queue.get_info(topic)
+        assert info.num_messages == conn._spawn_limit - 1
+
+
 async def test_spawn_limit_recoverable(topic: str, task_name: str) -> None:
     queue = InMemoryQueue([topic])
     store = InMemoryByteStore()
@@ -0,0 +1,76 @@
+import asyncio
+import sys
+import tempfile
+import time
+from collections.abc import AsyncIterator, Sequence
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from brrr.backends.sqlite import SqliteQueue
+from brrr.queue import Queue
+
+from tests.contract_queue import QueueContract
+
+
+class TestSqliteQueue(QueueContract):
+    has_accurate_info = True
+
+    @asynccontextmanager
+    async def with_queue(self, topics: Sequence[str]) -> AsyncIterator[Queue]:
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = SqliteQueue(Path(tmp) / "brrr.db")
+            queue.recv_block_secs = 1
+            try:
+                yield queue
+            finally:
+                await queue.close()
+
+
+async def test_sqlite_queue_wakes_up_across_processes(tmp_path: Path) -> None:
+    path = tmp_path / "brrr.db"
+    # Polling alone would take far longer than the test is allowed to
+    queue = SqliteQueue(path, poll_secs=60)
+    queue.recv_block_secs = 60
+    put = (
+        "import asyncio, sys\n"
+        "from brrr.backends.sqlite import SqliteQueue\n"
+        "async def main():\n"
+        "    await asyncio.sleep(0.5)\n"
+        "    queue = SqliteQueue(sys.argv[1])\n"
+        "    await queue.put_message('topic', 'hello')\n"
+        "    await queue.close()\n"
+        "asyncio.run(main())\n"
+    )
+    try:
+        # Create the database before racing with the other process
+        assert (await queue.get_info("topic")).num_messages == 0
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-c", put, str(path)
+        )
+        start = time.monotonic()
+        message = await queue.get_message("topic")
+        assert message.body == "hello"
+        assert time.monotonic() - start < 5
+        assert await proc.wait() == 0
+    finally:
+        await queue.close()
+
+
+async def test_sqlite_queue_wakes_up_every_receiver(tmp_path: Path) -> None:
+    # Polling alone would take far longer than the test is allowed to
+    queue = SqliteQueue(tmp_path / "brrr.db", poll_secs=60)
+    queue.recv_block_secs = 60
+    try:
+        receivers = [
+            asyncio.create_task(queue.get_message(topic))
+            for topic in ("one", "one", "two")
+        ]
+        await asyncio.sleep(0.1)
+        start = time.monotonic()
+        await queue.put_messages("one", ["a", "b"])
+        await queue.put_message("two", "c")
+        messages = await asyncio.gather(*receivers)
+        assert sorted(message.body for message in messages) == ["a", "b", "c"]
+        assert time.monotonic() - start < 5
+    finally:
+        await queue.close()
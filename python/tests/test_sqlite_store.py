@@ -0,0 +1,34 @@
+import tempfile
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from brrr.backends.sqlite import SqliteStore
+from brrr.store import MemKey, Store
+
+from .contract_store import MemoryContract
+
+
+class TestSqliteStore(MemoryContract):
+    @asynccontextmanager
+    async def with_store(self) -> AsyncIterator[Store]:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SqliteStore(Path(tmp) / "brrr.db")
+            try:
+                yield store
+            finally:
+                await store.close()
+
+
+async def test_sqlite_store_shared_file(tmp_path: Path) -> None:
+    one = SqliteStore(tmp_path / "brrr.db")
+    two = SqliteStore(tmp_path / "brrr.db")
+    key = MemKey("value", "id-1")
+    try:
+        await one.set(key, b"one")
+        assert await two.get(key) == b"one"
+        assert await one.incr_by("counter", 3) == 3
+        assert await two.incr("counter") == 4
+    finally:
+        await one.close()
+        await two.close()
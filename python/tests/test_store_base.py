@@ -1,12 +1,16 @@
 import functools
+from collections import Counter
 
 import pytest
 from brrr.backends.in_memory import InMemoryByteStore
+from brrr.call import Call
+from brrr.cas import ImmediateRetry
 from brrr.store import (
     CompareMismatch,
     MemKey,
     Memory,
     PendingReturns,
+    prefix_end,
 )
 from brrr.tagged_tuple import PendingReturn
 
@@ -46,12 +50,191 @@ async def test_memory_cas():
     # don’t think the API for the store is correct to begin with and we should
     # probably just remove it entirely.  This primitive though seems broken and
     # I need to test it now without rewriting the entire store API.
-    await memory._with_cas(functools.partial(store.set_new_value, key, b"123"))
+    await memory._with_cas(key, functools.partial(store.set_new_value, key, b"123"))
     assert b"123" == await store.get(key)
     await memory._with_cas(
-        functools.partial(store.compare_and_set, key, b"999", b"123")
+        key, functools.partial(store.compare_and_set, key, b"999", b"123")
     )
     assert b"999" == await store.get(key)
+    assert memory.cas_stats.attempts == {"value": Counter({2: 2})}
+    assert memory.cas_stats.conflicts("value") == 2
+
+
+class RecordingPolicy(ImmediateRetry):
+    def __init__(self, max_attempts: int):
+        super().__init__(max_attempts)
+        self.calls: list[tuple[str, int]] = []
+
+    def delay(self, key: MemKey, attempt: int) -> float | None:
+        self.calls.append((key.type, attempt))
+        return super().delay(key, attempt)
+
+
+async def test_memory_cas_retry_limit() -> None:
+    policy = RecordingPolicy(3)
+    memory = Memory(InMemoryByteStore(), cas_retry=policy)
+    key = MemKey("pending_returns", "foo")
+
+    async def always_lose() -> None:
+        raise CompareMismatch()
+
+    with pytest.raises(Exception, match="exceeded CAS retry limit"):
+        await memory._with_cas(key, always_lose)
+
+    assert policy.calls == [
+        ("pending_returns", 1),
+        ("pending_returns", 2),
+        ("pending_returns", 3),
+    ]
+    assert memory.cas_stats.exhausted == Counter({"pending_returns": 1})
+    assert memory.cas_stats.conflicts("pending_returns") == 3
+    assert memory.cas_stats.operations("pending_returns") == 1
+
+
+class CountingStore(InMemoryByteStore):
+    gets: int = 0
+
+    async def get(self, key: MemKey) -> bytes:
+        self.gets += 1
+        return await super().get(key)
+
+
+async def test_memory_value_cache() -> None:
+    store = CountingStore()
+    memory = Memory(store, value_cache_bytes=10)
+
+    # Written values are cached straight away
+    await memory.set_value("a", b"123")
+    assert await memory.get_value("a") == b"123"
+    assert store.gets == 0
+
+    # Read values are cached after the first read
+    await store.set(MemKey("value", "b"), b"4567")
+    assert await memory.get_value("b") == b"4567"
+    assert await memory.get_value("b") == b"4567"
+    assert store.gets == 1
+    assert await memory.has_value("b")
+
+    # Evicted on size
+    await memory.set_value("c", b"8901")
+    assert await memory.get_value("a") == b"123"
+    assert store.gets == 2
+    assert (memory.value_cache.hits, memory.value_cache.misses) == (2, 2)
+
+
+async def test_memory_call_cache() -> None:
+    store = CountingStore()
+    memory = Memory(store, call_cache_size=2)
+    a, b, c = (Call(task_name="t", payload=x.encode(), call_hash=x) for x in "abc")
+
+    # Written calls are cached straight away
+    await memory.set_call(a)
+    assert await memory.get_call("a") == a
+    assert store.gets == 0
+
+    # Read calls are cached after the first read
+    # ...by another worker
+    await Memory(store).set_call(b)
+    assert await memory.get_call("b") == b
+    assert await memory.get_call("b") == b
+    assert store.gets == 1
+
+    # Evicted on count
+    await memory.set_calls([c])
+    assert await memory.get_call("c") == c
+    assert await memory.get_call("a") == a
+    assert store.gets == 2
+    assert (memory.call_cache.hits, memory.call_cache.misses) == (3, 2)
+
+
+async def test_memory_compression() -> None:
+    store = InMemoryByteStore()
+    memory = Memory(store, compression="zlib", compression_threshold=100)
+    payload = b"abc" * 100
+    call = Call(task_name="t", payload=payload, call_hash="a")
+
+    await memory.set_call(call)
+    await memory.set_value("a", payload)
+    await memory.set_value("b", b"short")
+    assert len(await store.get(MemKey("call", "a"))) < len(payload)
+    assert len(await store.get(MemKey("value", "a"))) < len(payload)
+    assert await store.get(MemKey("value", "b")) == b"short"
+
+    # Readable by any worker, with or without compression
+    for reader in (memory, Memory(store)):
+        assert await reader.get_call("a") == call
+        assert await reader.get_value("a") == payload
+        assert await reader.get_values(["a", "b"]) == {"a": payload, "b": b"short"}
+
+    # Uncompressed records are still readable when compression is on
+    await Memory(store).set_value("c", payload)
+    assert await memory.get_value("c") == payload
+
+
+class OpCountingStore(InMemoryByteStore):
+    def __init__(self, fused: bool):
+        super().__init__()
+        self.supports_set_and_compare_and_set = fused
+        self.ops: Counter[str] = Counter()
+
+    async def get(self, key: MemKey) -> bytes:
+        self.ops["get"] += 1
+        return await super().get(key)
+
+    async def set(self, key: MemKey, value: bytes) -> None:
+        self.ops["set"] += 1
+        return await super().set(key, value)
+
+    async def set_many(self, items):
+        self.ops["set_many"] += 1
+        return await super().set_many(items)
+
+    async def set_new_value(self, key: MemKey, value: bytes):
+        self.ops["set_new_value"] += 1
+        return await super().set_new_value(key, value)
+
+    async def compare_and_set(self, key: MemKey, value: bytes, expected: bytes):
+        self.ops["compare_and_set"] += 1
+        return await super().compare_and_set(key, value, expected)
+
+    async def set_and_compare_and_set(self, items, key, value, expected):
+        self.ops["set_and_compare_and_set"] += 1
+        return await super().set_and_compare_and_set(items, key, value, expected)
+
+
+@pytest.mark.parametrize("fused", [False, True])
+async def test_add_calls_with_pending_return(fused: bool) -> None:
+    store = OpCountingStore(fused)
+    memory = Memory(store)
+    calls = [
+        Call(task_name="t", payload=bytes([i]), call_hash=f"c{i}") for i in range(3)
+    ]
+    one = PendingReturn(root_id="root", call_hash="parent", topic="t")
+    two = PendingReturn(root_id="other", call_hash="parent", topic="t")
+
+    assert await memory.add_calls_with_pending_return(calls, one) == [True] * 3
+    # No need to look for existing pending returns first
+    if fused:
+        assert store.ops == {"set_and_compare_and_set": 3}
+    else:
+        assert store.ops == {"set_many": 1, "get": 3, "set_new_value": 3}
+    for call in calls:
+        assert await memory.get_call(call.call_hash) == call
+
+    # Existing pending returns: same root is not rescheduled, a different one is
+    store.ops.clear()
+    assert await memory.add_calls_with_pending_return(calls[:1], one) == [False]
+    assert await memory.add_calls_with_pending_return(calls[1:], two) == [True] * 2
+    # Known to exist: no guessing, straight to the compare-and-set
+    if fused:
+        assert store.ops == {"set_and_compare_and_set": 3, "get": 3}
+    else:
+        assert store.ops == {"set_many": 2, "get": 3, "compare_and_set": 3}
+
+    async def body(returns) -> None:
+        assert set(returns) == {one, two}
+
+    await memory.with_pending_returns_remove("c2", body)
 
 
 @pytest.mark.parametrize(
@@ -75,3 +258,57 @@ async def test_encode_decode_mixed_cases(scheduled_at: int, returns: set[str]) -
     assert decoded == pending_returns
     assert decoded.scheduled_at == pending_returns.scheduled_at
     assert decoded.returns == pending_returns.returns
+
+
+@pytest.mark.parametrize("fused", [False, True])
+async def test_known_calls_not_rewritten(fused: bool) -> None:
+    store = OpCountingStore(fused)
+    memory = Memory(store, call_cache_size=10)
+    calls = [
+        Call(task_name="t", payload=bytes([i]), call_hash=f"c{i}") for i in range(3)
+    ]
+    one = PendingReturn(root_id="root", call_hash="parent", topic="t")
+
+    await memory.add_calls_with_pending_return(calls, one)
+    writes = store.ops["set_many"] + store.ops["set_and_compare_and_set"]
+    assert writes == (3 if fused else 1)
+
+    # A replay only touches the pending returns
+    store.ops.clear()
+    assert await memory.add_calls_with_pending_return(calls, one) == [False] * 3
+    assert "set_many" not in store.ops
+    if fused:
+        assert store.ops == {"set_and_compare_and_set": 3, "get": 3}
+    else:
+        assert store.ops == {"get": 3, "compare_and_set": 3}
+
+    # Top-level calls too
+    await memory.set_call(calls[0])
+    assert "set" not in store.ops
+
+
+async def test_replay_on_another_worker() -> None:
+    store = OpCountingStore(True)
+    calls = [
+        Call(task_name="t", payload=bytes([i]), call_hash=f"c{i}") for i in range(3)
+    ]
+    one = PendingReturn(root_id="root", call_hash="parent", topic="t")
+    await Memory(store).add_calls_with_pending_return(calls, one)
+
+    # Nothing to go by: guess they're new, which costs a failed write each
+    store.ops.clear()
+    memory = Memory(store)
+    assert await memory.add_calls_with_pending_return(calls, one) == [False] * 3
+    assert store.ops == {"set_and_compare_and_set": 6, "get": 3}
+
+    # But only once
+    store.ops.clear()
+    assert await memory.add_calls_with_pending_return(calls, one) == [False] * 3
+    assert store.ops == {"set_and_compare_and_set": 3, "get": 3}
+
+
+def test_prefix_end() -> None:
+    assert prefix_end(b"ab") == b"ac"
+    assert prefix_end(b"a\xff\xff") == b"b"
+    assert prefix_end(b"\xff") is None
+    assert prefix_end(b"") is None
@@ -0,0 +1,70 @@
+import bencodepy
+import pytest
+from brrr import wire
+from brrr.store import PendingReturns
+from brrr.tagged_tuple import PendingReturn, ScheduleMessage
+
+_bc = bencodepy.Bencode(encoding="utf-8")
+
+STRINGS = ["", "a", "root-id", "ünïcödé ✓", "x" * 1000, "with:colon e"]
+
+
+@pytest.mark.parametrize("s", STRINGS)
+def test_tagged(s: str) -> None:
+    msg = ScheduleMessage(root_id=s, call_hash="hash")
+    enc = msg.encode()
+    assert enc == _bc.encode((2, s, "hash"))
+    assert ScheduleMessage.decode(enc) == msg
+
+
+@pytest.mark.parametrize("scheduled_at", [None, 0, 1700000000])
+@pytest.mark.parametrize("n", [0, 1, 3])
+def test_pending_returns(scheduled_at: int | None, n: int) -> None:
+    returns = {
+        PendingReturn(s, f"hash-{i}", "topic") for i, s in enumerate(STRINGS[:n])
+    }
+    prs = PendingReturns(scheduled_at, returns)
+    enc = prs.encode()
+    assert enc == _bc.encode(
+        {
+            "returns": sorted(x.astuple() for x in returns),
+            **({"scheduled_at": scheduled_at} if scheduled_at else {}),
+        }
+    )
+    decoded = PendingReturns.decode(enc)
+    assert decoded.scheduled_at == (scheduled_at or None)
+    assert decoded.returns == returns
+
+
+@pytest.mark.parametrize("task_name", STRINGS)
+@pytest.mark.parametrize("payload", [b"", b"payload", bytes(range(256)) * 10])
+def test_call(task_name: str, payload: bytes) -> None:
+    enc = wire.encode_call(task_name, payload)
+    assert enc == bencodepy.encode(
+        {b"task_name": task_name.encode("utf-8"), b"payload": payload}
+    )
+    assert wire.decode_call(enc) == (task_name, payload)
+
+
+def test_fallback() -> None:
+    # Valid bencode, just not what brrr itself writes
+    assert wire.decode_tagged(_bc.encode([2, "a", ["b"]])) == (2, "a", ["b"])
+    assert wire.decode_pending_returns(
+        _bc.encode({"returns": [], "scheduled_at": -1})
+    ) == (-1, [])
+    assert wire.decode_call(
+        bencodepy.encode({b"task_name": b"t", b"payload": b"p", b"extra": 1})
+    ) == ("t", b"p")
+
+
+@pytest.mark.parametrize(
+    "enc", [b"", b"li2e", b"li2e5:abce", b"li2e3:abcee", b"x", b"d7:returnsl"]
+)
+def test_malformed(enc: bytes) -> None:
+    # Left to bencodepy, which fails just like it did before the fast path
+    with pytest.raises(bencodepy.BencodeDecodeError, match="bencoded"):
+        ScheduleMessage.decode(enc)
+    with pytest.raises(bencodepy.BencodeDecodeError, match="bencoded"):
+        PendingReturns.decode(enc)
+    with pytest.raises(bencodepy.BencodeDecodeError, match="bencoded"):
+        wire.decode_call(enc)